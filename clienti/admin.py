@@ -1,12 +1,17 @@
 from django.contrib import admin
-from django.core.mail import send_mail
-from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from negozio_cucine.changelist import ChangelistScalabileMixin
+from notifiche import outbox
+from . import promemoria, ricerca
 from .models import Cliente, Appuntamento
 
 @admin.register(Cliente)
-class ClienteAdmin(admin.ModelAdmin):
+class ClienteAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
     list_display = ['cognome', 'nome', 'email', 'telefono', 'citta', 'data_registrazione']
     search_fields = ['nome', 'cognome', 'email', 'telefono']
+    # Prefissi e trigrammi indicizzati, anche per l'autocompletamento dei preventivi
+    ricerca_indicizzata = staticmethod(ricerca.cerca_ids)
     list_filter = ['citta', 'data_registrazione']
     fieldsets = (
         ('Informazioni Personali', {
@@ -21,7 +26,7 @@ class ClienteAdmin(admin.ModelAdmin):
     )
 
 @admin.register(Appuntamento)
-class AppuntamentoAdmin(admin.ModelAdmin):
+class AppuntamentoAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
     list_display = ['cliente', 'data_ora', 'tipo_consulenza', 'stato']
     list_filter = ['stato', 'tipo_consulenza', 'data_ora']
     search_fields = ['cliente__nome', 'cliente__cognome', 'note']
@@ -41,27 +46,35 @@ class AppuntamentoAdmin(admin.ModelAdmin):
     
     @admin.action(description='Conferma appuntamenti selezionati')
     def conferma_appuntamenti(self, request, queryset):
-        updated = queryset.filter(stato='RICHIESTO').update(stato='CONFERMATO')
-        for appuntamento in queryset.filter(stato='CONFERMATO'):
-            self._invia_email_conferma(appuntamento)
-        self.message_user(request, f'{updated} appuntamenti confermati.')
+        # Email solo per gli appuntamenti che hanno cambiato stato, non per
+        # quelli già confermati; i clienti arrivano con una sola JOIN e il
+        # worker dell'outbox spedisce il blocco su un'unica connessione
+        with transaction.atomic():
+            ids = queryset.conferma()
+            confermati = Appuntamento.objects.filter(pk__in=ids).select_related('cliente').only(
+                'data_ora', 'tipo_consulenza', 'cliente__nome', 'cliente__cognome', 'cliente__email'
+            )
+            outbox.accoda_in_blocco(self._email_conferma(appuntamento) for appuntamento in confermati)
+        self.message_user(request, f'{len(ids)} appuntamenti confermati.')
     
     @admin.action(description='Invia promemoria email')
     def invia_promemoria(self, request, queryset):
-        count = 0
-        for appuntamento in queryset.filter(stato='CONFERMATO'):
-            self._invia_email_promemoria(appuntamento)
-            count += 1
+        messaggi = [
+            self._email_promemoria(appuntamento)
+            for appuntamento in queryset.filter(stato='CONFERMATO').select_related('cliente')
+        ]
+        outbox.accoda_in_blocco(messaggi)
+        count = len(messaggi)
         self.message_user(request, f'Promemoria inviati per {count} appuntamenti.')
     
-    def _invia_email_conferma(self, appuntamento):
+    def _email_conferma(self, appuntamento):
         subject = 'Conferma Appuntamento - Negozio Cucine'
         message = f"""
         Gentile {appuntamento.cliente.get_nome_completo()},
         
         Il suo appuntamento è stato confermato:
         
-        Data e Ora: {appuntamento.data_ora.strftime('%d/%m/%Y alle %H:%M')}
+        Data e Ora: {timezone.localtime(appuntamento.data_ora).strftime('%d/%m/%Y alle %H:%M')}
         Tipo: {appuntamento.get_tipo_consulenza_display()}
         
         La aspettiamo presso il nostro showroom.
@@ -69,31 +82,8 @@ class AppuntamentoAdmin(admin.ModelAdmin):
         Cordiali saluti,
         Negozio Cucine
         """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [appuntamento.cliente.email],
-            fail_silently=True,
-        )
+        return outbox.nuovo_messaggio(subject, message, [appuntamento.cliente.email])
     
-    def _invia_email_promemoria(self, appuntamento):
-        subject = 'Promemoria Appuntamento - Negozio Cucine'
-        message = f"""
-        Gentile {appuntamento.cliente.get_nome_completo()},
-        
-        Le ricordiamo il suo appuntamento:
-        
-        Data e Ora: {appuntamento.data_ora.strftime('%d/%m/%Y alle %H:%M')}
-        Tipo: {appuntamento.get_tipo_consulenza_display()}
-        
-        A presto,
-        Negozio Cucine
-        """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [appuntamento.cliente.email],
-            fail_silently=True,
-        )
+    def _email_promemoria(self, appuntamento):
+        # Stesso testo dei promemoria automatici
+        return promemoria.messaggio(appuntamento)
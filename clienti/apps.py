@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ClientiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clienti'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,137 @@
+"""
+Feed iCalendar (.ics) degli appuntamenti, per i calendari dello staff.
+
+Il feed è protetto da APPUNTAMENTI_FEED_TOKEN, che fa parte dell'URL di
+sottoscrizione, e può essere filtrato per stato e tipo di consulenza
+(?stato=CONFERMATO&stato=RICHIESTO&tipo=RILIEVO). Senza filtro di stato
+contiene gli appuntamenti attivi, dagli ultimi GIORNI_PASSATI giorni in
+poi.
+
+Il documento viene generato riga per riga da un iterator() a blocchi
+sull'indice di data_ora, con il cliente in JOIN: la memoria usata non
+dipende dal numero di appuntamenti. I calendari ricontrollano il feed ogni
+pochi minuti: l'ETag è calcolato da una sola query di aggregazione
+(ultimo data_aggiornamento di appuntamenti e clienti e numero di
+appuntamenti del feed), e se non è cambiato la risposta è un 304 senza
+corpo.
+"""
+import hashlib
+from datetime import timedelta, timezone as fuso_orario
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import disponibilita
+from .models import Appuntamento
+
+GIORNI_PASSATI = 30
+DIMENSIONE_BLOCCO = 500
+# Intervallo di aggiornamento suggerito ai calendari
+AGGIORNAMENTO = 'PT15M'
+
+STATI_ICS = {
+    'RICHIESTO': 'TENTATIVE',
+    'CONFERMATO': 'CONFIRMED',
+    'COMPLETATO': 'CONFIRMED',
+    'ANNULLATO': 'CANCELLED',
+}
+
+
+def seleziona(stati=(), tipi=(), adesso=None):
+    """Appuntamenti del feed: senza `stati`, quelli attivi."""
+    adesso = adesso or timezone.now()
+    appuntamenti = Appuntamento.objects.filter(data_ora__gte=adesso - timedelta(days=GIORNI_PASSATI))
+    appuntamenti = appuntamenti.filter(stato__in=stati) if stati else appuntamenti.attivi()
+    if tipi:
+        appuntamenti = appuntamenti.filter(tipo_consulenza__in=tipi)
+    return appuntamenti
+
+
+def etag(appuntamenti, *filtri):
+    """ETag del feed. Gli eventi riportano nome, email e telefono del
+    cliente: conta anche il suo data_aggiornamento. Il numero di
+    appuntamenti coglie le eliminazioni e le uscite dal feed, che non
+    lasciano un data_aggiornamento."""
+    valori = appuntamenti.order_by().aggregate(
+        ultimo=Max('data_aggiornamento'),
+        ultimo_cliente=Max('cliente__data_aggiornamento'),
+        numero=Count('pk'),
+    )
+    impronta = '|'.join(str(valore) for valore in (
+        valori['ultimo'], valori['ultimo_cliente'], valori['numero'], *filtri
+    ))
+    return f'"{hashlib.md5(impronta.encode()).hexdigest()}"'
+
+
+def _data_utc(valore):
+    return valore.astimezone(fuso_orario.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _testo(valore):
+    return (
+        str(valore).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+    )
+
+
+def _riga(nome, valore):
+    """Riga del contenuto con ripiegamento a 75 ottetti (RFC 5545 §3.1)."""
+    riga = f'{nome}:{valore}'.encode()
+    parti = []
+    limite = 75
+    while len(riga) > limite:
+        taglio = limite
+        # Non spezzare un carattere UTF-8 a metà
+        while riga[taglio] & 0xC0 == 0x80:
+            taglio -= 1
+        parti.append(riga[:taglio])
+        riga = riga[taglio:]
+        # Le righe di continuazione iniziano con uno spazio
+        limite = 74
+    parti.append(riga)
+    return b'\r\n '.join(parti).decode() + '\r\n'
+
+
+def evento(appuntamento, dominio):
+    cliente = appuntamento.cliente
+    descrizione = [f'Telefono: {cliente.telefono}', f'Email: {cliente.email}']
+    if appuntamento.note:
+        descrizione.append(appuntamento.note)
+    modificato = max(appuntamento.data_aggiornamento, cliente.data_aggiornamento)
+    return ''.join([
+        'BEGIN:VEVENT\r\n',
+        _riga('UID', f'appuntamento-{appuntamento.pk}@{dominio}'),
+        _riga('DTSTAMP', _data_utc(modificato)),
+        _riga('LAST-MODIFIED', _data_utc(modificato)),
+        _riga('DTSTART', _data_utc(appuntamento.data_ora)),
+        _riga('DTEND', _data_utc(
+            appuntamento.data_ora + disponibilita.durata(appuntamento.tipo_consulenza)
+        )),
+        _riga('SUMMARY', _testo(
+            f'{appuntamento.get_tipo_consulenza_display()} - {cliente.get_nome_completo()}'
+        )),
+        _riga('DESCRIPTION', _testo('\n'.join(descrizione))),
+        _riga('STATUS', STATI_ICS[appuntamento.stato]),
+        'END:VEVENT\r\n',
+    ])
+
+
+def flusso(appuntamenti, dominio, nome='Appuntamenti showroom'):
+    """Il documento .ics un evento alla volta, per StreamingHttpResponse."""
+    yield ''.join([
+        'BEGIN:VCALENDAR\r\n',
+        'VERSION:2.0\r\n',
+        'PRODID:-//Negozio Cucine//Agenda showroom//IT\r\n',
+        'CALSCALE:GREGORIAN\r\n',
+        _riga('X-WR-CALNAME', _testo(nome)),
+        _riga('REFRESH-INTERVAL;VALUE=DURATION', AGGIORNAMENTO),
+        _riga('X-PUBLISHED-TTL', AGGIORNAMENTO),
+    ])
+    righe = appuntamenti.select_related('cliente').only(
+        'data_ora', 'tipo_consulenza', 'stato', 'note', 'data_aggiornamento',
+        'cliente__nome', 'cliente__cognome', 'cliente__email', 'cliente__telefono',
+        'cliente__data_aggiornamento',
+    ).order_by('data_ora', 'pk')
+    for appuntamento in righe.iterator(chunk_size=DIMENSIONE_BLOCCO):
+        yield evento(appuntamento, dominio)
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,86 @@
+"""
+Ricerca e unione dei clienti duplicati.
+
+I clienti vengono letti una volta sola, in streaming, e raggruppati per
+chiavi di blocco (vedi identita.py); i gruppi di duplicati si uniscono nel
+cliente più vecchio. Gli appuntamenti, i preventivi e ogni altra riga che
+punta ai duplicati vengono riassegnati con un UPDATE per modello e per
+blocco di gruppi, poi i duplicati vengono eliminati.
+"""
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from . import identita, ricerca
+from .models import Cliente
+
+DIMENSIONE_BLOCCO = 200
+# Campi del cliente superstite completati con quelli dei duplicati, se vuoti
+CAMPI_COMPLETABILI = ('telefono', 'indirizzo', 'citta', 'cap')
+
+
+def schede():
+    righe = Cliente.objects.order_by().values_list(
+        'pk', 'nome', 'cognome', 'cap', 'telefono_normalizzato', 'email'
+    )
+    return (identita.Scheda(*riga) for riga in righe.iterator(chunk_size=2000))
+
+
+def trova_duplicati():
+    """Gruppi di pk di clienti probabilmente duplicati, il più vecchio per primo."""
+    return identita.gruppi_duplicati(schede())
+
+
+def _riassegna(sostituti):
+    """Sposta sui superstiti le righe collegate ai duplicati;
+    `sostituti` è {pk duplicato: pk superstite}."""
+    for relazione in Cliente._meta.related_objects:
+        if not relazione.one_to_many:
+            continue
+        colonna = relazione.field.attname
+        relazione.related_model._default_manager.filter(
+            **{f'{colonna}__in': list(sostituti)}
+        ).update(**{colonna: Case(
+            *[When(**{colonna: duplicato}, then=Value(superstite))
+              for duplicato, superstite in sostituti.items()]
+        )})
+
+
+def _unisci_blocco(gruppi):
+    clienti = Cliente.objects.select_for_update().in_bulk([pk for gruppo in gruppi for pk in gruppo])
+    sostituti = {}
+    superstiti = []
+    for gruppo in gruppi:
+        presenti = [clienti[pk] for pk in gruppo if pk in clienti]
+        if len(presenti) < 2:
+            continue
+        superstite, *duplicati = presenti
+        for duplicato in duplicati:
+            for campo in CAMPI_COMPLETABILI:
+                if not getattr(superstite, campo):
+                    setattr(superstite, campo, getattr(duplicato, campo))
+            if duplicato.note:
+                superstite.note = '\n'.join(filter(None, [superstite.note, duplicato.note]))
+            sostituti[duplicato.pk] = superstite.pk
+        superstite.aggiorna_chiavi()
+        superstiti.append(superstite)
+    if not sostituti:
+        return 0
+    _riassegna(sostituti)
+    # Prima l'eliminazione: la chiave email di un duplicato può essere
+    # quella che il superstite deve ricevere
+    Cliente.objects.filter(pk__in=list(sostituti)).delete()
+    Cliente.objects.bulk_update(
+        superstiti, [*CAMPI_COMPLETABILI, 'note', 'email_normalizzata', 'telefono_normalizzato']
+    )
+    ricerca.indicizza(superstiti)
+    return len(sostituti)
+
+
+def unisci(gruppi, dimensione=DIMENSIONE_BLOCCO):
+    """Unisce ogni gruppo nel suo primo cliente; restituisce il numero di
+    clienti eliminati. Ogni blocco di gruppi è una transazione."""
+    uniti = 0
+    for inizio in range(0, len(gruppi), dimensione):
+        with transaction.atomic():
+            uniti += _unisci_blocco(gruppi[inizio:inizio + dimensione])
+    return uniti
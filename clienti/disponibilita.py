@@ -0,0 +1,173 @@
+"""
+Disponibilità degli appuntamenti in showroom.
+
+Le fasce di apertura, la durata di ogni tipo di consulenza e il numero di
+appuntamenti seguiti in contemporanea sono nelle impostazioni
+APPUNTAMENTI_*. Un appuntamento occupa l'intervallo
+[data_ora, data_ora + durata del suo tipo); quelli annullati non occupano
+nulla.
+
+Gli orari liberi di un intervallo di date si calcolano con una sola query
+(gli appuntamenti attivi che possono sovrapporsi, sull'indice parziale
+appuntamento_attivo_idx) e una scansione in memoria: gli inizi e le fine
+degli appuntamenti diventano una sequenza di livelli di occupazione, e
+ogni orario candidato è libero se il livello massimo che attraversa resta
+sotto la capacità.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Appuntamento, GiornataAgenda
+
+Slot = namedtuple('Slot', 'inizio fine liberi')
+
+# Giorni richiedibili in una volta all'endpoint degli orari liberi
+GIORNI_MASSIMI = 31
+
+
+def orari():
+    return getattr(settings, 'APPUNTAMENTI_ORARI', {})
+
+
+def capacita():
+    return getattr(settings, 'APPUNTAMENTI_CAPACITA', 1)
+
+
+def durata(tipo):
+    durate = getattr(settings, 'APPUNTAMENTI_DURATE', {})
+    return timedelta(minutes=durate.get(tipo, 60))
+
+
+def durata_massima():
+    durate = getattr(settings, 'APPUNTAMENTI_DURATE', {})
+    return timedelta(minutes=max(durate.values(), default=60))
+
+
+def _ora(testo):
+    return time.fromisoformat(testo)
+
+
+def fasce(giorno):
+    """Fasce di apertura del giorno come (inizio, fine) nel fuso locale."""
+    fuso = timezone.get_current_timezone()
+    return [
+        (
+            timezone.make_aware(datetime.combine(giorno, _ora(inizio)), fuso),
+            timezone.make_aware(datetime.combine(giorno, _ora(fine)), fuso),
+        )
+        for inizio, fine in orari().get(giorno.weekday(), [])
+    ]
+
+
+def occupati(inizio, fine, escludi=None):
+    """Intervalli (inizio, fine) degli appuntamenti attivi che si
+    sovrappongono a [inizio, fine), letti con una query."""
+    appuntamenti = Appuntamento.objects.attivi().filter(
+        data_ora__lt=fine, data_ora__gt=inizio - durata_massima()
+    )
+    if escludi is not None:
+        appuntamenti = appuntamenti.exclude(pk=escludi)
+    intervalli = []
+    for data_ora, tipo in appuntamenti.values_list('data_ora', 'tipo_consulenza'):
+        termine = data_ora + durata(tipo)
+        if termine > inizio:
+            intervalli.append((data_ora, termine))
+    return intervalli
+
+
+def livelli(intervalli):
+    """Occupazione come sequenza ordinata di (istante, appuntamenti in
+    corso da quell'istante al successivo)."""
+    variazioni = {}
+    for inizio, fine in intervalli:
+        variazioni[inizio] = variazioni.get(inizio, 0) + 1
+        variazioni[fine] = variazioni.get(fine, 0) - 1
+    sequenza = []
+    in_corso = 0
+    for istante in sorted(variazioni):
+        in_corso += variazioni[istante]
+        sequenza.append((istante, in_corso))
+    return sequenza
+
+
+def massimo_occupati(sequenza, istanti, inizio, fine):
+    """Livello massimo di `sequenza` nell'intervallo [inizio, fine);
+    `istanti` sono i primi elementi di `sequenza`, per la ricerca binaria."""
+    indice = bisect_right(istanti, inizio) - 1
+    massimo = sequenza[indice][1] if indice >= 0 else 0
+    indice += 1
+    while indice < len(sequenza) and sequenza[indice][0] < fine:
+        massimo = max(massimo, sequenza[indice][1])
+        indice += 1
+    return massimo
+
+
+def candidati(dal, al, tipo, dopo=None):
+    """Orari di inizio proposti tra le date `dal` e `al` incluse: ogni
+    APPUNTAMENTI_PASSO minuti dall'apertura, se l'appuntamento finisce
+    entro la fascia."""
+    passo = timedelta(minutes=getattr(settings, 'APPUNTAMENTI_PASSO', 30))
+    lunghezza = durata(tipo)
+    giorno = dal
+    while giorno <= al:
+        for apertura, chiusura in fasce(giorno):
+            inizio = apertura
+            while inizio + lunghezza <= chiusura:
+                if dopo is None or inizio >= dopo:
+                    yield inizio, inizio + lunghezza
+                inizio += passo
+        giorno += timedelta(days=1)
+
+
+def inizio_prenotabile(adesso=None):
+    preavviso = timedelta(minutes=getattr(settings, 'APPUNTAMENTI_PREAVVISO', 0))
+    return (adesso or timezone.now()) + preavviso
+
+
+def slot_liberi(dal, al, tipo, adesso=None):
+    """Slot con almeno un posto libero tra le date `dal` e `al` incluse."""
+    proposti = list(candidati(dal, al, tipo, dopo=inizio_prenotabile(adesso)))
+    if not proposti:
+        return []
+    sequenza = livelli(occupati(proposti[0][0], proposti[-1][1]))
+    istanti = [istante for istante, _ in sequenza]
+    posti = capacita()
+    liberi = []
+    for inizio, fine in proposti:
+        disponibili = posti - massimo_occupati(sequenza, istanti, inizio, fine)
+        if disponibili > 0:
+            liberi.append(Slot(inizio, fine, disponibili))
+    return liberi
+
+
+def verifica(data_ora, tipo, escludi=None, adesso=None):
+    """Solleva ValidationError se l'appuntamento non può essere fissato:
+    fuori orario, con preavviso insufficiente o senza posti liberi."""
+    data_ora = timezone.localtime(data_ora)
+    fine = data_ora + durata(tipo)
+    if data_ora < inizio_prenotabile(adesso):
+        raise ValidationError("L'orario scelto non è più prenotabile online.")
+    if not any(apertura <= data_ora and fine <= chiusura for apertura, chiusura in fasce(data_ora.date())):
+        raise ValidationError("Lo showroom è chiuso nell'orario scelto.")
+    sequenza = livelli(occupati(data_ora, fine, escludi=escludi))
+    occupazione = massimo_occupati(sequenza, [istante for istante, _ in sequenza], data_ora, fine)
+    if occupazione >= capacita():
+        raise ValidationError("L'orario scelto non è più disponibile: scegline un altro.")
+
+
+def prenota(appuntamento):
+    """Salva l'appuntamento se l'orario è ancora libero. La riga del giorno
+    in GiornataAgenda resta bloccata fino alla fine della transazione: due
+    prenotazioni concorrenti dello stesso giorno vengono verificate una
+    dopo l'altra e non possono occupare entrambe l'ultimo posto."""
+    with transaction.atomic():
+        GiornataAgenda.blocca(timezone.localdate(appuntamento.data_ora))
+        verifica(appuntamento.data_ora, appuntamento.tipo_consulenza, escludi=appuntamento.pk)
+        appuntamento.save()
+    return appuntamento
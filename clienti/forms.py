@@ -1,6 +1,7 @@
 from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column, Field
+from . import disponibilita
 from .models import Appuntamento, Cliente
 
 class AppuntamentoForm(forms.ModelForm):
@@ -44,17 +45,28 @@ class AppuntamentoForm(forms.ModelForm):
             Submit('submit', 'Prenota Appuntamento', css_class='btn btn-primary btn-lg')
         )
     
+    def clean(self):
+        cleaned_data = super().clean()
+        data_ora = cleaned_data.get('data_ora')
+        tipo = cleaned_data.get('tipo_consulenza')
+        if data_ora and tipo:
+            try:
+                disponibilita.verifica(data_ora, tipo)
+            except forms.ValidationError as e:
+                self.add_error('data_ora', e)
+        return cleaned_data
+    
     def save(self, commit=True):
-        cliente, created = Cliente.objects.get_or_create(
-            email=self.cleaned_data['email'],
-            defaults={
-                'nome': self.cleaned_data['nome'],
-                'cognome': self.cleaned_data['cognome'],
-                'telefono': self.cleaned_data['telefono'],
-            }
+        cliente, created = Cliente.objects.registra(
+            self.cleaned_data['email'],
+            nome=self.cleaned_data['nome'],
+            cognome=self.cleaned_data['cognome'],
+            telefono=self.cleaned_data['telefono'],
         )
         appuntamento = super().save(commit=False)
         appuntamento.cliente = cliente
         if commit:
-            appuntamento.save()
+            # Verifica di nuovo i posti con il giorno bloccato: solleva
+            # ValidationError se l'ultimo posto è stato appena occupato
+            disponibilita.prenota(appuntamento)
         return appuntamento
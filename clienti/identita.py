@@ -0,0 +1,105 @@
+"""
+Chiavi normalizzate per riconoscere lo stesso cliente.
+
+- email: senza spazi e in minuscolo ("Mario.Rossi@X.it" e
+  "mario.rossi@x.it" sono lo stesso indirizzo);
+- telefono: formato E.164 ("+393331234567"), con il prefisso italiano per
+  i numeri scritti senza prefisso internazionale;
+- nomi: minuscoli, senza accenti, spazi e apostrofi, usati solo come
+  chiavi di blocco per la ricerca dei duplicati.
+
+La ricerca dei duplicati non confronta ogni cliente con tutti gli altri:
+raggruppa i clienti per chiavi di blocco (email, telefono, cognome + CAP)
+e confronta solo i clienti dello stesso gruppo.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+PREFISSO_PREDEFINITO = '39'
+
+
+def normalizza_email(email):
+    return (email or '').strip().lower()
+
+
+def normalizza_telefono(telefono, prefisso=PREFISSO_PREDEFINITO):
+    """Numero in formato E.164, o '' se non è un numero valido."""
+    cifre = re.sub(r'[\s\-./()]', '', telefono or '')
+    if cifre.startswith('00'):
+        cifre = '+' + cifre[2:]
+    numero = cifre[1:] if cifre.startswith('+') else prefisso + cifre
+    if not numero.isdigit() or not 8 <= len(numero) <= 15:
+        return ''
+    return '+' + numero
+
+
+def normalizza_nome(nome):
+    testo = unicodedata.normalize('NFKD', nome or '')
+    return ''.join(c for c in testo.lower() if c.isalpha())
+
+
+class Scheda:
+    """Dati di un cliente usati per il confronto."""
+
+    __slots__ = ('pk', 'nome', 'cognome', 'cap', 'telefono', 'email')
+
+    def __init__(self, pk, nome, cognome, cap, telefono, email):
+        self.pk = pk
+        self.nome = normalizza_nome(nome)
+        self.cognome = normalizza_nome(cognome)
+        self.cap = (cap or '').strip()
+        self.telefono = telefono
+        self.email = normalizza_email(email)
+
+    def chiavi_di_blocco(self):
+        chiavi = [('email', self.email)]
+        if self.telefono:
+            chiavi.append(('telefono', self.telefono))
+        if self.cognome and self.cap:
+            chiavi.append(('cognome_cap', self.cognome, self.cap))
+        return chiavi
+
+
+def probabili_duplicati(a, b):
+    if a.email == b.email:
+        return True
+    # Stesso telefono o stesso cognome e CAP non bastano: in una famiglia
+    # sono comuni a più persone
+    if a.nome != b.nome:
+        return False
+    return a.telefono == b.telefono or (a.cognome, a.cap) == (b.cognome, b.cap)
+
+
+def gruppi_duplicati(schede):
+    """Gruppi di pk di clienti probabilmente duplicati, ciascuno ordinato
+    per pk. I confronti avvengono solo dentro i blocchi."""
+    blocchi = defaultdict(list)
+    for scheda in schede:
+        for chiave in scheda.chiavi_di_blocco():
+            blocchi[chiave].append(scheda)
+
+    # Union-find sui pk: un duplicato di un duplicato finisce nello stesso gruppo
+    genitore = {}
+
+    def radice(pk):
+        while genitore.get(pk, pk) != pk:
+            genitore[pk] = genitore.get(genitore[pk], genitore[pk])
+            pk = genitore[pk]
+        return pk
+
+    for blocco in blocchi.values():
+        for i, a in enumerate(blocco):
+            for b in blocco[i + 1:]:
+                if probabili_duplicati(a, b):
+                    ra, rb = radice(a.pk), radice(b.pk)
+                    if ra != rb:
+                        genitore[max(ra, rb)] = min(ra, rb)
+
+    gruppi = defaultdict(list)
+    for pk in genitore:
+        gruppi[radice(pk)].append(pk)
+    for pk in list(gruppi):
+        if pk not in gruppi[pk]:
+            gruppi[pk].append(pk)
+    return sorted(sorted(set(pks)) for pks in gruppi.values())
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from clienti import deduplica
+from clienti.models import Cliente
+
+
+class Command(BaseCommand):
+    help = 'Trova i clienti probabilmente duplicati e li unisce nel cliente registrato per primo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocco',
+            type=int,
+            default=deduplica.DIMENSIONE_BLOCCO,
+            help=f'Gruppi di duplicati uniti per transazione (default {deduplica.DIMENSIONE_BLOCCO})',
+        )
+        parser.add_argument(
+            '--solo-verifica',
+            action='store_true',
+            help='Elenca i gruppi di duplicati senza unirli',
+        )
+
+    def handle(self, *args, **options):
+        gruppi = deduplica.trova_duplicati()
+        if not gruppi:
+            self.stdout.write(self.style.SUCCESS('Nessun cliente duplicato'))
+            return
+
+        if options['solo_verifica'] or options['verbosity'] > 1:
+            clienti = Cliente.objects.only('nome', 'cognome', 'email').in_bulk(
+                [pk for gruppo in gruppi for pk in gruppo]
+            )
+            for gruppo in gruppi:
+                self.stdout.write(' = '.join(
+                    f'#{pk} {clienti[pk]} <{clienti[pk].email}>' for pk in gruppo
+                ))
+
+        duplicati = sum(len(gruppo) - 1 for gruppo in gruppi)
+        if options['solo_verifica']:
+            self.stdout.write(self.style.WARNING(
+                f'{len(gruppi)} gruppi di duplicati, {duplicati} clienti da unire'
+            ))
+            return
+
+        uniti = deduplica.unisci(gruppi, dimensione=options['blocco'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{uniti} clienti duplicati uniti in {len(gruppi)} clienti'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from clienti import promemoria
+from notifiche import outbox
+
+
+class Command(BaseCommand):
+    help = 'Mette in coda i promemoria degli appuntamenti confermati entrati in una finestra di promemoria'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocco',
+            type=int,
+            default=promemoria.DIMENSIONE_BLOCCO,
+            help=f'Appuntamenti elaborati per transazione (default {promemoria.DIMENSIONE_BLOCCO})',
+        )
+        parser.add_argument(
+            '--invia',
+            action='store_true',
+            help='Spedisce subito le email in coda invece di lasciarle al comando invia_email',
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Resta in esecuzione e controlla gli appuntamenti a intervalli regolari',
+        )
+        parser.add_argument(
+            '--intervallo',
+            type=float,
+            default=300,
+            help='Secondi di attesa fra un controllo e il successivo (default 300)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            accodati = promemoria.accoda_promemoria(dimensione=options['blocco'])
+            totale = sum(accodati.values())
+            if totale or not options['continuo']:
+                dettaglio = ', '.join(
+                    f'{numero} a {finestra // 60}h' if finestra % 60 == 0 else f'{numero} a {finestra} min'
+                    for finestra, numero in sorted(accodati.items(), reverse=True)
+                )
+                self.stdout.write(f'{totale} promemoria in coda ({dettaglio})')
+            if totale and options['invia']:
+                inviati, falliti = outbox.svuota_coda()
+                self.stdout.write(f'{inviati} email inviate, {falliti} non riuscite')
+            if not options['continuo']:
+                return
+            close_old_connections()
+            time.sleep(options['intervallo'])
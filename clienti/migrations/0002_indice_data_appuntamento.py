@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appuntamento',
+            name='data_ora',
+            field=models.DateTimeField(db_index=True, verbose_name='Data e Ora'),
+        ),
+    ]
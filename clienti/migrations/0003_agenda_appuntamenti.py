@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0002_indice_data_appuntamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GiornataAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('giorno', models.DateField(unique=True, verbose_name='Giorno')),
+                ('verifiche', models.PositiveIntegerField(default=0, verbose_name='Verifiche di disponibilità')),
+            ],
+            options={
+                'verbose_name': 'Giornata Agenda',
+                'verbose_name_plural': 'Giornate Agenda',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appuntamento',
+            index=models.Index(condition=models.Q(('stato', 'ANNULLATO'), _negated=True), fields=['data_ora'], name='appuntamento_attivo_idx'),
+        ),
+    ]
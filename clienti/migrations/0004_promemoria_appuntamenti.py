@@ -0,0 +1,27 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0003_agenda_appuntamenti'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuntamento',
+            name='promemoria_data_ora',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='appuntamento',
+            name='promemoria_minuti',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ultimo promemoria (minuti prima)'),
+        ),
+        migrations.AddIndex(
+            model_name='appuntamento',
+            index=models.Index(condition=models.Q(('stato', 'CONFERMATO')), fields=['data_ora'], name='appuntamento_confermato_idx'),
+        ),
+    ]
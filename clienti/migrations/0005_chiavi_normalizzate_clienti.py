@@ -0,0 +1,60 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:44
+
+import re
+
+from django.db import migrations, models
+
+# Copie di identita.normalizza_email e normalizza_telefono come erano a
+# questa migrazione: le migrazioni non dipendono dal codice corrente
+
+
+def normalizza_email(email):
+    return (email or '').strip().lower()
+
+
+def normalizza_telefono(telefono, prefisso='39'):
+    cifre = re.sub(r'[\s\-./()]', '', telefono or '')
+    if cifre.startswith('00'):
+        cifre = '+' + cifre[2:]
+    numero = cifre[1:] if cifre.startswith('+') else prefisso + cifre
+    if not numero.isdigit() or not 8 <= len(numero) <= 15:
+        return ''
+    return '+' + numero
+
+
+def popola_chiavi(apps, schema_editor):
+    Cliente = apps.get_model('clienti', 'Cliente')
+    viste = set()
+    clienti = []
+    for cliente in Cliente.objects.order_by('pk').only('email', 'telefono').iterator(chunk_size=2000):
+        email = normalizza_email(cliente.email)
+        # Solo il primo cliente di ogni email ottiene la chiave unica: gli
+        # altri restano senza finché deduplica_clienti non li unisce
+        cliente.email_normalizzata = email if email and email not in viste else None
+        cliente.telefono_normalizzato = normalizza_telefono(cliente.telefono)
+        viste.add(email)
+        clienti.append(cliente)
+    Cliente.objects.bulk_update(
+        clienti, ['email_normalizzata', 'telefono_normalizzato'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0004_promemoria_appuntamenti'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='email_normalizzata',
+            field=models.CharField(editable=False, max_length=254, null=True, verbose_name='Email normalizzata'),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='telefono_normalizzato',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16, verbose_name='Telefono E.164'),
+        ),
+        migrations.RunPython(popola_chiavi, migrations.RunPython.noop),
+    ]
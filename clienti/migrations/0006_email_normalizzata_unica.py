@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0005_chiavi_normalizzate_clienti'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cliente',
+            name='email_normalizzata',
+            field=models.CharField(editable=False, max_length=254, null=True, unique=True, verbose_name='Email normalizzata'),
+        ),
+    ]
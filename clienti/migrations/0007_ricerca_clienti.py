@@ -0,0 +1,98 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:48
+
+import unicodedata
+
+from django.db import migrations, models
+
+DIMENSIONE_BLOCCO = 500
+
+SQLITE_CREA = (
+    "CREATE VIRTUAL TABLE clienti_ricerca USING fts5(testo, tokenize='trigram')"
+)
+
+POSTGRESQL_CREA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE clienti_ricerca ("
+    "cliente_id bigint PRIMARY KEY REFERENCES clienti_cliente (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "testo text NOT NULL)",
+    "CREATE INDEX clienti_ricerca_testo_idx ON clienti_ricerca USING GIN (testo gin_trgm_ops)",
+]
+
+
+# Copie di identita.normalizza_nome e ricerca.normalizza/_testo come erano
+# a questa migrazione: le migrazioni non dipendono dal codice corrente
+
+
+def normalizza_nome(nome):
+    testo = unicodedata.normalize('NFKD', nome or '')
+    return ''.join(c for c in testo.lower() if c.isalpha())
+
+
+def normalizza(testo):
+    testo = unicodedata.normalize('NFKD', (testo or '').lower())
+    return ''.join(c for c in testo if not unicodedata.combining(c))
+
+
+def testo_ricerca(cliente):
+    return ' '.join(normalizza(campo) for campo in (
+        cliente.nome, cliente.cognome, cliente.email,
+        cliente.telefono_normalizzato.lstrip('+'), cliente.citta,
+    ) if campo)
+
+
+def crea_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREA)
+        inserisci = 'INSERT INTO clienti_ricerca (rowid, testo) VALUES (%s, %s)'
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_CREA:
+            schema_editor.execute(sql)
+        inserisci = 'INSERT INTO clienti_ricerca (cliente_id, testo) VALUES (%s, %s)'
+    else:
+        inserisci = None
+
+    Cliente = apps.get_model('clienti', 'Cliente')
+    ultimo_pk = 0
+    while True:
+        blocco = list(
+            Cliente.objects.filter(pk__gt=ultimo_pk).order_by('pk')
+            .only('nome', 'cognome', 'email', 'telefono_normalizzato', 'citta')[:DIMENSIONE_BLOCCO]
+        )
+        if not blocco:
+            break
+        for cliente in blocco:
+            cliente.nome_ricerca = normalizza_nome(cliente.nome)
+            cliente.cognome_ricerca = normalizza_nome(cliente.cognome)
+        Cliente.objects.bulk_update(blocco, ['nome_ricerca', 'cognome_ricerca'])
+        if inserisci:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.executemany(inserisci, [(cliente.pk, testo_ricerca(cliente)) for cliente in blocco])
+        ultimo_pk = blocco[-1].pk
+
+
+def elimina_indice(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS clienti_ricerca")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0006_email_normalizzata_unica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='cognome_ricerca',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='nome_ricerca',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(crea_indice, elimina_indice),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clienti', '0007_ricerca_clienti'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuntamento',
+            name='data_aggiornamento',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='data_aggiornamento',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
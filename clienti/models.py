@@ -1,5 +1,54 @@
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, Q
+from django.core.exceptions import ValidationError
 from django.core.validators import EmailValidator, RegexValidator
+from django.utils import timezone
+from negozio_cucine import segnali
+from . import identita
+
+class ClienteQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create non chiama save() né invia segnali: chiavi normalizzate
+        # e indice di ricerca si aggiornano qui
+        from . import ricerca
+        
+        objs = list(objs)
+        for cliente in objs:
+            cliente.aggiorna_chiavi()
+        creati = super().bulk_create(objs, *args, **kwargs)
+        ricerca.indicizza(cliente for cliente in creati if cliente.pk is not None)
+        return creati
+    
+    def update(self, **kwargs):
+        # update() non applica auto_now: l'ETag del feed iCalendar dipende
+        # anche da data_aggiornamento dei clienti
+        kwargs.setdefault('data_aggiornamento', timezone.now())
+        return super().update(**kwargs)
+    
+    def registra(self, email, **dati):
+        """Cliente con l'email indicata (confrontata in forma normalizzata),
+        creato con `dati` se non esiste; dei clienti esistenti completa solo
+        i campi vuoti. Restituisce (cliente, creato).
+        
+        Sicuro con richieste concorrenti: la creazione avviene sotto
+        savepoint e, se un'altra transazione ha appena inserito la stessa
+        email, il vincolo unico su email_normalizzata la fa fallire e si
+        rilegge la riga esistente.
+        """
+        chiave = identita.normalizza_email(email)
+        cliente = self.filter(email_normalizzata=chiave).first()
+        if cliente is None:
+            try:
+                with transaction.atomic():
+                    return self.create(email=email.strip(), **dati), True
+            except IntegrityError:
+                cliente = self.get(email_normalizzata=chiave)
+        mancanti = [campo for campo, valore in dati.items() if valore and not getattr(cliente, campo)]
+        if mancanti:
+            for campo in mancanti:
+                setattr(cliente, campo, dati[campo])
+            cliente.save(update_fields=mancanti)
+        return cliente, False
 
 class Cliente(models.Model):
     nome = models.CharField(max_length=100, verbose_name="Nome")
@@ -23,6 +72,21 @@ class Cliente(models.Model):
     cap = models.CharField(max_length=10, blank=True, verbose_name="CAP")
     note = models.TextField(blank=True, verbose_name="Note")
     data_registrazione = models.DateTimeField(auto_now_add=True)
+    data_aggiornamento = models.DateTimeField(auto_now=True)
+    # Chiavi di ricerca calcolate da email e telefono (vedi identita.py).
+    # email_normalizzata è vuota solo per i duplicati trovati dalla
+    # migrazione 0005, in attesa di deduplica_clienti
+    email_normalizzata = models.CharField(
+        max_length=254, unique=True, null=True, editable=False, verbose_name="Email normalizzata"
+    )
+    telefono_normalizzato = models.CharField(
+        max_length=16, blank=True, db_index=True, editable=False, verbose_name="Telefono E.164"
+    )
+    # Nome e cognome normalizzati per la ricerca per prefisso (vedi ricerca.py)
+    nome_ricerca = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
+    cognome_ricerca = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
+    
+    objects = ClienteQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Cliente"
@@ -32,9 +96,91 @@ class Cliente(models.Model):
     def __str__(self):
         return f"{self.cognome} {self.nome}"
     
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # L'unicità di email distingue maiuscole e minuscole, quella della
+        # chiave normalizzata no
+        if exclude is None or 'email' not in exclude:
+            chiave = identita.normalizza_email(self.email)
+            if chiave and Cliente.objects.filter(email_normalizzata=chiave).exclude(pk=self.pk).exists():
+                raise ValidationError({'email': 'Esiste già un cliente con questa email.'})
+    
+    def aggiorna_chiavi(self):
+        self.email_normalizzata = identita.normalizza_email(self.email) or None
+        self.telefono_normalizzato = identita.normalizza_telefono(self.telefono)
+        self.nome_ricerca = identita.normalizza_nome(self.nome)
+        self.cognome_ricerca = identita.normalizza_nome(self.cognome)
+    
+    def save(self, *args, **kwargs):
+        self.aggiorna_chiavi()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            campi = set(update_fields) | {'data_aggiornamento'}
+            if 'email' in campi:
+                campi.add('email_normalizzata')
+            if 'telefono' in campi:
+                campi.add('telefono_normalizzato')
+            if 'nome' in campi:
+                campi.add('nome_ricerca')
+            if 'cognome' in campi:
+                campi.add('cognome_ricerca')
+            kwargs['update_fields'] = campi
+        super().save(*args, **kwargs)
+    
     def get_nome_completo(self):
         return f"{self.nome} {self.cognome}"
 
+class AppuntamentoQuerySet(models.QuerySet):
+    def attivi(self):
+        # Stessa condizione dell'indice parziale appuntamento_attivo_idx
+        return self.filter(~Q(stato='ANNULLATO'))
+    
+    def update(self, **kwargs):
+        # update() non applica auto_now: l'ETag del feed iCalendar si basa
+        # su data_aggiornamento
+        kwargs.setdefault('data_aggiornamento', timezone.now())
+        # update() non invia pre_save/post_save: le statistiche leggono qui
+        # i giorni delle righe prima della modifica
+        segnali.pre_update.send(sender=self.model, queryset=self, campi=set(kwargs))
+        return super().update(**kwargs)
+    
+    def conferma(self):
+        """Porta a CONFERMATO gli appuntamenti RICHIESTO della selezione e
+        restituisce gli id di quelli che hanno cambiato stato, con un solo
+        UPDATE. Gli appuntamenti già confermati, anche da una transazione
+        concorrente, restano fuori: la condizione sullo stato è
+        rivalutata sulla riga bloccata dall'UPDATE.
+        """
+        connessione = connections[self.db]
+        richiesti = self.filter(stato='RICHIESTO').order_by()
+        adesso = timezone.now()
+        with transaction.atomic(using=self.db):
+            if _update_returning(connessione):
+                qn = connessione.ops.quote_name
+                tabella = qn(self.model._meta.db_table)
+                pk = qn(self.model._meta.pk.column)
+                sottoquery, parametri = richiesti.values('pk').query.get_compiler(self.db).as_sql()
+                with connessione.cursor() as cursor:
+                    cursor.execute(
+                        f'UPDATE {tabella} SET {qn("stato")} = %s, {qn("data_aggiornamento")} = %s '
+                        f'WHERE {qn("stato")} = %s AND {pk} IN ({sottoquery}) RETURNING {pk}',
+                        ['CONFERMATO', connessione.ops.adapt_datetimefield_value(adesso), 'RICHIESTO', *parametri],
+                    )
+                    ids = [riga[0] for riga in cursor.fetchall()]
+            else:
+                ids = list(richiesti.select_for_update().values_list('pk', flat=True))
+                models.QuerySet.update(
+                    self.model.objects.filter(pk__in=ids), stato='CONFERMATO', data_aggiornamento=adesso
+                )
+            segnali.modificati_in_blocco.send(sender=self.model, pks=ids)
+        return ids
+
+def _update_returning(connessione):
+    """UPDATE ... RETURNING: PostgreSQL e SQLite dalla 3.35."""
+    if connessione.vendor == 'postgresql':
+        return True
+    return connessione.vendor == 'sqlite' and connessione.Database.sqlite_version_info >= (3, 35)
+
 class Appuntamento(models.Model):
     TIPO_CONSULENZA_CHOICES = [
         ('CONSULENZA', 'Consulenza Progettuale'),
@@ -56,7 +202,7 @@ class Appuntamento(models.Model):
         related_name='appuntamenti',
         verbose_name="Cliente"
     )
-    data_ora = models.DateTimeField(verbose_name="Data e Ora")
+    data_ora = models.DateTimeField(db_index=True, verbose_name="Data e Ora")
     tipo_consulenza = models.CharField(
         max_length=20,
         choices=TIPO_CONSULENZA_CHOICES,
@@ -71,11 +217,66 @@ class Appuntamento(models.Model):
     )
     note = models.TextField(blank=True, verbose_name="Note")
     data_creazione = models.DateTimeField(auto_now_add=True)
+    data_aggiornamento = models.DateTimeField(auto_now=True)
+    # Ultimo promemoria automatico (vedi promemoria.py): finestra in minuti
+    # e data_ora dell'appuntamento a cui si riferiva
+    promemoria_minuti = models.PositiveIntegerField(
+        null=True, blank=True, editable=False, verbose_name="Ultimo promemoria (minuti prima)"
+    )
+    promemoria_data_ora = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = AppuntamentoQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Appuntamento"
         verbose_name_plural = "Appuntamenti"
         ordering = ['-data_ora']
+        indexes = [
+            # Intervalli di occupazione dell'agenda (vedi disponibilita.py)
+            models.Index(
+                fields=['data_ora'],
+                condition=~Q(stato='ANNULLATO'),
+                name='appuntamento_attivo_idx',
+            ),
+            # Finestre dei promemoria automatici
+            models.Index(
+                fields=['data_ora'],
+                condition=Q(stato='CONFERMATO'),
+                name='appuntamento_confermato_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.cliente} - {self.data_ora.strftime('%d/%m/%Y %H:%M')}"
+
+class GiornataAgenda(models.Model):
+    """Una riga per ogni giorno con prenotazioni, bloccata mentre una
+    prenotazione di quel giorno verifica i posti liberi.
+
+    Il blocco è l'UPDATE che incrementa `verifiche`, così funziona anche
+    sotto SQLite: il contatore misura le verifiche andate a buon fine, non
+    gli appuntamenti del giorno, e non cala con gli annullamenti."""
+    giorno = models.DateField(unique=True, verbose_name="Giorno")
+    verifiche = models.PositiveIntegerField(default=0, verbose_name="Verifiche di disponibilità")
+    
+    class Meta:
+        verbose_name = "Giornata Agenda"
+        verbose_name_plural = "Giornate Agenda"
+    
+    def __str__(self):
+        return f"{self.giorno}: {self.verifiche}"
+    
+    @classmethod
+    def blocca(cls, giorno):
+        """Blocca la riga del giorno fino alla fine della transazione del
+        chiamante, creandola se manca (come ContatorePreventivo)."""
+        with transaction.atomic():
+            giornata = cls.objects.filter(giorno=giorno)
+            if giornata.update(verifiche=F('verifiche') + 1):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(giorno=giorno, verifiche=1)
+            except IntegrityError:
+                # Giorno creato nel frattempo da un'altra transazione
+                giornata.update(verifiche=F('verifiche') + 1)
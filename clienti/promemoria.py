@@ -0,0 +1,103 @@
+"""
+Promemoria automatici degli appuntamenti confermati.
+
+Le finestre di promemoria sono in APPUNTAMENTI_PROMEMORIA, in minuti prima
+di data_ora (di norma 24 ore e 2 ore). Il comando
+invia_promemoria_appuntamenti, eseguito da cron o in ciclo continuo, cerca
+gli appuntamenti CONFERMATO entrati in una finestra con una query per
+intervallo sull'indice parziale appuntamento_confermato_idx e li elabora a
+blocchi: ogni blocco segna gli appuntamenti e mette in coda le email nella
+stessa transazione, poi il worker dell'outbox le spedisce su un'unica
+connessione.
+
+Ogni appuntamento riceve un solo promemoria per finestra. Il segno
+ricorda anche la data_ora a cui si riferiva, così un appuntamento spostato
+torna a ricevere i promemoria; chi entra direttamente nella finestra più
+stretta (ad esempio confermato due ore prima) ne riceve uno solo.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from notifiche import outbox
+
+from .models import Appuntamento
+
+DIMENSIONE_BLOCCO = 200
+
+
+def finestre():
+    """Finestre di promemoria in minuti, dalla più stretta alla più larga."""
+    return sorted(set(getattr(settings, 'APPUNTAMENTI_PROMEMORIA', [24 * 60, 2 * 60])))
+
+
+def messaggio(appuntamento):
+    data_ora = timezone.localtime(appuntamento.data_ora)
+    return outbox.nuovo_messaggio(
+        'Promemoria Appuntamento - Negozio Cucine',
+        f"""
+        Gentile {appuntamento.cliente.get_nome_completo()},
+
+        Le ricordiamo il suo appuntamento:
+
+        Data e Ora: {data_ora.strftime('%d/%m/%Y alle %H:%M')}
+        Tipo: {appuntamento.get_tipo_consulenza_display()}
+
+        A presto,
+        Negozio Cucine
+        """,
+        [appuntamento.cliente.email],
+    )
+
+
+def da_ricordare(finestra, precedente, adesso):
+    """Appuntamenti confermati con inizio in (adesso + precedente,
+    adesso + finestra] che non hanno ancora il promemoria di questa
+    finestra per la loro data_ora attuale."""
+    return Appuntamento.objects.filter(
+        stato='CONFERMATO',
+        data_ora__gt=adesso + timedelta(minutes=precedente),
+        data_ora__lte=adesso + timedelta(minutes=finestra),
+    ).filter(
+        Q(promemoria_minuti__isnull=True)
+        | Q(promemoria_minuti__gt=finestra)
+        | ~Q(promemoria_data_ora=F('data_ora'))
+    )
+
+
+def _accoda_blocco(finestra, precedente, adesso, dimensione):
+    with transaction.atomic():
+        # skip_locked: più esecuzioni parallele si dividono gli appuntamenti
+        appuntamenti = list(
+            da_ricordare(finestra, precedente, adesso)
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('cliente')
+            .only('data_ora', 'tipo_consulenza', 'cliente__nome', 'cliente__cognome', 'cliente__email')
+            .order_by('data_ora', 'pk')[:dimensione]
+        )
+        if appuntamenti:
+            Appuntamento.objects.filter(pk__in=[a.pk for a in appuntamenti]).update(
+                promemoria_minuti=finestra, promemoria_data_ora=F('data_ora')
+            )
+            outbox.accoda_in_blocco(messaggio(appuntamento) for appuntamento in appuntamenti)
+    return len(appuntamenti)
+
+
+def accoda_promemoria(adesso=None, dimensione=DIMENSIONE_BLOCCO):
+    """Mette in coda i promemoria dovuti; restituisce {finestra: numero}.
+    In memoria resta un blocco di appuntamenti alla volta."""
+    adesso = adesso or timezone.now()
+    accodati = {}
+    precedente = 0
+    for finestra in finestre():
+        accodati[finestra] = 0
+        while True:
+            numero = _accoda_blocco(finestra, precedente, adesso, dimensione)
+            accodati[finestra] += numero
+            # I segnati escono dalla selezione: il blocco successivo riparte dall'inizio
+            if numero < dimensione:
+                break
+        precedente = finestra
+    return accodati
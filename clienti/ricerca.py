@@ -0,0 +1,202 @@
+"""
+Ricerca veloce dei clienti, per la lista dell'admin e l'autocompletamento
+dei preventivi.
+
+La ricerca avviene in due passi, con risultati limitati:
+
+1. prefissi sulle colonne indicizzate: cognome e nome normalizzati, email
+   normalizzata, telefono E.164. Ogni parola della ricerca deve essere
+   l'inizio di uno di questi campi. Sono i risultati più rilevanti e
+   arrivano per primi, in ordine alfabetico;
+2. se non bastano, sottostringhe ovunque nel testo del cliente (nome,
+   cognome, email, telefono, città) su un indice di trigrammi: una tabella
+   virtuale FTS5 con tokenizer trigram sotto SQLite, una tabella con indice
+   GIN gin_trgm_ops sotto PostgreSQL (estensione pg_trgm). Ordinati per
+   rilevanza (bm25 / similarity).
+
+Le parole più corte di tre caratteri non hanno trigrammi: contano solo per
+i prefissi. La tabella `clienti_ricerca` è aggiornata dai segnali di
+salvataggio (vedi signals.py) e da ClienteQuerySet.bulk_create.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+
+from . import identita
+
+TABELLA = 'clienti_ricerca'
+RISULTATI_MASSIMI = 50
+DIMENSIONE_BLOCCO = 500
+LUNGHEZZA_TRIGRAMMA = 3
+
+
+def normalizza(testo):
+    testo = unicodedata.normalize('NFKD', (testo or '').lower())
+    return ''.join(c for c in testo if not unicodedata.combining(c))
+
+
+def _testo(cliente):
+    return ' '.join(normalizza(campo) for campo in (
+        cliente.nome, cliente.cognome, cliente.email,
+        cliente.telefono_normalizzato.lstrip('+'), cliente.citta,
+    ) if campo)
+
+
+def supportata():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def indicizza(clienti):
+    """Inserisce o aggiorna i clienti nell'indice dei trigrammi."""
+    if not supportata():
+        return
+    clienti = list(clienti)
+    if not clienti:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                f'DELETE FROM {TABELLA} WHERE rowid = %s',
+                [(cliente.pk,) for cliente in clienti],
+            )
+            cursor.executemany(
+                f'INSERT INTO {TABELLA} (rowid, testo) VALUES (%s, %s)',
+                [(cliente.pk, _testo(cliente)) for cliente in clienti],
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {TABELLA} (cliente_id, testo) VALUES (%s, %s) '
+                'ON CONFLICT (cliente_id) DO UPDATE SET testo = EXCLUDED.testo',
+                [(cliente.pk, _testo(cliente)) for cliente in clienti],
+            )
+
+
+def rimuovi(ids):
+    if not supportata() or not ids:
+        return
+    colonna = 'rowid' if connection.vendor == 'sqlite' else 'cliente_id'
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {TABELLA} WHERE {colonna} = %s',
+            [(pk,) for pk in ids],
+        )
+
+
+def ricostruisci_indice():
+    from .models import Cliente
+
+    if not supportata():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABELLA}')
+    totale = 0
+    blocco = []
+    for cliente in Cliente.objects.order_by().iterator(chunk_size=DIMENSIONE_BLOCCO):
+        blocco.append(cliente)
+        if len(blocco) == DIMENSIONE_BLOCCO:
+            indicizza(blocco)
+            totale += len(blocco)
+            blocco = []
+    indicizza(blocco)
+    return totale + len(blocco)
+
+
+def _inizia_con(campo, prefisso):
+    if connection.vendor == 'postgresql':
+        # LIKE 'prefisso%' usa l'indice varchar_pattern_ops creato da Django
+        return Q(**{f'{campo}__startswith': prefisso})
+    # Sotto SQLite LIKE ignora le maiuscole e non usa l'indice: l'intervallo
+    # [prefisso, successivo) sì, e le chiavi sono già minuscole
+    successivo = prefisso[:-1] + chr(ord(prefisso[-1]) + 1)
+    return Q(**{f'{campo}__gte': prefisso, f'{campo}__lt': successivo})
+
+
+def _prefisso_telefono(parola):
+    cifre = re.sub(r'\D', '', parola)
+    if len(cifre) < LUNGHEZZA_TRIGRAMMA:
+        return ''
+    if parola.startswith('+'):
+        return '+' + cifre
+    if parola.startswith('00'):
+        return '+' + cifre[2:]
+    return '+' + identita.PREFISSO_PREDEFINITO + cifre
+
+
+def _filtro_prefissi(parole):
+    filtro = Q()
+    for parola in parole:
+        alternative = Q()
+        nome = identita.normalizza_nome(parola)
+        if nome:
+            alternative |= _inizia_con('cognome_ricerca', nome) | _inizia_con('nome_ricerca', nome)
+        alternative |= _inizia_con('email_normalizzata', identita.normalizza_email(parola))
+        telefono = _prefisso_telefono(parola)
+        if telefono:
+            alternative |= _inizia_con('telefono_normalizzato', telefono)
+        filtro &= alternative
+    if len(parole) > 1:
+        # Cognomi composti scritti con lo spazio: "de lu" -> "delu"
+        cognome = identita.normalizza_nome(''.join(parole))
+        if cognome:
+            filtro |= _inizia_con('cognome_ricerca', cognome)
+    return filtro
+
+
+def _cerca_sottostringhe(parole, limite):
+    from .models import Cliente
+
+    termini = [normalizza(parola) for parola in parole]
+    termini = [termine for termine in termini if len(termine) >= LUNGHEZZA_TRIGRAMMA]
+    if not termini:
+        return []
+
+    if connection.vendor == 'sqlite':
+        # Con il tokenizer trigram ogni stringa quotata cerca una sottostringa
+        query = ' '.join('"{}"'.format(termine.replace('"', '""')) for termine in termini)
+        sql = f'SELECT rowid FROM {TABELLA} WHERE {TABELLA} MATCH %s ORDER BY rank LIMIT %s'
+        parametri = [query, limite]
+    elif connection.vendor == 'postgresql':
+        modelli = [
+            '%{}%'.format(termine.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+            for termine in termini
+        ]
+        sql = (
+            f'SELECT cliente_id FROM {TABELLA} WHERE '
+            + ' AND '.join(['testo LIKE %s'] * len(modelli))
+            + ' ORDER BY similarity(testo, %s) DESC LIMIT %s'
+        )
+        parametri = [*modelli, ' '.join(termini), limite]
+    else:
+        filtro = Q()
+        for termine in termini:
+            filtro &= (
+                Q(nome__icontains=termine) | Q(cognome__icontains=termine)
+                | Q(email__icontains=termine) | Q(telefono__icontains=termine)
+            )
+        return list(Cliente.objects.filter(filtro).values_list('pk', flat=True)[:limite])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametri)
+        return [riga[0] for riga in cursor.fetchall()]
+
+
+def cerca_ids(testo, limite=RISULTATI_MASSIMI):
+    """Id dei clienti che corrispondono a `testo`, dal più rilevante:
+    prima le corrispondenze per prefisso, poi quelle per sottostringa."""
+    from .models import Cliente
+
+    parole = (testo or '').split()
+    if not parole:
+        return []
+    ids = list(
+        Cliente.objects.filter(_filtro_prefissi(parole))
+        .order_by('cognome_ricerca', 'nome_ricerca', 'pk')
+        .values_list('pk', flat=True)[:limite]
+    )
+    if len(ids) < limite:
+        trovati = set(ids)
+        altri = _cerca_sottostringhe(parole, limite + len(ids))
+        ids += [pk for pk in altri if pk not in trovati][:limite - len(ids)]
+    return ids
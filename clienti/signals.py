@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import ricerca
+from .models import Cliente
+
+
+@receiver(post_save, sender=Cliente)
+def indicizza_cliente(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ricerca.indicizza([instance])
+
+
+@receiver(post_delete, sender=Cliente)
+def rimuovi_cliente_da_indice(sender, instance, **kwargs):
+    ricerca.rimuovi([instance.pk])
@@ -1,3 +1,582 @@
-from django.test import TestCase
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import close_old_connections, connection, models
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from negozio_cucine.test_utils import QueryListaMixin
+from notifiche.models import MessaggioEmail
+from preventivi.models import Preventivo
+
+from . import deduplica, disponibilita, identita, promemoria, ricerca
+from .models import Appuntamento, Cliente, ClienteQuerySet, GiornataAgenda
+
+
+def crea_clienti(n, inizio=0):
+    return Cliente.objects.bulk_create([
+        Cliente(nome=f'Nome{i}', cognome=f'Cognome{i}', email=f'cliente{i}@example.com', telefono='3331234567')
+        for i in range(inizio, inizio + n)
+    ])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ChangelistClientiTest(QueryListaMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_lista_clienti_query_costanti(self):
+        url = reverse('admin:clienti_cliente_changelist')
+        crea_clienti(5)
+        poche = self._query_lista(url)[1]
+        crea_clienti(20, inizio=5)
+        self.assertEqual(self._query_lista(url)[1], poche)
+
+    def test_lista_appuntamenti_con_cliente_in_join(self):
+        url = reverse('admin:clienti_appuntamento_changelist')
+        domani = timezone.now() + timedelta(days=1)
+
+        def crea_appuntamenti(clienti):
+            Appuntamento.objects.bulk_create([
+                Appuntamento(cliente=cliente, data_ora=domani + timedelta(hours=i))
+                for i, cliente in enumerate(clienti)
+            ])
+
+        crea_appuntamenti(crea_clienti(3))
+        poche = self._query_lista(url)[1]
+        crea_appuntamenti(crea_clienti(20, inizio=3))
+        self.assertEqual(self._query_lista(url)[1], poche)
+
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RicercaClientiTest(TestCase):
+    def setUp(self):
+        self.rossi = Cliente.objects.create(
+            nome='Mario', cognome='Rossi', email='mario.rossi@example.com', telefono='3331234567', citta='Milano'
+        )
+        self.derossi = Cliente.objects.create(
+            nome='Anna', cognome='De Rossi', email='anna@studio.it', telefono='+390212345678', citta='Roma'
+        )
+        self.bianchi = Cliente.objects.create(
+            nome='Luca', cognome='Bianchi', email='luca.b@example.org', telefono='3479876543', citta='Rossano'
+        )
+
+    def test_prefissi_prima_delle_sottostringhe(self):
+        # "rossi" è l'inizio del cognome di Rossi, una sottostringa di De
+        # Rossi e di Rossano (città di Bianchi): prima il prefisso
+        self.assertEqual(ricerca.cerca_ids('rossi')[0], self.rossi.pk)
+        self.assertEqual(set(ricerca.cerca_ids('rossi')), {self.rossi.pk, self.derossi.pk})
+        ids = ricerca.cerca_ids('ross')
+        self.assertEqual(ids[0], self.rossi.pk)
+        self.assertEqual(set(ids), {self.rossi.pk, self.derossi.pk, self.bianchi.pk})
+
+    def test_campi_e_normalizzazione(self):
+        for testo, atteso in [
+            ('MARIO.R', [self.rossi.pk]),
+            ('333 123', [self.rossi.pk]),
+            ('02123', [self.derossi.pk]),
+            ('9876543', [self.bianchi.pk]),
+            ('studio', [self.derossi.pk]),
+            ('anna rossi', [self.derossi.pk]),
+            ('Rössi Mario', [self.rossi.pk]),
+            ('zz', []),
+            ('', []),
+        ]:
+            with self.subTest(testo=testo):
+                self.assertEqual(ricerca.cerca_ids(testo), atteso)
+        # Cognome composto scritto con lo spazio: "de" è troppo corto per
+        # i trigrammi, ma "deross" è un prefisso
+        self.assertEqual(ricerca.cerca_ids('de ross')[0], self.derossi.pk)
+
+    def test_indice_aggiornato_e_limite(self):
+        self.bianchi.cognome = 'Verdi'
+        self.bianchi.save()
+        self.assertEqual(ricerca.cerca_ids('verd'), [self.bianchi.pk])
+        self.assertEqual(ricerca.cerca_ids('bianchi'), [])
+        pk = self.rossi.pk
+        self.rossi.delete()
+        self.assertNotIn(pk, ricerca.cerca_ids('mario'))
+        crea_clienti(30)
+        self.assertEqual(len(ricerca.cerca_ids('cliente', limite=10)), 10)
+        self.assertEqual(len(ricerca.cerca_ids('liente1', limite=50)), 11)
+        self.assertEqual(ricerca.ricostruisci_indice(), 32)
+
+    def test_lista_e_autocompletamento_in_ordine_di_rilevanza(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:clienti_cliente_changelist'), {'q': 'ross'})
+        self.assertEqual(list(response.context['cl'].result_list)[0], self.rossi)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        # Con un ordinamento scelto la rilevanza non conta
+        response = self.client.get(reverse('admin:clienti_cliente_changelist'), {'q': 'ross', 'o': '1'})
+        self.assertEqual(list(response.context['cl'].result_list)[0], self.bianchi)
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'preventivi', 'model_name': 'preventivo', 'field_name': 'cliente', 'term': 'ross',
+        })
+        risultati = [int(r['id']) for r in response.json()['results']]
+        self.assertEqual(risultati[0], self.rossi.pk)
+        self.assertEqual(len(risultati), 3)
+
+
+ORARI_PROVA = {0: [('09:00', '13:00')], 1: [('09:00', '13:00')]}
+LUNEDI = date(2030, 5, 6)
+
+
+def alle(ore, minuti=0, giorno=LUNEDI):
+    return timezone.make_aware(datetime.combine(giorno, time(ore, minuti)))
+
+
+@override_settings(
+    APPUNTAMENTI_ORARI=ORARI_PROVA,
+    APPUNTAMENTI_DURATE={'CONSULENZA': 60, 'RILIEVO': 120, 'PREVENTIVO': 45, 'ALTRO': 30},
+    APPUNTAMENTI_CAPACITA=1,
+    APPUNTAMENTI_PASSO=30,
+    APPUNTAMENTI_PREAVVISO=120,
+)
+class DisponibilitaTest(TestCase):
+    def setUp(self):
+        self.cliente = crea_clienti(1)[0]
+        Appuntamento.objects.create(cliente=self.cliente, data_ora=alle(10), tipo_consulenza='CONSULENZA')
+        Appuntamento.objects.create(
+            cliente=self.cliente, data_ora=alle(12), tipo_consulenza='RILIEVO', stato='ANNULLATO'
+        )
+
+    def _orari(self, slot):
+        return [timezone.localtime(s.inizio).strftime('%H:%M') for s in slot]
+
+    def test_slot_liberi_con_una_query(self):
+        with self.assertNumQueries(1):
+            slot = disponibilita.slot_liberi(LUNEDI, LUNEDI, 'CONSULENZA')
+        # 9:30 e 10:30 si sovrappongono alla consulenza delle 10; l'annullato non occupa
+        self.assertEqual(self._orari(slot), ['09:00', '11:00', '11:30', '12:00'])
+        self.assertEqual(
+            self._orari(disponibilita.slot_liberi(LUNEDI, LUNEDI, 'RILIEVO')), ['11:00']
+        )
+
+    def test_capacita_e_giorni_chiusi(self):
+        with self.settings(APPUNTAMENTI_CAPACITA=2):
+            slot = disponibilita.slot_liberi(LUNEDI, LUNEDI + timedelta(days=6), 'RILIEVO')
+        self.assertEqual({timezone.localtime(s.inizio).date() for s in slot}, {LUNEDI, LUNEDI + timedelta(days=1)})
+        self.assertEqual([s.liberi for s in slot[:5]], [1, 1, 1, 1, 2])
+
+    def test_preavviso(self):
+        self.assertEqual(self._orari(disponibilita.slot_liberi(LUNEDI, LUNEDI, 'ALTRO', adesso=alle(6)))[0], '09:00')
+        # Dalle 10:15: la mezz'ora delle 10:30 è occupata dalla consulenza
+        slot = disponibilita.slot_liberi(LUNEDI, LUNEDI, 'ALTRO', adesso=alle(8, 15))
+        self.assertEqual(self._orari(slot)[:2], ['11:00', '11:30'])
+
+    def test_verifica(self):
+        for data_ora, messaggio in [
+            (alle(10, 30), 'non è più disponibile'),
+            (alle(12, 30), 'chiuso'),
+            (alle(10, giorno=LUNEDI + timedelta(days=5)), 'chiuso'),
+        ]:
+            with self.subTest(data_ora=data_ora), self.assertRaisesMessage(ValidationError, messaggio):
+                disponibilita.verifica(data_ora, 'CONSULENZA')
+        with self.assertRaisesMessage(ValidationError, 'non è più prenotabile'):
+            disponibilita.verifica(alle(11), 'CONSULENZA', adesso=alle(10))
+        disponibilita.verifica(alle(11), 'RILIEVO')
+
+    def test_endpoint_json(self):
+        url = reverse('clienti:slot_liberi')
+        response = self.client.get(url, {'tipo': 'RILIEVO', 'dal': '2030-05-06', 'al': '2030-05-07'})
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        dati = response.json()
+        self.assertEqual(dati['durata_minuti'], 120)
+        self.assertEqual([g['data'] for g in dati['giorni']], ['2030-05-06', '2030-05-07'])
+        self.assertEqual(dati['giorni'][0]['slot'], [
+            {'inizio': '2030-05-06T11:00:00+02:00', 'fine': '2030-05-06T13:00:00+02:00', 'liberi': 1},
+        ])
+        for parametri in ({'tipo': 'X'}, {'dal': 'ieri'}, {'dal': '2030-05-06', 'al': '2030-07-06'}):
+            self.assertEqual(self.client.get(url, parametri).status_code, 400)
+
+    def test_prenotazione_dell_ultimo_posto(self):
+        dati = {
+            'nome': 'Anna', 'cognome': 'Verdi', 'email': 'anna.verdi@example.com',
+            'telefono': '3337654321', 'data_ora': '2030-05-06T11:00',
+            'tipo_consulenza': 'RILIEVO', 'note': '',
+        }
+        self.assertEqual(self.client.post(reverse('clienti:prenota'), dati).status_code, 302)
+        response = self.client.post(reverse('clienti:prenota'), {**dati, 'email': 'altro@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'non è più disponibile')
+        self.assertEqual(Appuntamento.objects.attivi().filter(data_ora=alle(11)).count(), 1)
+        self.assertFalse(Cliente.objects.filter(email='altro@example.com').exists())
+
+    def test_verifica_al_salvataggio_con_giorno_bloccato(self):
+        # Posto occupato dopo la validazione del form: la prenotazione viene respinta
+        nuovo = Appuntamento(cliente=self.cliente, data_ora=alle(11), tipo_consulenza='CONSULENZA')
+        Appuntamento.objects.create(cliente=self.cliente, data_ora=alle(11, 30), tipo_consulenza='ALTRO')
+        with self.assertRaises(ValidationError):
+            disponibilita.prenota(nuovo)
+        self.assertIsNone(nuovo.pk)
+        disponibilita.prenota(Appuntamento(cliente=self.cliente, data_ora=alle(12), tipo_consulenza='CONSULENZA'))
+        self.assertEqual(GiornataAgenda.objects.get(giorno=LUNEDI).verifiche, 1)
+
+
+@override_settings(APPUNTAMENTI_ORARI=ORARI_PROVA, APPUNTAMENTI_CAPACITA=1, APPUNTAMENTI_PREAVVISO=0)
+class PrenotazioneConcorrenteTest(TransactionTestCase):
+    WORKER = 6
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest(
+                'SQLite in memoria usa lock di tabella senza attesa: '
+                'serve un database con scritture concorrenti'
+            )
+
+    def test_ultimo_posto_assegnato_una_volta(self):
+        clienti = crea_clienti(self.WORKER)
+        partenza = threading.Barrier(self.WORKER)
+
+        def prenota(cliente):
+            partenza.wait()
+            try:
+                disponibilita.prenota(Appuntamento(cliente=cliente, data_ora=alle(9), tipo_consulenza='CONSULENZA'))
+                return True
+            except ValidationError:
+                return False
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.WORKER) as pool:
+            esiti = list(pool.map(prenota, clienti))
+
+        self.assertEqual(esiti.count(True), 1)
+        self.assertEqual(Appuntamento.objects.count(), 1)
+
+
+@override_settings(
+    APPUNTAMENTI_PROMEMORIA=[24 * 60, 2 * 60],
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class PromemoriaTest(TestCase):
+    def setUp(self):
+        self.adesso = alle(8)
+        self.clienti = crea_clienti(6)
+
+    def _appuntamento(self, ore, stato='CONFERMATO', cliente=0):
+        return Appuntamento.objects.create(
+            cliente=self.clienti[cliente], data_ora=self.adesso + timedelta(hours=ore), stato=stato
+        )
+
+    def _destinatari(self):
+        return sorted(d[0] for d in MessaggioEmail.objects.values_list('destinatari', flat=True))
+
+    def test_finestre_e_idempotenza(self):
+        self._appuntamento(20, cliente=0)
+        self._appuntamento(1, cliente=1)
+        self._appuntamento(30, cliente=2)
+        self._appuntamento(20, stato='RICHIESTO', cliente=3)
+        self._appuntamento(-1, cliente=4)
+
+        self.assertEqual(promemoria.accoda_promemoria(self.adesso), {120: 1, 1440: 1})
+        self.assertEqual(self._destinatari(), ['cliente0@example.com', 'cliente1@example.com'])
+        # Una seconda esecuzione non manda nulla
+        self.assertEqual(promemoria.accoda_promemoria(self.adesso), {120: 0, 1440: 0})
+
+        # 19 ore dopo l'appuntamento delle 20 entra nella finestra delle 2 ore
+        MessaggioEmail.objects.all().delete()
+        self.assertEqual(promemoria.accoda_promemoria(self.adesso + timedelta(hours=19)), {120: 1, 1440: 1})
+        self.assertEqual(self._destinatari(), ['cliente0@example.com', 'cliente2@example.com'])
+
+    def test_appuntamento_spostato_riceve_di_nuovo_il_promemoria(self):
+        appuntamento = self._appuntamento(20)
+        promemoria.accoda_promemoria(self.adesso)
+        Appuntamento.objects.filter(pk=appuntamento.pk).update(data_ora=appuntamento.data_ora + timedelta(hours=2))
+        self.assertEqual(promemoria.accoda_promemoria(self.adesso), {120: 0, 1440: 1})
+        self.assertEqual(MessaggioEmail.objects.count(), 2)
+
+    def test_blocchi_con_query_costanti(self):
+        Appuntamento.objects.bulk_create([
+            Appuntamento(cliente=self.clienti[i % 6], data_ora=self.adesso + timedelta(hours=10, minutes=i), stato='CONFERMATO')
+            for i in range(25)
+        ])
+        with CaptureQueriesContext(connection) as query:
+            accodati = promemoria.accoda_promemoria(self.adesso, dimensione=10)
+        self.assertEqual(accodati[1440], 25)
+        self.assertEqual(MessaggioEmail.objects.count(), 25)
+        # Una lettura (con il cliente) per blocco: una per la finestra delle
+        # 2 ore, vuota, e tre per quella delle 24 ore
+        letture = [q for q in query if q['sql'].startswith('SELECT') and 'clienti_appuntamento' in q['sql']]
+        self.assertEqual(len(letture), 1 + 3)
+        self.assertTrue(all('"clienti_cliente"' in q['sql'] for q in letture))
+
+    def test_comando_spedisce_su_una_connessione(self):
+        for cliente in range(3):
+            self._appuntamento(10 + cliente, cliente=cliente)
+        out = io.StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=self.adesso), \
+                mock.patch('notifiche.outbox.get_connection', wraps=get_connection) as connessioni:
+            call_command('invia_promemoria_appuntamenti', '--invia', stdout=out)
+        self.assertIn('3 promemoria in coda', out.getvalue())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(connessioni.call_count, 1)
+        self.assertIn('Promemoria Appuntamento', mail.outbox[0].subject)
+
+
+class IdentitaClientiTest(TestCase):
+    def test_normalizzazione(self):
+        self.assertEqual(identita.normalizza_email('  Mario.Rossi@Example.COM '), 'mario.rossi@example.com')
+        for telefono, atteso in [
+            ('3331234567', '+393331234567'),
+            ('333 123 4567', '+393331234567'),
+            ('+39 333-1234567', '+393331234567'),
+            ('0039 333 1234567', '+393331234567'),
+            ('02/1234567', '+39021234567'),
+            ('+41 44 123 45 67', '+41441234567'),
+            ('interno 12', ''),
+        ]:
+            with self.subTest(telefono=telefono):
+                self.assertEqual(identita.normalizza_telefono(telefono), atteso)
+        self.assertEqual(identita.normalizza_nome("D'Àngelo De Luca"), 'dangelodeluca')
+
+    def test_chiavi_calcolate_al_salvataggio(self):
+        cliente = Cliente.objects.create(
+            nome='Mario', cognome='Rossi', email='Mario.Rossi@Example.com', telefono='3331234567'
+        )
+        self.assertEqual(cliente.email_normalizzata, 'mario.rossi@example.com')
+        self.assertEqual(crea_clienti(1)[0].telefono_normalizzato, '+393331234567')
+        cliente.telefono = '+393337654321'
+        cliente.save(update_fields=['telefono'])
+        cliente.refresh_from_db()
+        self.assertEqual(cliente.telefono_normalizzato, '+393337654321')
+        with self.assertRaisesMessage(ValidationError, 'Esiste già un cliente con questa email'):
+            Cliente(nome='M', cognome='R', email='MARIO.ROSSI@example.com', telefono='3331234567').full_clean()
+
+    def test_registra_idempotente(self):
+        esistente = Cliente.objects.create(
+            nome='Mario', cognome='Rossi', email='Mario.Rossi@Example.com', telefono='3331234567'
+        )
+        cliente, creato = Cliente.objects.registra(
+            ' mario.rossi@example.com', nome='Marco', cognome='Rossi', telefono='3330000000', indirizzo='Via Roma 1'
+        )
+        self.assertEqual((cliente.pk, creato), (esistente.pk, False))
+        cliente.refresh_from_db()
+        # Completati solo i campi vuoti
+        self.assertEqual((cliente.nome, cliente.telefono, cliente.indirizzo), ('Mario', '3331234567', 'Via Roma 1'))
+
+        nuovo, creato = Cliente.objects.registra('anna@example.com', nome='Anna', cognome='Verdi', telefono='3337654321')
+        self.assertTrue(creato)
+        self.assertEqual(Cliente.objects.count(), 2)
+
+    def test_registra_dopo_inserimento_concorrente(self):
+        esistente = crea_clienti(1)[0]
+        # La lettura non vede il cliente inserito "nel frattempo": la
+        # creazione viola il vincolo e si rilegge la riga esistente
+        with mock.patch.object(ClienteQuerySet, 'first', return_value=None):
+            cliente, creato = Cliente.objects.registra('CLIENTE0@example.com', nome='X', cognome='Y', telefono='3331234567')
+        self.assertEqual((cliente.pk, creato), (esistente.pk, False))
+        self.assertEqual(Cliente.objects.count(), 1)
+
+    def _crea(self, nome, cognome, email, telefono, cap='', **campi):
+        return Cliente.objects.create(nome=nome, cognome=cognome, email=email, telefono=telefono, cap=cap, **campi)
+
+    def _crea_duplicati(self):
+        mario = self._crea('Mario', 'Rossi', 'mario@example.com', '3331111111', cap='20100')
+        stesso_telefono = self._crea('mario', 'Rossi', 'm.rossi@example.net', '+39 333 111 1111', indirizzo='Via Roma 1')
+        stesso_cap = self._crea('Màrio', 'Rossi', 'altro@example.org', '3332222222', cap='20100', note='Cucina angolare')
+        stessa_email = self._crea('M.', 'Rossi', 'temporanea@example.com', '3333333333')
+        # Due email uguali a meno delle maiuscole, come lasciate dalla migrazione
+        models.QuerySet.update(
+            Cliente.objects.filter(pk=stessa_email.pk), email='MARIO@example.com', email_normalizzata=None
+        )
+        # Stesso telefono e cognome ma altro nome: un familiare, non un duplicato
+        familiare = self._crea('Luca', 'Rossi', 'luca@example.com', '3331111111', cap='20100')
+        return mario, [stesso_telefono, stesso_cap, stessa_email], familiare
+
+    def test_trova_duplicati_per_blocchi(self):
+        mario, duplicati, familiare = self._crea_duplicati()
+        with self.assertNumQueries(1):
+            gruppi = deduplica.trova_duplicati()
+        self.assertEqual(gruppi, [[mario.pk, *[d.pk for d in duplicati]]])
+
+    def test_unione_riassegna_appuntamenti_e_preventivi(self):
+        mario, duplicati, familiare = self._crea_duplicati()
+        for i, cliente in enumerate([mario, *duplicati, familiare]):
+            Appuntamento.objects.create(cliente=cliente, data_ora=alle(9 + i))
+            Preventivo.objects.create(cliente=cliente)
+
+        uscita = io.StringIO()
+        call_command('deduplica_clienti', '--solo-verifica', stdout=uscita)
+        self.assertIn('1 gruppi di duplicati, 3 clienti da unire', uscita.getvalue())
+        self.assertEqual(Cliente.objects.count(), 5)
+
+        call_command('deduplica_clienti', stdout=io.StringIO())
+        self.assertEqual(set(Cliente.objects.values_list('pk', flat=True)), {mario.pk, familiare.pk})
+        self.assertEqual(mario.appuntamenti.count(), 4)
+        self.assertEqual(mario.preventivi.count(), 4)
+        self.assertEqual(familiare.appuntamenti.count(), 1)
+        mario.refresh_from_db()
+        self.assertEqual((mario.email, mario.telefono, mario.cap), ('mario@example.com', '3331111111', '20100'))
+        self.assertEqual((mario.indirizzo, mario.note), ('Via Roma 1', 'Cucina angolare'))
+        self.assertEqual(deduplica.trova_duplicati(), [])
+
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConfermaAppuntamentiTest(TestCase):
+    def setUp(self):
+        self.cliente = crea_clienti(1)[0]
+
+    def _crea(self, stati):
+        return Appuntamento.objects.bulk_create([
+            Appuntamento(cliente=self.cliente, data_ora=alle(9 + i % 8, giorno=LUNEDI + timedelta(days=i // 8)), stato=stato)
+            for i, stato in enumerate(stati)
+        ])
+
+    def test_restituisce_solo_gli_id_cambiati(self):
+        for returning in (True, False):
+            with self.subTest(returning=returning), mock.patch('clienti.models._update_returning', return_value=returning):
+                appuntamenti = self._crea(['RICHIESTO', 'CONFERMATO', 'ANNULLATO', 'RICHIESTO'])
+                selezione = Appuntamento.objects.filter(pk__in=[a.pk for a in appuntamenti])
+                with self.captureOnCommitCallbacks() as callbacks:
+                    ids = selezione.conferma()
+                self.assertEqual(sorted(ids), [appuntamenti[0].pk, appuntamenti[3].pk])
+                self.assertEqual(len(callbacks), 1)
+                self.assertEqual(
+                    list(selezione.order_by('pk').values_list('stato', flat=True)),
+                    ['CONFERMATO', 'CONFERMATO', 'ANNULLATO', 'CONFERMATO'],
+                )
+                self.assertEqual(selezione.conferma(), [])
+
+    def test_azione_admin_accoda_solo_le_nuove_conferme(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:clienti_appuntamento_changelist')
+
+        def conferma(appuntamenti):
+            with CaptureQueriesContext(connection) as query:
+                self.client.post(url, {
+                    'action': 'conferma_appuntamenti', '_selected_action': [a.pk for a in appuntamenti],
+                })
+            return len(query)
+
+        gia_confermato, richiesto = self._crea(['CONFERMATO', 'RICHIESTO'])
+        poche = conferma([gia_confermato, richiesto])
+        messaggi = MessaggioEmail.objects.filter(oggetto__startswith='Conferma')
+        self.assertEqual(messaggi.count(), 1)
+        self.assertIn('06/05/2030 alle 10:00', messaggi.get().corpo)
+
+        # Una settimana intera: stesse query, un'email per appuntamento
+        settimana = self._crea(['RICHIESTO'] * 40)
+        self.assertEqual(conferma(settimana), poche)
+        self.assertEqual(messaggi.count(), 41)
+
+
+
+@override_settings(APPUNTAMENTI_FEED_TOKEN='segreto-di-prova')
+class AgendaIcsTest(TestCase):
+    def setUp(self):
+        self.url = reverse('clienti:agenda_ics', args=['segreto-di-prova'])
+        self.cliente = Cliente.objects.create(
+            nome='Mario', cognome='Rossi, Jr.', email='mario@example.com', telefono='3331234567'
+        )
+        self.consulenza = Appuntamento.objects.create(
+            cliente=self.cliente, data_ora=alle(10), tipo_consulenza='CONSULENZA', stato='CONFERMATO',
+            note='Cucina ad angolo; portare le misure della parete e la planimetria della casa nuova',
+        )
+        self.rilievo = Appuntamento.objects.create(cliente=self.cliente, data_ora=alle(15), tipo_consulenza='RILIEVO')
+        self.annullato = Appuntamento.objects.create(
+            cliente=self.cliente, data_ora=alle(11), tipo_consulenza='ALTRO', stato='ANNULLATO'
+        )
+
+    def _ics(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_token_richiesto(self):
+        self.assertEqual(self.client.get(reverse('clienti:agenda_ics', args=['sbagliato'])).status_code, 404)
+        with self.settings(APPUNTAMENTI_FEED_TOKEN=''):
+            self.assertEqual(self.client.get(reverse('clienti:agenda_ics', args=['segreto-di-prova'])).status_code, 404)
+
+    def test_eventi_in_streaming(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        ics = self._ics(response)
+        self.assertTrue(ics.startswith('BEGIN:VCALENDAR\r\n') and ics.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(ics.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:appuntamento-{self.consulenza.pk}@testserver\r\n', ics)
+        # 10:00 ora di Roma (CEST) = 08:00 UTC, durata 60 minuti
+        self.assertIn('DTSTART:20300506T080000Z\r\nDTEND:20300506T090000Z\r\n', ics)
+        self.assertIn('STATUS:CONFIRMED', ics)
+        self.assertIn('STATUS:TENTATIVE', ics)
+        self.assertIn('SUMMARY:Consulenza Progettuale - Mario Rossi\\, Jr.', ics)
+        self.assertTrue(all(len(riga.encode()) <= 75 for riga in ics.split('\r\n')))
+        self.assertIn('Cucina ad angolo\\; portare', ics.replace('\r\n ', ''))
+
+    def test_filtri(self):
+        ics = self._ics(self.client.get(self.url, {'stato': 'ANNULLATO'}))
+        self.assertEqual(ics.count('BEGIN:VEVENT'), 1)
+        self.assertIn('STATUS:CANCELLED', ics)
+        ics = self._ics(self.client.get(self.url, {'tipo': ['RILIEVO', 'ALTRO']}))
+        self.assertEqual(ics.count('BEGIN:VEVENT'), 1)
+        self.assertIn(f'appuntamento-{self.rilievo.pk}@', ics)
+        self.assertEqual(self.client.get(self.url, {'stato': 'ARCHIVIATO'}).status_code, 400)
+
+    def test_etag_con_una_query(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get(self.url, {'stato': 'CONFERMATO'})['ETag'], etag)
+
+        Appuntamento.objects.filter(pk=self.rilievo.pk).conferma()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.consulenza.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_cambia_con_il_cliente(self):
+        etag = self.client.get(self.url)['ETag']
+        self.cliente.telefono = '3339876543'
+        self.cliente.save(update_fields=['telefono'])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Telefono: 3339876543', self._ics(response))
+
+        etag = response['ETag']
+        Cliente.objects.filter(pk=self.cliente.pk).update(cognome='Bianchi')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RegistrazioneConcorrenteTest(TransactionTestCase):
+    WORKER = 6
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest(
+                'SQLite in memoria usa lock di tabella senza attesa: '
+                'serve un database con scritture concorrenti'
+            )
+
+    def test_stessa_email_un_solo_cliente(self):
+        partenza = threading.Barrier(self.WORKER)
+
+        def registra(i):
+            partenza.wait()
+            try:
+                return Cliente.objects.registra(
+                    'ANNA.VERDI@example.com' if i % 2 else 'anna.verdi@example.com',
+                    nome='Anna', cognome='Verdi', telefono='3337654321',
+                )[0].pk
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.WORKER) as pool:
+            pks = set(pool.map(registra, range(self.WORKER)))
+
+        self.assertEqual(len(pks), 1)
+        self.assertEqual(Cliente.objects.count(), 1)
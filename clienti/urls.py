@@ -6,4 +6,6 @@ app_name = 'clienti'
 urlpatterns = [
     path('prenota/', views.prenota_appuntamento, name='prenota'),
     path('successo/', views.appuntamento_successo, name='appuntamento_successo'),
+    path('slot-liberi/', views.slot_liberi, name='slot_liberi'),
+    path('agenda/<str:token>.ics', views.agenda_ics, name='agenda_ics'),
 ]
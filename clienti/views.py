@@ -1,38 +1,42 @@
+import hmac
+from datetime import date, timedelta
+
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+from notifiche import outbox
+from . import calendario, disponibilita
 from .forms import AppuntamentoForm
+from .models import Appuntamento
 
-def prenota_appuntamento(request):
-    if request.method == 'POST':
-        form = AppuntamentoForm(request.POST)
-        if form.is_valid():
-            appuntamento = form.save()
-            
-            # Invia email al cliente
-            send_mail(
-                'Richiesta Appuntamento Ricevuta - Negozio Cucine',
-                f"""
+def _accoda_email_prenotazione(appuntamento):
+    # Email al cliente
+    outbox.accoda(
+        'Richiesta Appuntamento Ricevuta - Negozio Cucine',
+        f"""
                 Gentile {appuntamento.cliente.get_nome_completo()},
-                
-                Abbiamo ricevuto la sua richiesta di appuntamento per il giorno 
+
+                Abbiamo ricevuto la sua richiesta di appuntamento per il giorno
                 {appuntamento.data_ora.strftime('%d/%m/%Y alle %H:%M')}.
-                
+
                 La contatteremo a breve per confermare.
-                
+
                 Cordiali saluti,
                 Negozio Cucine
                 """,
-                settings.DEFAULT_FROM_EMAIL,
-                [appuntamento.cliente.email],
-                fail_silently=True,
-            )
-            
-            # Invia notifica all'admin
-            send_mail(
-                'Nuova Richiesta Appuntamento',
-                f"""
+        [appuntamento.cliente.email],
+    )
+
+    # Notifica all'admin (saltata se EMAIL_HOST_USER non è configurato)
+    outbox.accoda(
+        'Nuova Richiesta Appuntamento',
+        f"""
                 Nuovo appuntamento richiesto:
                 Cliente: {appuntamento.cliente.get_nome_completo()}
                 Email: {appuntamento.cliente.email}
@@ -40,20 +44,95 @@ def prenota_appuntamento(request):
                 Data: {appuntamento.data_ora.strftime('%d/%m/%Y alle %H:%M')}
                 Tipo: {appuntamento.get_tipo_consulenza_display()}
                 """,
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.EMAIL_HOST_USER],
-                fail_silently=True,
-            )
-            
-            messages.success(
-                request,
-                'Appuntamento richiesto con successo! Riceverai una conferma via email.'
-            )
-            return redirect('clienti:appuntamento_successo')
+        [settings.EMAIL_HOST_USER],
+    )
+
+def prenota_appuntamento(request):
+    if request.method == 'POST':
+        form = AppuntamentoForm(request.POST)
+        if form.is_valid():
+            try:
+                # L'appuntamento e le email in coda vengono salvati insieme
+                with transaction.atomic():
+                    appuntamento = form.save()
+                    _accoda_email_prenotazione(appuntamento)
+            except ValidationError as e:
+                # Ultimo posto occupato da una prenotazione concorrente
+                form.add_error('data_ora', e)
+            else:
+                messages.success(
+                    request,
+                    'Appuntamento richiesto con successo! Riceverai una conferma via email.'
+                )
+                return redirect('clienti:appuntamento_successo')
     else:
         form = AppuntamentoForm()
     
     return render(request, 'clienti/prenota_appuntamento.html', {'form': form})
 
+@require_GET
+def slot_liberi(request):
+    """Orari liberi per il selettore della pagina di prenotazione:
+    ?tipo=RILIEVO&dal=2026-10-19&al=2026-10-25 (date incluse)."""
+    tipo = request.GET.get('tipo', 'CONSULENZA')
+    if tipo not in dict(Appuntamento.TIPO_CONSULENZA_CHOICES):
+        return JsonResponse({'errore': 'Tipo di consulenza non valido'}, status=400)
+    try:
+        dal = date.fromisoformat(request.GET['dal']) if request.GET.get('dal') else timezone.localdate()
+        al = date.fromisoformat(request.GET['al']) if request.GET.get('al') else dal + timedelta(days=6)
+    except ValueError:
+        return JsonResponse({'errore': 'Date non valide (formato AAAA-MM-GG)'}, status=400)
+    if al < dal or (al - dal).days >= disponibilita.GIORNI_MASSIMI:
+        return JsonResponse(
+            {'errore': f'Intervallo non valido: al massimo {disponibilita.GIORNI_MASSIMI} giorni'},
+            status=400,
+        )
+
+    giorni = {}
+    for slot in disponibilita.slot_liberi(dal, al, tipo):
+        inizio = timezone.localtime(slot.inizio)
+        giorni.setdefault(inizio.date().isoformat(), []).append({
+            'inizio': inizio.isoformat(),
+            'fine': timezone.localtime(slot.fine).isoformat(),
+            'liberi': slot.liberi,
+        })
+    response = JsonResponse({
+        'tipo': tipo,
+        'durata_minuti': int(disponibilita.durata(tipo).total_seconds() // 60),
+        'giorni': [{'data': giorno, 'slot': slot} for giorno, slot in giorni.items()],
+    })
+    # Disponibilità che cambia a ogni prenotazione: niente cache intermedie
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@require_GET
+def agenda_ics(request, token):
+    """Feed iCalendar degli appuntamenti per i calendari dello staff:
+    /clienti/agenda/<token>.ics?stato=CONFERMATO&tipo=RILIEVO"""
+    atteso = getattr(settings, 'APPUNTAMENTI_FEED_TOKEN', '')
+    if not atteso or not hmac.compare_digest(token.encode(), atteso.encode()):
+        raise Http404
+    stati = sorted(set(request.GET.getlist('stato')))
+    tipi = sorted(set(request.GET.getlist('tipo')))
+    if not set(stati) <= dict(Appuntamento.STATO_CHOICES).keys():
+        return HttpResponseBadRequest('Stato non valido')
+    if not set(tipi) <= dict(Appuntamento.TIPO_CONSULENZA_CHOICES).keys():
+        return HttpResponseBadRequest('Tipo di consulenza non valido')
+
+    appuntamenti = calendario.seleziona(stati, tipi)
+    etag = calendario.etag(appuntamenti, *stati, '/', *tipi)
+    non_modificato = get_conditional_response(request, etag=etag)
+    if non_modificato is not None:
+        return non_modificato
+    response = StreamingHttpResponse(
+        calendario.flusso(appuntamenti, request.get_host().split(':')[0]),
+        content_type='text/calendar; charset=utf-8',
+    )
+    response['ETag'] = etag
+    # Dati dei clienti: niente cache condivise, e ogni richiesta ricontrolla l'ETag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = 'inline; filename="appuntamenti.ics"'
+    return response
+
 def appuntamento_successo(request):
     return render(request, 'clienti/appuntamento_successo.html')
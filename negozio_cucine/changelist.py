@@ -0,0 +1,169 @@
+"""
+Mixin comune per le liste dell'admin su tabelle grandi.
+
+- list_select_related calcolato dai campi ForeignKey di list_display (più
+  quelli dichiarati in `select_related_aggiuntivi`, ad esempio le relazioni
+  usate da __str__), invece del select_related() senza argomenti che segue
+  tutte le chiavi esterne non nulle;
+- conteggio stimato per le liste senza filtri: le statistiche del catalogo
+  su PostgreSQL, MAX(pk) su SQLite; sotto `soglia_conteggio_stimato` righe
+  il COUNT(*) esatto costa poco e viene usato comunque. La lista mostra il
+  numero come approssimato (templates/admin/pagination.html) e una pagina
+  oltre le righe reali diventa l'ultima pagina non vuota;
+- niente secondo COUNT(*) sull'intera tabella per "mostra tutti";
+- modelli di URL per i link di riga: reverse() una volta per nome, poi
+  solo sostituzione della chiave primaria;
+- ricerca su indice (`ricerca_indicizzata`), usata sia dalla casella di
+  ricerca della lista sia dall'autocompletamento: i risultati sono limitati
+  e, se non si sceglie un altro ordinamento, restano in ordine di rilevanza.
+"""
+from django.contrib.admin.views.main import ORDER_VAR
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
+from django.urls import get_script_prefix, reverse
+from django.utils.functional import cached_property
+
+# Segnaposto numerico: compatibile con i convertitori <int:...> degli URL
+SEGNAPOSTO_PK = 987654321
+
+
+def stima_righe(modello, using='default'):
+    """Numero approssimato di righe della tabella del modello, senza
+    leggerla; None se il database non offre una stima."""
+    connessione = connections[using]
+    tabella = modello._meta.db_table
+    with connessione.cursor() as cursore:
+        if connessione.vendor == 'postgresql':
+            # reltuples è aggiornato da ANALYZE/autovacuum: -1 se mai analizzata
+            cursore.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [tabella])
+            riga = cursore.fetchone()
+            return riga[0] if riga and riga[0] >= 0 else None
+        if connessione.vendor == 'sqlite':
+            # Con le chiavi intere MAX(pk) legge solo la fine dell'indice:
+            # sovrastima se ci sono state eliminazioni, mai sottostima
+            colonna = connessione.ops.quote_name(modello._meta.pk.column)
+            cursore.execute(f'SELECT MAX({colonna}) FROM {connessione.ops.quote_name(tabella)}')
+            riga = cursore.fetchone()
+            return riga[0] or 0
+    return None
+
+
+class PaginatoreStimato(Paginator):
+    """Paginator che per le liste senza filtri usa il numero stimato di
+    righe al posto del COUNT(*) esatto, se la tabella è abbastanza grande.
+
+    La stima può superare le righe reali: una pagina richiesta oltre la
+    fine viene sostituita dall'ultima pagina non vuota, ricavata dal
+    COUNT(*) esatto (solo in questo caso). `pagina_corretta` è allora il
+    numero della pagina restituita.
+    """
+
+    def __init__(self, *args, soglia=10000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.soglia = soglia
+        self.stimato = False
+        self.pagina_corretta = None
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            stima = stima_righe(queryset.model, queryset.db)
+            if stima is not None and stima >= self.soglia:
+                self.stimato = True
+                return stima
+        return super().count
+
+    def page(self, number):
+        if not self.stimato:
+            return super().page(number)
+        try:
+            pagina = super().page(number)
+        except EmptyPage:
+            pagina = None
+        if pagina is None or (pagina.number > 1 and not pagina.object_list):
+            # Stima troppo alta (righe eliminate): conteggio esatto
+            self.stimato = False
+            self.__dict__['count'] = Paginator.count.func(self)
+            self.__dict__.pop('num_pages', None)
+            pagina = super().page(self.num_pages)
+            self.pagina_corretta = pagina.number
+        return pagina
+
+
+def per_rilevanza(queryset, ids):
+    """Righe di `queryset` con pk in `ids`, nello stesso ordine."""
+    posizioni = [When(pk=pk, then=Value(posizione)) for posizione, pk in enumerate(ids)]
+    if not posizioni:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).annotate(
+        rilevanza=Case(*posizioni, output_field=IntegerField())
+    ).order_by('rilevanza')
+
+
+class ChangelistScalabileMixin:
+    select_related_aggiuntivi = ()
+    soglia_conteggio_stimato = 10000
+    show_full_result_count = False
+    # Funzione (testo, limite) -> id in ordine di rilevanza, da dichiarare
+    # come staticmethod; senza, la ricerca usa search_fields
+    ricerca_indicizzata = None
+    risultati_ricerca_massimi = 1000
+    risultati_autocompletamento_massimi = 100
+
+    def get_changelist_instance(self, request):
+        cl = super().get_changelist_instance(request)
+        pagina = getattr(cl.paginator, 'pagina_corretta', None)
+        if pagina is not None:
+            # Pagina oltre la fine della stima: numeri e link della
+            # paginazione seguono la pagina mostrata e il conteggio esatto
+            cl.page_num = pagina
+            cl.result_count = cl.paginator.count
+            cl.can_show_all = cl.result_count <= cl.list_max_show_all
+            cl.multi_page = cl.result_count > cl.list_per_page
+        return cl
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or self.ricerca_indicizzata is None:
+            return super().get_search_results(request, queryset, search_term)
+        autocompletamento = getattr(request.resolver_match, 'url_name', None) == 'autocomplete'
+        limite = self.risultati_autocompletamento_massimi if autocompletamento else self.risultati_ricerca_massimi
+        ids = self.ricerca_indicizzata(search_term, limite)
+        if ORDER_VAR in request.GET:
+            # Ordinamento scelto dall'utente nella lista: vale quello
+            return queryset.filter(pk__in=ids), False
+        return per_rilevanza(queryset, ids), False
+
+    def get_list_select_related(self, request):
+        if self.list_select_related is not False:
+            return self.list_select_related
+        campi = []
+        for nome in self.get_list_display(request):
+            if not isinstance(nome, str):
+                continue
+            try:
+                campo = self.model._meta.get_field(nome)
+            except FieldDoesNotExist:
+                continue
+            if campo.many_to_one or (campo.one_to_one and campo.concrete):
+                campi.append(nome)
+        campi += [c for c in self.select_related_aggiuntivi if c not in campi]
+        # Tupla vuota: nessun JOIN, invece del select_related() automatico
+        return tuple(campi)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return PaginatoreStimato(
+            queryset, per_page, orphans, allow_empty_first_page,
+            soglia=self.soglia_conteggio_stimato,
+        )
+
+    def url_riga(self, nome, pk):
+        """reverse(f'admin:{nome}', args=[pk]) senza risolvere l'URL per
+        ogni riga della lista."""
+        chiave = (nome, get_script_prefix())
+        modelli = self.__dict__.setdefault('_modelli_url', {})
+        if chiave not in modelli:
+            modelli[chiave] = reverse(f'admin:{nome}', args=[SEGNAPOSTO_PK]).replace(str(SEGNAPOSTO_PK), '{}', 1)
+        return modelli[chiave].format(pk)
@@ -0,0 +1,17 @@
+"""
+Segnali delle modifiche in blocco.
+
+update(), bulk_create() e bulk_update() non inviano pre_save e post_save: i
+QuerySet che le personalizzano inviano questi segnali, così le app che
+tengono dati derivati (le statistiche) si collegano dal proprio
+AppConfig.ready() e i modelli non le importano.
+"""
+from django.dispatch import Signal
+
+# Prima di un update() in blocco. Argomenti: queryset (le righe non ancora
+# modificate) e campi (i nomi dei campi aggiornati)
+pre_update = Signal()
+
+# Dopo una modifica in blocco che non passa da save(). Argomenti: pks delle
+# istanze di `sender` coinvolte, anche solo attraverso righe collegate
+modificati_in_blocco = Signal()
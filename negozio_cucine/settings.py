@@ -51,6 +51,8 @@ INSTALLED_APPS = [
     'prodotti',
     'clienti',
     'preventivi',
+    'notifiche',
+    'statistiche',
 ]
 
 MIDDLEWARE = [
@@ -97,6 +99,53 @@ DATABASES = {
 }
 
 
+# Cache
+# La versione del catalogo vive in cache e deve essere la stessa per tutti i
+# worker gunicorn: il backend predefinito è la tabella nel database
+# (creata da `manage.py createcachetable`, vedi build.sh). CACHE_BACKEND e
+# CACHE_LOCATION permettono di passare a Redis o Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'negozio_cucine_cache'),
+    }
+}
+
+CATALOGO_CACHE_TIMEOUT = 600
+CATALOGO_CACHE_STALE = 300
+
+# PDF dei preventivi già generati, indirizzati per contenuto (vedi preventivi/cache_pdf.py)
+PREVENTIVI_PDF_CACHE_DIR = os.environ.get('PREVENTIVI_PDF_CACHE_DIR', BASE_DIR / 'cache' / 'preventivi_pdf')
+PREVENTIVI_PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Agenda degli appuntamenti in showroom (vedi clienti/disponibilita.py)
+# Fasce di apertura per giorno della settimana (0 = lunedì), ora locale
+APPUNTAMENTI_ORARI = {
+    0: [('09:00', '18:00')],
+    1: [('09:00', '18:00')],
+    2: [('09:00', '18:00')],
+    3: [('09:00', '18:00')],
+    4: [('09:00', '18:00')],
+    5: [('09:00', '13:00')],
+}
+# Durata in minuti per tipo di consulenza
+APPUNTAMENTI_DURATE = {'CONSULENZA': 60, 'RILIEVO': 120, 'PREVENTIVO': 45, 'ALTRO': 30}
+# Appuntamenti che lo showroom può seguire in contemporanea
+APPUNTAMENTI_CAPACITA = 2
+# Distanza in minuti tra due orari di inizio proposti
+APPUNTAMENTI_PASSO = 30
+# Preavviso minimo in minuti per una prenotazione online
+APPUNTAMENTI_PREAVVISO = 120
+# Promemoria automatici, in minuti prima dell'appuntamento: il comando
+# `python manage.py invia_promemoria_appuntamenti --continuo` va tenuto
+# attivo (o eseguito da cron) accanto al worker delle email
+APPUNTAMENTI_PROMEMORIA = [24 * 60, 2 * 60]
+# Feed iCalendar dell'agenda per i calendari dello staff, da sottoscrivere
+# all'indirizzo /clienti/agenda/<token>.ics (vedi clienti/calendario.py):
+# senza token il feed è disattivato
+APPUNTAMENTI_FEED_TOKEN = os.environ.get('APPUNTAMENTI_FEED_TOKEN', '')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -164,3 +213,7 @@ DEFAULT_FROM_EMAIL = 'Negozio Cucine <noreply@negoziocucine.it>'
 # EMAIL_USE_TLS = True
 # EMAIL_HOST_USER = 'your-email@gmail.com'
 # EMAIL_HOST_PASSWORD = 'your-app-password'
+
+# Le email vengono messe in coda (app notifiche) e spedite dal comando
+# `python manage.py invia_email --continuo`, da tenere attivo come processo
+# separato accanto al server web.
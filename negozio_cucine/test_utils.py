@@ -0,0 +1,24 @@
+"""
+Utilità condivise dai test delle app.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from clienti.models import Cliente
+
+
+def crea_cliente(email='mario.rossi@example.com'):
+    return Cliente.objects.create(
+        nome='Mario', cognome='Rossi', email=email, telefono='3331234567',
+    )
+
+
+class QueryListaMixin:
+    """Per i TestCase che verificano il numero di query delle liste dell'admin."""
+
+    def _query_lista(self, url):
+        """GET di `url`; restituisce la risposta e il numero di query eseguite."""
+        with CaptureQueriesContext(connection) as query:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(query)
@@ -0,0 +1,32 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import MessaggioEmail
+
+@admin.register(MessaggioEmail)
+class MessaggioEmailAdmin(admin.ModelAdmin):
+    list_display = ['oggetto', 'destinatari', 'stato', 'tentativi', 'prossimo_tentativo', 'data_creazione', 'data_invio']
+    list_filter = ['stato', 'data_creazione']
+    search_fields = ['oggetto', 'destinatari']
+    date_hierarchy = 'data_creazione'
+    # Il contenuto degli allegati (base64) non si mostra: solo i nomi
+    exclude = ['allegati']
+    readonly_fields = [
+        'oggetto', 'corpo', 'mittente', 'destinatari', 'nomi_allegati', 'tentativi',
+        'prossimo_tentativo', 'ultimo_errore', 'data_creazione', 'data_invio'
+    ]
+    
+    actions = ['rimetti_in_coda']
+    
+    @admin.action(description='Rimetti in coda i messaggi non recapitati')
+    def rimetti_in_coda(self, request, queryset):
+        updated = queryset.filter(stato='FALLITO').update(
+            stato='IN_CODA', tentativi=0, prossimo_tentativo=timezone.now()
+        )
+        self.message_user(request, f'{updated} messaggi rimessi in coda.')
+    
+    @admin.display(description='Allegati')
+    def nomi_allegati(self, obj):
+        return ', '.join(allegato['nome'] for allegato in obj.allegati) or '-'
+    
+    def has_add_permission(self, request):
+        return False
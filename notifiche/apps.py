@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class NotificheConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'notifiche'
+    verbose_name = 'Notifiche'
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from notifiche import outbox
+
+
+class Command(BaseCommand):
+    help = 'Spedisce le email in coda, a blocchi su una sola connessione al server di posta'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocco',
+            type=int,
+            default=outbox.DIMENSIONE_BLOCCO,
+            help=f'Email spedite per ogni connessione (default {outbox.DIMENSIONE_BLOCCO})',
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Resta in esecuzione e controlla la coda a intervalli regolari',
+        )
+        parser.add_argument(
+            '--intervallo',
+            type=float,
+            default=10,
+            help='Secondi di attesa fra un controllo e il successivo (default 10)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            inviati, falliti = outbox.svuota_coda(options['blocco'])
+            if inviati or falliti or not options['continuo']:
+                self.stdout.write(f'{inviati} email inviate, {falliti} non riuscite')
+            if not options['continuo']:
+                return
+            close_old_connections()
+            time.sleep(options['intervallo'])
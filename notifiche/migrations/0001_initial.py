@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessaggioEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('oggetto', models.CharField(max_length=255, verbose_name='Oggetto')),
+                ('corpo', models.TextField(verbose_name='Testo')),
+                ('mittente', models.CharField(max_length=255, verbose_name='Mittente')),
+                ('destinatari', models.JSONField(default=list, verbose_name='Destinatari')),
+                ('allegati', models.JSONField(blank=True, default=list, verbose_name='Allegati')),
+                ('stato', models.CharField(choices=[('IN_CODA', 'In coda'), ('INVIATO', 'Inviato'), ('FALLITO', 'Non recapitabile')], default='IN_CODA', max_length=20, verbose_name='Stato')),
+                ('tentativi', models.PositiveSmallIntegerField(default=0, verbose_name='Tentativi')),
+                ('prossimo_tentativo', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Prossimo tentativo')),
+                ('ultimo_errore', models.TextField(blank=True, verbose_name='Ultimo errore')),
+                ('data_creazione', models.DateTimeField(auto_now_add=True)),
+                ('data_invio', models.DateTimeField(blank=True, null=True, verbose_name='Data invio')),
+            ],
+            options={
+                'verbose_name': 'Email in uscita',
+                'verbose_name_plural': 'Email in uscita',
+                'ordering': ['-data_creazione'],
+                'indexes': [models.Index(fields=['stato', 'prossimo_tentativo'], name='messaggio_coda_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifiche', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messaggioemail',
+            name='prenotazione',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import models
+from django.utils import timezone
+
+class MessaggioEmail(models.Model):
+    """Email in uscita. Viene scritta nella stessa transazione della modifica
+    che la origina e spedita dal comando invia_email (vedi outbox.py)."""
+    
+    STATO_CHOICES = [
+        ('IN_CODA', 'In coda'),
+        ('INVIATO', 'Inviato'),
+        ('FALLITO', 'Non recapitabile'),
+    ]
+    
+    oggetto = models.CharField(max_length=255, verbose_name="Oggetto")
+    corpo = models.TextField(verbose_name="Testo")
+    mittente = models.CharField(max_length=255, verbose_name="Mittente")
+    destinatari = models.JSONField(default=list, verbose_name="Destinatari")
+    # Allegati prodotti al momento dell'accodamento, contenuto in base64:
+    # [{'nome': ..., 'contenuto': ..., 'mimetype': ...}]
+    allegati = models.JSONField(default=list, blank=True, verbose_name="Allegati")
+    stato = models.CharField(
+        max_length=20,
+        choices=STATO_CHOICES,
+        default='IN_CODA',
+        verbose_name="Stato"
+    )
+    tentativi = models.PositiveSmallIntegerField(default=0, verbose_name="Tentativi")
+    prossimo_tentativo = models.DateTimeField(default=timezone.now, verbose_name="Prossimo tentativo")
+    # Token del worker che ha prelevato il messaggio (vedi outbox.preleva_blocco)
+    prenotazione = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
+    ultimo_errore = models.TextField(blank=True, verbose_name="Ultimo errore")
+    data_creazione = models.DateTimeField(auto_now_add=True)
+    data_invio = models.DateTimeField(null=True, blank=True, verbose_name="Data invio")
+    
+    class Meta:
+        verbose_name = "Email in uscita"
+        verbose_name_plural = "Email in uscita"
+        ordering = ['-data_creazione']
+        indexes = [
+            # Coda del worker: messaggi in attesa già scaduti, dal più vecchio
+            models.Index(fields=['stato', 'prossimo_tentativo'], name='messaggio_coda_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.oggetto} → {', '.join(self.destinatari)}"
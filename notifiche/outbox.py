@@ -0,0 +1,182 @@
+"""
+Coda delle email in uscita (outbox).
+
+Le viste e le azioni admin non spediscono più direttamente: accoda()
+scrive un MessaggioEmail nella transazione in corso, quindi l'email esiste
+se e solo se la modifica che la origina è stata salvata. Il comando
+invia_email preleva i messaggi scaduti a blocchi e li spedisce tutti su
+un'unica connessione al server di posta. Gli allegati sono prodotti al
+momento dell'accodamento e salvati nel messaggio: l'invio non dipende da
+oggetti che nel frattempo possono essere cambiati o eliminati.
+
+Un invio fallito viene ritentato con attesa esponenziale (RITARDO_BASE,
+raddoppiato a ogni tentativo fino a RITARDO_MASSIMO); dopo
+TENTATIVI_MASSIMI il messaggio passa nello stato FALLITO e resta visibile
+in admin, da dove può essere rimesso in coda.
+"""
+import base64
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MessaggioEmail
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONE_BLOCCO = 50
+TENTATIVI_MASSIMI = 5
+RITARDO_BASE = timedelta(minutes=1)
+RITARDO_MASSIMO = timedelta(hours=1)
+# Un blocco prelevato resta riservato al worker per questo tempo: se il
+# worker muore durante l'invio, i messaggi tornano disponibili
+DURATA_PRENOTAZIONE = timedelta(minutes=10)
+
+
+def nuovo_messaggio(oggetto, corpo, destinatari, mittente=None, allegati=()):
+    """MessaggioEmail non ancora salvato (per accoda_in_blocco).
+
+    `allegati` è una sequenza di (nome file, contenuto, mimetype), come per
+    EmailMessage.attach.
+    """
+    return MessaggioEmail(
+        oggetto=oggetto,
+        corpo=corpo,
+        mittente=mittente or settings.DEFAULT_FROM_EMAIL,
+        destinatari=[destinatario for destinatario in destinatari if destinatario],
+        allegati=[
+            {'nome': nome, 'contenuto': base64.b64encode(contenuto).decode(), 'mimetype': mimetype}
+            for nome, contenuto, mimetype in allegati
+        ],
+    )
+
+
+def accoda(oggetto, corpo, destinatari, mittente=None, allegati=()):
+    """Salva un'email da spedire nella transazione corrente."""
+    messaggio = nuovo_messaggio(oggetto, corpo, destinatari, mittente, allegati)
+    if not messaggio.destinatari:
+        return None
+    messaggio.save()
+    return messaggio
+
+
+def accoda_in_blocco(messaggi):
+    return MessaggioEmail.objects.bulk_create([m for m in messaggi if m.destinatari])
+
+
+def ritardo(tentativi):
+    # L'esponente è limitato: timedelta non accetta moltiplicatori enormi
+    return min(RITARDO_BASE * 2 ** min(tentativi - 1, 20), RITARDO_MASSIMO)
+
+
+def _candidati(adesso, dimensione):
+    # Sotto PostgreSQL skip_locked fa scegliere blocchi diversi a worker in
+    # parallelo; dove select_for_update non esiste (SQLite) è ignorato
+    return list(
+        MessaggioEmail.objects.select_for_update(skip_locked=True)
+        .filter(stato='IN_CODA', prossimo_tentativo__lte=adesso)
+        .order_by('prossimo_tentativo', 'pk')
+        .values_list('pk', flat=True)[:dimensione]
+    )
+
+
+def preleva_blocco(dimensione=DIMENSIONE_BLOCCO):
+    """Riserva al worker corrente i prossimi messaggi da spedire.
+
+    La prenotazione è un UPDATE condizionato: scrive il token del worker e
+    sposta in avanti prossimo_tentativo solo sui messaggi ancora in coda e
+    scaduti. Se due worker scelgono gli stessi messaggi l'UPDATE li assegna
+    a uno solo, su qualsiasi database; il worker riceve i messaggi che
+    portano il suo token.
+    """
+    while True:
+        adesso = timezone.now()
+        prenotazione = uuid.uuid4()
+        with transaction.atomic():
+            candidati = _candidati(adesso, dimensione)
+            if not candidati:
+                return []
+            MessaggioEmail.objects.filter(
+                pk__in=candidati, stato='IN_CODA', prossimo_tentativo__lte=adesso,
+            ).update(prenotazione=prenotazione, prossimo_tentativo=adesso + DURATA_PRENOTAZIONE)
+        messaggi = list(
+            MessaggioEmail.objects.filter(prenotazione=prenotazione).order_by('prossimo_tentativo', 'pk')
+        )
+        if messaggi:
+            return messaggi
+        # Tutti presi da un altro worker nel frattempo: si sceglie di nuovo
+
+
+def _email(messaggio, connection):
+    email = EmailMessage(
+        subject=messaggio.oggetto,
+        body=messaggio.corpo,
+        from_email=messaggio.mittente,
+        to=messaggio.destinatari,
+        connection=connection,
+    )
+    for allegato in messaggio.allegati:
+        email.attach(allegato['nome'], base64.b64decode(allegato['contenuto']), allegato['mimetype'])
+    return email
+
+
+def _registra_fallimento(messaggio, errore, adesso):
+    messaggio.tentativi += 1
+    messaggio.ultimo_errore = f'{type(errore).__name__}: {errore}'
+    if messaggio.tentativi >= TENTATIVI_MASSIMI:
+        messaggio.stato = 'FALLITO'
+        logger.error('Email %s non recapitabile: %s', messaggio.pk, messaggio.ultimo_errore)
+    else:
+        messaggio.prossimo_tentativo = adesso + ritardo(messaggio.tentativi)
+    messaggio.save(update_fields=['tentativi', 'ultimo_errore', 'stato', 'prossimo_tentativo'])
+
+
+def invia_blocco(messaggi, connection=None):
+    """Spedisce `messaggi` su una sola connessione; restituisce (inviati, falliti)."""
+    if not messaggi:
+        return 0, 0
+    connection = connection or get_connection(fail_silently=False)
+    inviati = falliti = 0
+    try:
+        connection.open()
+    except Exception as errore:
+        adesso = timezone.now()
+        for messaggio in messaggi:
+            _registra_fallimento(messaggio, errore, adesso)
+        return 0, len(messaggi)
+
+    try:
+        for messaggio in messaggi:
+            try:
+                # Un messaggio alla volta sulla connessione già aperta: un
+                # destinatario rifiutato non blocca gli altri del blocco
+                connection.send_messages([_email(messaggio, connection)])
+            except Exception as errore:
+                _registra_fallimento(messaggio, errore, timezone.now())
+                falliti += 1
+            else:
+                # Segnato subito: se il worker si interrompe a metà blocco, i
+                # messaggi già spediti non tornano in coda a fine prenotazione
+                MessaggioEmail.objects.filter(pk=messaggio.pk).update(
+                    stato='INVIATO', data_invio=timezone.now(), ultimo_errore=''
+                )
+                inviati += 1
+    finally:
+        connection.close()
+    return inviati, falliti
+
+
+def svuota_coda(dimensione=DIMENSIONE_BLOCCO):
+    """Spedisce a blocchi tutti i messaggi scaduti; restituisce (inviati, falliti)."""
+    totale_inviati = totale_falliti = 0
+    while True:
+        messaggi = preleva_blocco(dimensione)
+        if not messaggi:
+            return totale_inviati, totale_falliti
+        inviati, falliti = invia_blocco(messaggi)
+        totale_inviati += inviati
+        totale_falliti += falliti
@@ -0,0 +1,216 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from clienti.models import Appuntamento
+from negozio_cucine.test_utils import crea_cliente
+from preventivi.models import Preventivo
+
+from . import outbox
+from .models import MessaggioEmail
+
+
+class BackendConConteggio(EmailBackend):
+    """Backend locmem che conta le connessioni aperte."""
+    aperture = 0
+
+    def open(self):
+        BackendConConteggio.aperture += 1
+        return super().open()
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTest(TestCase):
+    def test_accoda_non_spedisce(self):
+        outbox.accoda('Oggetto', 'Testo', ['cliente@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+        messaggio = MessaggioEmail.objects.get()
+        self.assertEqual(messaggio.stato, 'IN_CODA')
+        self.assertEqual(messaggio.destinatari, ['cliente@example.com'])
+
+    def test_rollback_annulla_il_messaggio(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.accoda('Oggetto', 'Testo', ['cliente@example.com'])
+                raise RuntimeError
+        self.assertFalse(MessaggioEmail.objects.exists())
+
+    def test_senza_destinatari_non_accoda(self):
+        self.assertIsNone(outbox.accoda('Oggetto', 'Testo', ['']))
+        self.assertEqual(outbox.accoda_in_blocco([outbox.nuovo_messaggio('Oggetto', 'Testo', [])]), [])
+        self.assertFalse(MessaggioEmail.objects.exists())
+
+    @override_settings(EMAIL_BACKEND='notifiche.tests.BackendConConteggio')
+    def test_blocco_spedito_su_una_connessione(self):
+        outbox.accoda_in_blocco(
+            outbox.nuovo_messaggio(f'Oggetto {i}', 'Testo', [f'cliente{i}@example.com'])
+            for i in range(5)
+        )
+        BackendConConteggio.aperture = 0
+        self.assertEqual(outbox.svuota_coda(dimensione=10), (5, 0))
+        self.assertEqual(BackendConConteggio.aperture, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(MessaggioEmail.objects.exclude(stato='INVIATO').exists())
+        self.assertFalse(MessaggioEmail.objects.filter(data_invio__isnull=True).exists())
+
+        # Già inviati: un secondo passaggio non spedisce nulla
+        self.assertEqual(outbox.svuota_coda(), (0, 0))
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_messaggi_futuri_non_prelevati(self):
+        messaggio = outbox.accoda('Oggetto', 'Testo', ['cliente@example.com'])
+        MessaggioEmail.objects.filter(pk=messaggio.pk).update(
+            prossimo_tentativo=timezone.now() + timedelta(minutes=5)
+        )
+        self.assertEqual(outbox.preleva_blocco(), [])
+
+    def test_errore_riprogrammato_con_attesa_esponenziale(self):
+        messaggio = outbox.accoda('Oggetto', 'Testo', ['cliente@example.com'])
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=ConnectionError('rifiutato')):
+            prima = timezone.now()
+            self.assertEqual(outbox.svuota_coda(), (0, 1))
+        messaggio.refresh_from_db()
+        self.assertEqual(messaggio.stato, 'IN_CODA')
+        self.assertEqual(messaggio.tentativi, 1)
+        self.assertIn('rifiutato', messaggio.ultimo_errore)
+        self.assertGreaterEqual(messaggio.prossimo_tentativo, prima + outbox.RITARDO_BASE)
+
+        self.assertEqual(outbox.ritardo(2), outbox.RITARDO_BASE * 2)
+        self.assertEqual(outbox.ritardo(3), outbox.RITARDO_BASE * 4)
+        self.assertEqual(outbox.ritardo(50), outbox.RITARDO_MASSIMO)
+
+    def test_messaggio_fallito_non_blocca_gli_altri(self):
+        outbox.accoda('Primo', 'Testo', ['uno@example.com'])
+        outbox.accoda('Secondo', 'Testo', ['due@example.com'])
+        originale = EmailBackend.send_messages
+
+        def rifiuta_il_primo(backend, messaggi):
+            if messaggi[0].subject == 'Primo':
+                raise ValueError('indirizzo rifiutato')
+            return originale(backend, messaggi)
+
+        with mock.patch.object(EmailBackend, 'send_messages', rifiuta_il_primo):
+            self.assertEqual(outbox.svuota_coda(), (1, 1))
+        self.assertEqual([email.subject for email in mail.outbox], ['Secondo'])
+        self.assertEqual(MessaggioEmail.objects.get(oggetto='Primo').stato, 'IN_CODA')
+
+    def test_dopo_troppi_tentativi_non_recapitabile(self):
+        messaggio = outbox.accoda('Oggetto', 'Testo', ['cliente@example.com'])
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=ConnectionError('rifiutato')):
+            with self.assertLogs('notifiche.outbox', 'ERROR'):
+                for _ in range(outbox.TENTATIVI_MASSIMI):
+                    MessaggioEmail.objects.filter(pk=messaggio.pk).update(prossimo_tentativo=timezone.now())
+                    outbox.svuota_coda()
+        messaggio.refresh_from_db()
+        self.assertEqual(messaggio.stato, 'FALLITO')
+        self.assertEqual(messaggio.tentativi, outbox.TENTATIVI_MASSIMI)
+        self.assertEqual(outbox.preleva_blocco(), [])
+
+        # Rimesso in coda dall'admin viene spedito al passaggio successivo
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.post(reverse('admin:notifiche_messaggioemail_changelist'), {
+            'action': 'rimetti_in_coda', '_selected_action': [messaggio.pk],
+        })
+        call_command('invia_email', stdout=mock.MagicMock())
+        messaggio.refresh_from_db()
+        self.assertEqual(messaggio.stato, 'INVIATO')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_spediti_segnati_subito_se_il_worker_si_interrompe(self):
+        outbox.accoda('Primo', 'Testo', ['uno@example.com'])
+        outbox.accoda('Secondo', 'Testo', ['due@example.com'])
+        originale = EmailBackend.send_messages
+
+        def interrompi_al_secondo(backend, messaggi):
+            if messaggi[0].subject == 'Secondo':
+                raise SystemExit
+            return originale(backend, messaggi)
+
+        with mock.patch.object(EmailBackend, 'send_messages', interrompi_al_secondo):
+            with self.assertRaises(SystemExit):
+                outbox.svuota_coda()
+        self.assertEqual(MessaggioEmail.objects.get(oggetto='Primo').stato, 'INVIATO')
+        self.assertEqual(MessaggioEmail.objects.get(oggetto='Secondo').stato, 'IN_CODA')
+
+    def test_messaggi_presi_da_altro_worker_non_prelevati(self):
+        for i in range(3):
+            outbox.accoda(f'Oggetto {i}', 'Testo', [f'cliente{i}@example.com'])
+        originale = outbox._candidati
+        altro_worker = []
+
+        def prelevati_nel_frattempo(adesso, dimensione):
+            candidati = originale(adesso, dimensione)
+            if not altro_worker:
+                # Un altro worker prenota gli stessi messaggi prima dell'UPDATE
+                altro_worker.append(None)
+                altro_worker.extend(outbox.preleva_blocco(2))
+            return candidati
+
+        with mock.patch.object(outbox, '_candidati', side_effect=prelevati_nel_frattempo):
+            messaggi = outbox.preleva_blocco()
+        self.assertEqual([m.oggetto for m in altro_worker[1:]], ['Oggetto 0', 'Oggetto 1'])
+        self.assertEqual([m.oggetto for m in messaggi], ['Oggetto 2'])
+        self.assertEqual(outbox.preleva_blocco(), [])
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailApplicazioneTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    @override_settings(EMAIL_HOST_USER='negozio@example.com')
+    def test_prenotazione_accoda_email_cliente_e_negozio(self):
+        response = self.client.post(reverse('clienti:prenota'), {
+            'nome': 'Mario', 'cognome': 'Rossi', 'email': 'mario.rossi@example.com',
+            'telefono': '3331234567', 'data_ora': '2030-05-10T10:00',
+            'tipo_consulenza': 'CONSULENZA', 'note': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(destinatari for destinatari in MessaggioEmail.objects.values_list('destinatari', flat=True)),
+            [['mario.rossi@example.com'], ['negozio@example.com']],
+        )
+        outbox.svuota_coda()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_conferma_appuntamenti_accoda_in_blocco(self):
+        cliente = crea_cliente()
+        appuntamenti = [
+            Appuntamento.objects.create(cliente=cliente, data_ora=timezone.now() + timedelta(days=giorni))
+            for giorni in (1, 2)
+        ]
+        self.client.post(reverse('admin:clienti_appuntamento_changelist'), {
+            'action': 'conferma_appuntamenti', '_selected_action': [a.pk for a in appuntamenti],
+        })
+        self.assertEqual(MessaggioEmail.objects.filter(oggetto__startswith='Conferma').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_email_preventivo_con_pdf_salvato_nel_messaggio(self):
+        cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cartella, ignore_errors=True)
+        preventivo = Preventivo.objects.create(cliente=crea_cliente(), sconto_percentuale=Decimal('0'))
+
+        with override_settings(PREVENTIVI_PDF_CACHE_DIR=cartella):
+            self.client.get(reverse('admin:preventivi_preventivo_email', args=[preventivo.pk]))
+            preventivo.refresh_from_db()
+            self.assertEqual(preventivo.stato, 'INVIATO')
+            self.assertEqual(len(mail.outbox), 0)
+
+        # Il PDF è nel messaggio: l'invio non dipende più dal preventivo
+        preventivo.delete()
+        self.assertEqual(outbox.svuota_coda(), (1, 0))
+        nome, contenuto, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual(nome, f'preventivo_{preventivo.numero_preventivo}.pdf')
+        self.assertTrue(contenuto.startswith(b'%PDF'))
+        self.assertEqual(mimetype, 'application/pdf')
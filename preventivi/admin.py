@@ -1,17 +1,17 @@
 from django.contrib import admin
 from django.urls import reverse, path
 from django.utils.html import format_html
-from django.http import HttpResponse
-from django.core.mail import EmailMessage
-from django.conf import settings
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.pdfgen import canvas
-import io
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.cache import get_conditional_response
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from datetime import datetime
+from . import cache_pdf, esportazione, pdf
+from negozio_cucine.changelist import ChangelistScalabileMixin
+from notifiche import outbox
+from .forms import ImportaVociForm
 from .models import Preventivo, VocePreventivo
 
 class VocePreventivoInline(admin.TabularInline):
@@ -21,7 +21,7 @@ class VocePreventivoInline(admin.TabularInline):
     autocomplete_fields = ['prodotto']
 
 @admin.register(Preventivo)
-class PreventivoAdmin(admin.ModelAdmin):
+class PreventivoAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
     list_display = [
         'numero_preventivo',
         'cliente',
@@ -37,7 +37,7 @@ class PreventivoAdmin(admin.ModelAdmin):
         'cliente__cognome',
         'cliente__email'
     ]
-    readonly_fields = ['numero_preventivo', 'totale_stimato', 'data_creazione']
+    readonly_fields = ['numero_preventivo', 'subtotale', 'totale_stimato', 'data_creazione']
     inlines = [VocePreventivoInline]
     autocomplete_fields = ['cliente']
     
@@ -46,7 +46,7 @@ class PreventivoAdmin(admin.ModelAdmin):
             'fields': ('cliente', 'numero_preventivo')
         }),
         ('Stato e Importo', {
-            'fields': ('stato', 'totale_stimato', 'sconto_percentuale')
+            'fields': ('stato', 'subtotale', 'sconto_percentuale', 'totale_stimato')
         }),
         ('Dettagli', {
             'fields': ('validita_giorni', 'note', 'data_creazione')
@@ -56,17 +56,35 @@ class PreventivoAdmin(admin.ModelAdmin):
     actions = [
         'marca_come_inviato',
         'marca_come_accettato',
+        'duplica_preventivi',
         'genera_pdf',
         'invia_email_preventivo'
     ]
     
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not VocePreventivo:
+            return super().save_formset(request, form, formset, change)
+        # Il totale viene ricalcolato una sola volta in save_related()
+        voci = formset.save(commit=False)
+        for voce in formset.deleted_objects:
+            voce.delete(aggiorna_totale=False)
+        for voce in voci:
+            voce.save(aggiorna_totale=False)
+        formset.save_m2m()
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.aggiorna_totale()
+    
     def azioni_preventivo(self, obj):
-        pdf_url = reverse('admin:preventivi_preventivo_pdf', args=[obj.pk])
-        email_url = reverse('admin:preventivi_preventivo_email', args=[obj.pk])
+        pdf_url = self.url_riga('preventivi_preventivo_pdf', obj.pk)
+        email_url = self.url_riga('preventivi_preventivo_email', obj.pk)
+        importa_url = self.url_riga('preventivi_preventivo_importa_voci', obj.pk)
         return format_html(
             '<a class="button" href="{}">PDF</a>&nbsp;'
-            '<a class="button" href="{}">Email</a>',
-            pdf_url, email_url
+            '<a class="button" href="{}">Email</a>&nbsp;'
+            '<a class="button" href="{}">Importa voci</a>',
+            pdf_url, email_url, importa_url
         )
     azioni_preventivo.short_description = 'Azioni'
     
@@ -80,166 +98,64 @@ class PreventivoAdmin(admin.ModelAdmin):
         updated = queryset.update(stato='ACCETTATO')
         self.message_user(request, f'{updated} preventivi marcati come accettati.')
     
+    @admin.action(description='Duplica come nuove bozze')
+    def duplica_preventivi(self, request, queryset):
+        copie = queryset.duplica()
+        if len(copie) == 1:
+            url = reverse('admin:preventivi_preventivo_change', args=[copie[0].pk])
+            self.message_user(request, f'Creato il preventivo {copie[0].numero_preventivo}.')
+            return HttpResponseRedirect(url)
+        numeri = ', '.join(copia.numero_preventivo for copia in copie)
+        self.message_user(request, f'{len(copie)} preventivi duplicati: {numeri}.')
+    
     @admin.action(description='Genera PDF')
     def genera_pdf(self, request, queryset):
         if queryset.count() == 1:
-            preventivo = queryset.first()
+            preventivo = queryset.select_related('cliente').prefetch_related('voci__prodotto').first()
             return self._genera_pdf_response(preventivo)
-        else:
-            self.message_user(request, 'Seleziona un solo preventivo per generare il PDF.')
+        # Più preventivi: archivio ZIP generato in parallelo e inviato man mano
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        response = StreamingHttpResponse(
+            esportazione.flusso_zip(esportazione.pdf_in_parallelo(ids)),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="preventivi_{datetime.now():%Y%m%d_%H%M}.zip"'
+        return response
     
     @admin.action(description='Invia Email con PDF')
     def invia_email_preventivo(self, request, queryset):
         count = 0
-        for preventivo in queryset:
-            self._invia_email_con_pdf(preventivo)
-            preventivo.stato = 'INVIATO'
-            preventivo.save()
+        for preventivo in queryset.select_related('cliente'):
+            self._accoda_email_con_pdf(preventivo)
             count += 1
-        self.message_user(request, f'{count} preventivi inviati via email.')
+        self.message_user(request, f'{count} preventivi in coda per l\'invio email.')
     
-    def _genera_pdf_reportlab(self, preventivo):
-        """Genera PDF usando ReportLab"""
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-        
-        # Container per gli elementi del PDF
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Stile personalizzato per il titolo
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#667eea'),
-            spaceAfter=30,
-            alignment=1  # Center
-        )
-        
-        # Titolo
-        elements.append(Paragraph("PREVENTIVO", title_style))
-        elements.append(Paragraph(f"N. {preventivo.numero_preventivo}", styles['Normal']))
-        elements.append(Paragraph(f"Data: {preventivo.data_creazione.strftime('%d/%m/%Y')}", styles['Normal']))
-        elements.append(Spacer(1, 20))
-        
-        # Dati Cliente
-        elements.append(Paragraph("<b>Dati Cliente</b>", styles['Heading2']))
-        cliente_info = f"""
-        <b>Nome:</b> {preventivo.cliente.get_nome_completo()}<br/>
-        <b>Email:</b> {preventivo.cliente.email}<br/>
-        <b>Telefono:</b> {preventivo.cliente.telefono}<br/>
-        """
-        if preventivo.cliente.indirizzo:
-            cliente_info += f"<b>Indirizzo:</b> {preventivo.cliente.indirizzo}, {preventivo.cliente.cap} {preventivo.cliente.citta}"
-        
-        elements.append(Paragraph(cliente_info, styles['Normal']))
-        elements.append(Spacer(1, 20))
-        
-        # Tabella Prodotti
-        elements.append(Paragraph("<b>Dettaglio Prodotti</b>", styles['Heading2']))
-        elements.append(Spacer(1, 10))
-        
-        # Dati tabella
-        data = [['Prodotto', 'Qtà', 'Prezzo Unit.', 'Totale']]
-        
-        for voce in preventivo.voci.all():
-            prodotto_info = f"{voce.prodotto.nome}"
-            if voce.note:
-                prodotto_info += f"\n{voce.note}"
-            
-            data.append([
-                prodotto_info,
-                str(voce.quantita),
-                f"€ {voce.prezzo_unitario_finale}",
-                f"€ {voce.get_totale()}"
-            ])
-        
-        # Crea tabella
-        table = Table(data, colWidths=[8*cm, 2*cm, 3*cm, 3*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        
-        elements.append(table)
-        elements.append(Spacer(1, 20))
-        
-        # Sconto e Totale
-        if preventivo.sconto_percentuale > 0:
-            subtotale = preventivo.calcola_totale() + (preventivo.totale_stimato * preventivo.sconto_percentuale / 100)
-            sconto_text = f"""
-            <b>Subtotale:</b> € {subtotale:.2f}<br/>
-            <b>Sconto {preventivo.sconto_percentuale}%:</b> - € {(subtotale - preventivo.totale_estimato):.2f}<br/>
-            """
-            elements.append(Paragraph(sconto_text, styles['Normal']))
-        
-        # Totale in grande
-        totale_style = ParagraphStyle(
-            'Totale',
-            parent=styles['Normal'],
-            fontSize=16,
-            textColor=colors.HexColor('#667eea'),
-            spaceAfter=20,
-            alignment=2  # Right
+    def _carica_per_pdf(self, preventivo_id):
+        """Preventivo con cliente e voci già caricati per impronta e PDF"""
+        return get_object_or_404(
+            Preventivo.objects.select_related('cliente').prefetch_related('voci__prodotto'),
+            pk=preventivo_id,
         )
-        elements.append(Paragraph(f"<b>TOTALE: € {preventivo.totale_stimato}</b>", totale_style))
-        
-        # Note
-        if preventivo.note:
-            elements.append(Spacer(1, 20))
-            elements.append(Paragraph("<b>Note</b>", styles['Heading2']))
-            elements.append(Paragraph(preventivo.note, styles['Normal']))
-        
-        # Footer
-        elements.append(Spacer(1, 30))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.grey,
-            alignment=1  # Center
-        )
-        footer_text = f"""
-        <b>Negozio Cucine</b><br/>
-        Via Example 123, 00100 Roma<br/>
-        Tel: +39 123 456 7890 | Email: info@negoziocucine.it<br/>
-        P.IVA: 12345678900<br/>
-        <br/>
-        Il presente preventivo ha validità di <b>{preventivo.validita_giorni} giorni</b> dalla data di emissione.
-        """
-        elements.append(Paragraph(footer_text, footer_style))
-        
-        # Costruisci PDF
-        doc.build(elements)
-        
-        buffer.seek(0)
-        return buffer
     
-    def _genera_pdf_response(self, preventivo):
-        """Genera e restituisce PDF come risposta HTTP"""
-        pdf_buffer = self._genera_pdf_reportlab(preventivo)
-        
-        response = HttpResponse(pdf_buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="preventivo_{preventivo.numero_preventivo}.pdf"'
+    def _genera_pdf_response(self, preventivo, impronta=None):
+        """Restituisce il PDF dalla cache su disco, generandolo se necessario"""
+        impronta = impronta or cache_pdf.impronta(preventivo)
+        response = FileResponse(
+            cache_pdf.apri(preventivo, pdf.genera_pdf, impronta),
+            content_type='application/pdf',
+            filename=f'preventivo_{preventivo.numero_preventivo}.pdf',
+        )
+        response['ETag'] = f'"{impronta}"'
         return response
     
-    def _invia_email_con_pdf(self, preventivo):
-        """Invia email con PDF allegato"""
-        pdf_buffer = self._genera_pdf_reportlab(preventivo)
-        
-        email = EmailMessage(
-            subject=f'Preventivo {preventivo.numero_preventivo} - Negozio Cucine',
-            body=f"""
+    def _accoda_email_con_pdf(self, preventivo):
+        """Mette in coda l'email con il PDF allegato e segna il preventivo come
+        inviato nella stessa transazione. Il PDF (dalla cache su disco) viene
+        salvato nel messaggio: l'email parte anche se il preventivo cambia."""
+        with transaction.atomic():
+            outbox.accoda(
+                f'Preventivo {preventivo.numero_preventivo} - Negozio Cucine',
+                f"""
             Gentile {preventivo.cliente.get_nome_completo()},
             
             In allegato trova il preventivo richiesto.
@@ -251,15 +167,12 @@ class PreventivoAdmin(admin.ModelAdmin):
             Cordiali saluti,
             Negozio Cucine
             """,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[preventivo.cliente.email],
-        )
-        email.attach(
-            f'preventivo_{preventivo.numero_preventivo}.pdf',
-            pdf_buffer.read(),
-            'application/pdf'
-        )
-        email.send()
+                [preventivo.cliente.email],
+                allegati=[esportazione.allegato_pdf(preventivo.pk)],
+            )
+            preventivo.stato = 'INVIATO'
+            # Lo stato non compare nel PDF: il file in cache resta valido
+            preventivo.save(update_fields=['stato', 'data_aggiornamento'])
     
     def get_urls(self):
         urls = super().get_urls()
@@ -274,24 +187,51 @@ class PreventivoAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.email_view),
                 name='preventivi_preventivo_email',
             ),
+            path(
+                '<int:preventivo_id>/importa-voci/',
+                self.admin_site.admin_view(self.importa_voci_view),
+                name='preventivi_preventivo_importa_voci',
+            ),
         ]
         return custom_urls + urls
     
     def pdf_view(self, request, preventivo_id):
-        preventivo = Preventivo.objects.get(pk=preventivo_id)
-        return self._genera_pdf_response(preventivo)
+        preventivo = self._carica_per_pdf(preventivo_id)
+        impronta = cache_pdf.impronta(preventivo)
+        non_modificato = get_conditional_response(request, etag=f'"{impronta}"')
+        if non_modificato is not None:
+            return non_modificato
+        return self._genera_pdf_response(preventivo, impronta)
     
     def email_view(self, request, preventivo_id):
-        preventivo = Preventivo.objects.get(pk=preventivo_id)
-        self._invia_email_con_pdf(preventivo)
-        preventivo.stato = 'INVIATO'
-        preventivo.save()
-        self.message_user(request, f'Preventivo {preventivo.numero_preventivo} inviato via email.')
+        preventivo = get_object_or_404(Preventivo.objects.select_related('cliente'), pk=preventivo_id)
+        self._accoda_email_con_pdf(preventivo)
+        self.message_user(request, f'Preventivo {preventivo.numero_preventivo} in coda per l\'invio email.')
         return HttpResponse(status=302, headers={'Location': request.META.get('HTTP_REFERER')})
 
+    def importa_voci_view(self, request, preventivo_id):
+        preventivo = get_object_or_404(Preventivo.objects.select_related('cliente'), pk=preventivo_id)
+        if not self.has_change_permission(request, preventivo):
+            raise PermissionDenied
+        form = ImportaVociForm(request.POST or None, request.FILES or None, preventivo=preventivo)
+        if request.method == 'POST' and form.is_valid():
+            voci = form.save()
+            self.message_user(request, f'{len(voci)} voci importate nel preventivo {preventivo.numero_preventivo}.')
+            return HttpResponseRedirect(reverse('admin:preventivi_preventivo_change', args=[preventivo.pk]))
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Importa voci nel preventivo {preventivo.numero_preventivo}',
+            'opts': self.model._meta,
+            'original': preventivo,
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/preventivi/importa_voci.html', context)
+
 @admin.register(VocePreventivo)
-class VocePreventivoAdmin(admin.ModelAdmin):
+class VocePreventivoAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
     list_display = ['preventivo', 'prodotto', 'quantita', 'prezzo_unitario_finale', 'get_totale']
+    # Preventivo.__str__ mostra il cliente
+    select_related_aggiuntivi = ['preventivo__cliente']
     list_filter = ['preventivo__stato']
     search_fields = ['preventivo__numero_preventivo', 'prodotto__nome']
     autocomplete_fields = ['preventivo', 'prodotto']
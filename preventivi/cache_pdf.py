@@ -0,0 +1,150 @@
+"""
+Cache su disco dei PDF dei preventivi.
+
+Ogni PDF è salvato come `<id preventivo>-<impronta>.pdf`, dove l'impronta
+è lo SHA-256 di tutto ciò che compare nel documento: intestazione, voci,
+prezzi, sconto e dati del cliente. Un preventivo modificato ha quindi
+un'impronta diversa e non può mai ricevere un PDF vecchio; i file non più
+validi vengono eliminati dai segnali (vedi signals.py) o, in ultima
+istanza, dall'espulsione LRU quando la cartella supera
+PREVENTIVI_PDF_CACHE_MAX_BYTES. L'impronta è anche l'ETag di pdf_view.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+# Da incrementare quando cambia l'impaginazione del PDF
+VERSIONE_LAYOUT = 2
+
+CAMPI_CLIENTE = ('nome', 'cognome', 'email', 'telefono', 'indirizzo', 'cap', 'citta')
+
+
+def cartella():
+    percorso = Path(getattr(
+        settings, 'PREVENTIVI_PDF_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'preventivi_pdf'
+    ))
+    percorso.mkdir(parents=True, exist_ok=True)
+    return percorso
+
+
+def dimensione_massima():
+    return getattr(settings, 'PREVENTIVI_PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+
+def impronta(preventivo):
+    """SHA-256 dello stato del preventivo mostrato nel PDF. Le voci vengono
+    lette da preventivo.voci.all(), quindi da un eventuale prefetch."""
+    stato = {
+        'layout': VERSIONE_LAYOUT,
+        'preventivo': [
+            preventivo.numero_preventivo,
+            preventivo.data_creazione.isoformat(),
+            str(preventivo.subtotale),
+            str(preventivo.sconto_percentuale),
+            str(preventivo.totale_stimato),
+            preventivo.validita_giorni,
+            preventivo.note,
+        ],
+        'cliente': [getattr(preventivo.cliente, campo) for campo in CAMPI_CLIENTE],
+        'voci': [
+            [voce.prodotto.nome, voce.note, voce.quantita, str(voce.prezzo_unitario_finale)]
+            for voce in preventivo.voci.all()
+        ],
+    }
+    return hashlib.sha256(json.dumps(stato, sort_keys=True).encode()).hexdigest()
+
+
+def percorso_pdf(preventivo_id, impronta_pdf):
+    return cartella() / f'{preventivo_id}-{impronta_pdf}.pdf'
+
+
+def ottieni(preventivo, genera, impronta_pdf=None):
+    """Percorso del PDF di `preventivo`, generato con `genera(preventivo)`
+    (che restituisce i byte del documento) solo se non è già in cache."""
+    impronta_pdf = impronta_pdf or impronta(preventivo)
+    percorso = percorso_pdf(preventivo.pk, impronta_pdf)
+    try:
+        # L'ora di modifica segna l'ultimo utilizzo per l'espulsione LRU
+        os.utime(percorso)
+        return percorso
+    except FileNotFoundError:
+        pass
+
+    contenuto = genera(preventivo)
+    # Scrittura atomica: un altro processo vede il file completo o non lo vede
+    descrittore, temporaneo = tempfile.mkstemp(dir=percorso.parent, suffix='.tmp')
+    try:
+        with os.fdopen(descrittore, 'wb') as file_temporaneo:
+            file_temporaneo.write(contenuto)
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.unlink(temporaneo)
+        raise
+    espelli()
+    return percorso
+
+
+def apri(preventivo, genera, impronta_pdf=None):
+    """Come ottieni(), ma restituisce il file già aperto in lettura: un file
+    espulso da un altro processo fra i due passaggi viene rigenerato."""
+    impronta_pdf = impronta_pdf or impronta(preventivo)
+    for _ in range(2):
+        try:
+            return open(ottieni(preventivo, genera, impronta_pdf), 'rb')
+        except FileNotFoundError:
+            continue
+    return open(ottieni(preventivo, genera, impronta_pdf), 'rb')
+
+
+def espelli(limite=None):
+    """Elimina i PDF usati meno di recente finché la cartella non rientra nel limite."""
+    limite = dimensione_massima() if limite is None else limite
+    voci = []
+    totale = 0
+    for voce in os.scandir(cartella()):
+        if not voce.name.endswith('.pdf'):
+            continue
+        try:
+            stat = voce.stat()
+        except FileNotFoundError:
+            continue
+        voci.append((stat.st_mtime, stat.st_size, voce.path))
+        totale += stat.st_size
+    if totale <= limite:
+        return 0
+
+    eliminati = 0
+    for _, dimensione, percorso in sorted(voci):
+        if totale <= limite:
+            break
+        try:
+            os.unlink(percorso)
+        except FileNotFoundError:
+            pass
+        totale -= dimensione
+        eliminati += 1
+    return eliminati
+
+
+def elimina(preventivo_ids):
+    """Elimina tutti i PDF salvati per i preventivi indicati."""
+    radice = cartella()
+    for preventivo_id in set(preventivo_ids):
+        for percorso in radice.glob(f'{preventivo_id}-*.pdf'):
+            try:
+                os.unlink(percorso)
+            except FileNotFoundError:
+                pass
+
+
+def invalida(preventivo_ids):
+    """Elimina i PDF dei preventivi dopo il commit della transazione corrente."""
+    preventivo_ids = {pk for pk in preventivo_ids if pk is not None}
+    if preventivo_ids:
+        transaction.on_commit(lambda: elimina(preventivo_ids))
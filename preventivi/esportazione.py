@@ -0,0 +1,133 @@
+"""
+Esportazione in blocco dei PDF dei preventivi in un archivio ZIP.
+
+ReportLab è CPU-bound e single-thread: i PDF vengono generati in un pool
+di processi (PREVENTIVI_EXPORT_PROCESSI, di default uno per CPU; 0 li
+genera nel processo corrente) passando per la cache su disco, così i
+preventivi non modificati non vengono ridisegnati. L'archivio è prodotto
+a pezzi mentre i PDF arrivano, senza tenerlo in memoria: può essere
+inviato con una StreamingHttpResponse o scritto su file.
+"""
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+
+from . import cache_pdf, pdf
+
+# PDF in coda per ogni processo: limita la memoria occupata dai risultati
+IN_CODA_PER_PROCESSO = 2
+
+
+def numero_processi():
+    processi = getattr(settings, 'PREVENTIVI_EXPORT_PROCESSI', None)
+    if processi is None:
+        return os.cpu_count() or 1
+    return processi
+
+
+def nome_pdf(numero_preventivo):
+    return f'preventivo_{numero_preventivo}.pdf'
+
+
+def genera_pdf(preventivo_id):
+    """(nome file, contenuto) del PDF, oppure None se il preventivo non esiste più."""
+    from .models import Preventivo
+
+    preventivo = (
+        Preventivo.objects.select_related('cliente').prefetch_related('voci__prodotto')
+        .filter(pk=preventivo_id).first()
+    )
+    if preventivo is None:
+        return None
+    with cache_pdf.apri(preventivo, pdf.genera_pdf) as file_pdf:
+        return nome_pdf(preventivo.numero_preventivo), file_pdf.read()
+
+
+def allegato_pdf(preventivo_id):
+    """Allegato (nome, contenuto, mimetype) per notifiche.outbox.accoda()."""
+    from .models import Preventivo
+
+    risultato = genera_pdf(preventivo_id)
+    if risultato is None:
+        raise Preventivo.DoesNotExist(f'Preventivo {preventivo_id} eliminato')
+    return (*risultato, 'application/pdf')
+
+
+def _inizializza_processo():
+    # Con il metodo di avvio spawn il processo figlio parte senza Django
+    import django
+    django.setup()
+
+
+def pdf_in_parallelo(preventivo_ids, processi=None):
+    """Genera i PDF di `preventivo_ids` e produce (nome, contenuto) nell'ordine
+    in cui sono pronti."""
+    processi = numero_processi() if processi is None else processi
+    if processi <= 0:
+        for preventivo_id in preventivo_ids:
+            risultato = genera_pdf(preventivo_id)
+            if risultato is not None:
+                yield risultato
+        return
+
+    da_generare = iter(preventivo_ids)
+    # Con fork i figli erediterebbero le connessioni aperte del padre e le
+    # chiuderebbero uscendo: il padre le chiude prima di avviare il pool
+    connections.close_all()
+    pool = ProcessPoolExecutor(max_workers=processi, initializer=_inizializza_processo)
+    try:
+        in_corso = {
+            pool.submit(genera_pdf, preventivo_id)
+            for preventivo_id in islice(da_generare, processi * IN_CODA_PER_PROCESSO)
+        }
+        while in_corso:
+            completati, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+            for futuro in completati:
+                prossimo = next(da_generare, None)
+                if prossimo is not None:
+                    in_corso.add(pool.submit(genera_pdf, prossimo))
+                risultato = futuro.result()
+                if risultato is not None:
+                    yield risultato
+    finally:
+        # Anche quando il client interrompe il download
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Flusso:
+    """File in sola scrittura che accumula i byte fino al prossimo svuota()."""
+
+    def __init__(self):
+        self._pezzi = []
+
+    def write(self, dati):
+        self._pezzi.append(bytes(dati))
+        return len(dati)
+
+    def flush(self):
+        pass
+
+    def svuota(self):
+        dati = b''.join(self._pezzi)
+        self._pezzi = []
+        return dati
+
+
+def flusso_zip(file_pdf):
+    """Archivio ZIP dei (nome, contenuto) in `file_pdf`, prodotto a pezzi.
+    Il flusso non è ricercabile: zipfile scrive i descrittori dopo i dati."""
+    flusso = _Flusso()
+    nomi = set()
+    # I PDF sono già compressi: ZIP_STORED non spreca CPU nel processo web
+    with zipfile.ZipFile(flusso, 'w', compression=zipfile.ZIP_STORED) as archivio:
+        for nome, contenuto in file_pdf:
+            if nome in nomi:
+                continue
+            nomi.add(nome)
+            archivio.writestr(nome, contenuto)
+            yield flusso.svuota()
+    yield flusso.svuota()
@@ -0,0 +1,37 @@
+from django import forms
+from django.core.exceptions import ValidationError
+
+from . import importazione
+from .models import VocePreventivo
+
+class ImportaVociForm(forms.Form):
+    righe = forms.CharField(
+        required=False,
+        label="Voci",
+        widget=forms.Textarea(attrs={'rows': 12, 'cols': 80}),
+        help_text="Una voce per riga: prodotto (slug o id); quantità; prezzo unitario; note. "
+                  "Prezzo e note sono facoltativi: senza prezzo si usa il prezzo base del prodotto.",
+    )
+    file = forms.FileField(required=False, label="Oppure file CSV")
+    
+    def __init__(self, *args, preventivo, **kwargs):
+        self.preventivo = preventivo
+        super().__init__(*args, **kwargs)
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        testo = cleaned_data.get('righe', '')
+        file_csv = cleaned_data.get('file')
+        if file_csv:
+            try:
+                testo = file_csv.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise ValidationError("Il file deve essere un CSV in UTF-8")
+        if not testo.strip():
+            raise ValidationError("Incolla le voci o carica un file CSV")
+        cleaned_data['voci'] = importazione.prepara_voci(self.preventivo, testo)
+        return cleaned_data
+    
+    def save(self):
+        # Un solo bulk_create: il totale del preventivo viene ricalcolato una volta
+        return VocePreventivo.objects.bulk_create(self.cleaned_data['voci'])
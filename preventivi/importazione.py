@@ -0,0 +1,119 @@
+"""
+Importazione in blocco delle voci di un preventivo da CSV o testo incollato.
+
+Ogni riga contiene prodotto (slug o id), quantità e, facoltativi, prezzo
+unitario e note, separati da punto e virgola, tabulazione o virgola (in
+quest'ordine di preferenza: con la virgola i decimali vanno scritti col
+punto):
+
+    cucina-aurora;2
+    15;1;1890,00;Finitura rovere
+
+I prodotti di tutte le righe vengono letti con una sola query e
+ImportaVociForm salva le voci con un solo bulk_create, che ricalcola una
+volta il totale (vedi VocePreventivoQuerySet): anche centinaia di righe
+costano poche query.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Q
+
+from prodotti.models import Prodotto
+from .models import VocePreventivo
+
+
+def _separatore(testo):
+    for separatore in (';', '\t'):
+        if separatore in testo:
+            return separatore
+    return ','
+
+
+def _righe_csv(testo):
+    separatore = _separatore(testo)
+    righe = [riga for riga in testo.splitlines() if riga.strip()]
+    return separatore, list(csv.reader(righe, delimiter=separatore))
+
+
+def _decimale(valore):
+    # Accetta sia "1890,50" sia "1890.50"; i separatori delle migliaia non sono ammessi
+    return Decimal(valore.strip().replace(',', '.'))
+
+
+def leggi_righe(testo):
+    """Righe (numero, chiave prodotto, quantità, prezzo o None, note).
+    Solleva ValidationError con un messaggio per ogni riga non valida;
+    un'intestazione che inizia con "prodotto" viene saltata."""
+    righe = []
+    errori = []
+    separatore, righe_csv = _righe_csv(testo)
+    for numero, campi in enumerate(righe_csv, start=1):
+        # Le note possono contenere il separatore: si ricompongono i campi residui
+        note = separatore.join(campi[3:]).strip()
+        campi = [campo.strip() for campo in campi[:3]] + [''] * 3
+        chiave, quantita, prezzo = campi[:3]
+        if numero == 1 and chiave.lower() == 'prodotto':
+            continue
+        if not chiave:
+            errori.append(f'Riga {numero}: prodotto mancante')
+            continue
+        try:
+            quantita = int(quantita or 1)
+            if quantita < 1:
+                raise ValueError
+        except ValueError:
+            errori.append(f'Riga {numero}: quantità non valida "{campi[1]}"')
+            continue
+        try:
+            prezzo = _decimale(prezzo) if prezzo else None
+            if prezzo is not None and prezzo < 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            errori.append(f'Riga {numero}: prezzo non valido "{campi[2]}"')
+            continue
+        righe.append((numero, chiave, quantita, prezzo, note[:255]))
+    if errori:
+        raise ValidationError(errori)
+    if not righe:
+        raise ValidationError('Nessuna voce da importare')
+    return righe
+
+
+def risolvi_prodotti(chiavi):
+    """{chiave: Prodotto} per slug o id, con una sola query."""
+    chiavi = set(chiavi)
+    ids = {int(chiave) for chiave in chiavi if chiave.isdigit()}
+    prodotti = Prodotto.objects.filter(Q(slug__in=chiavi) | Q(pk__in=ids)).only('pk', 'slug', 'prezzo_base')
+    trovati = {}
+    for prodotto in prodotti:
+        trovati[prodotto.slug] = prodotto
+        trovati.setdefault(str(prodotto.pk), prodotto)
+    # Uno slug prevale su un id con lo stesso testo
+    return {chiave: trovati[chiave] for chiave in chiavi if chiave in trovati}
+
+
+def prepara_voci(preventivo, testo):
+    """Voci non ancora salvate descritte in `testo`, da aggiungere in coda
+    a quelle del preventivo. Solleva ValidationError con tutti gli errori."""
+    righe = leggi_righe(testo)
+    prodotti = risolvi_prodotti(chiave for _, chiave, _, _, _ in righe)
+    mancanti = [f'Riga {numero}: prodotto "{chiave}" non trovato'
+                for numero, chiave, _, _, _ in righe if chiave not in prodotti]
+    if mancanti:
+        raise ValidationError(mancanti)
+
+    ordine = preventivo.voci.aggregate(massimo=Max('ordine'))['massimo'] or 0
+    return [
+        VocePreventivo(
+            preventivo=preventivo,
+            prodotto=prodotti[chiave],
+            quantita=quantita,
+            # Prezzo già noto: bulk_create non rilegge i prodotti
+            prezzo_unitario_finale=prodotti[chiave].prezzo_base if prezzo is None else prezzo,
+            note=note,
+            ordine=ordine + indice,
+        )
+        for indice, (_, chiave, quantita, prezzo, note) in enumerate(righe, start=1)
+    ]
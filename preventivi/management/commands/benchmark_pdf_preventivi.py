@@ -0,0 +1,78 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from clienti.models import Cliente
+from preventivi import pdf
+from preventivi.models import Preventivo, VocePreventivo
+from prodotti.models import Prodotto
+
+
+def preventivo_di_prova(numero_righe):
+    """Preventivo non salvato con `numero_righe` voci: misura solo il disegno del PDF."""
+    cliente = Cliente(
+        nome='Mario', cognome='Rossi', email='mario.rossi@example.com',
+        telefono='+393331234567', indirizzo='Via Roma 1', cap='00100', citta='Roma',
+    )
+    preventivo = Preventivo(
+        cliente=cliente,
+        numero_preventivo='PREV-BENCH-00001',
+        data_creazione=timezone.now(),
+        sconto_percentuale=Decimal('10'),
+        note='Installazione e trasporto inclusi nel prezzo.',
+    )
+    voci = [
+        VocePreventivo(
+            preventivo=preventivo,
+            prodotto=Prodotto(nome=f'Cucina componibile modello {i}'),
+            quantita=1 + i % 3,
+            prezzo_unitario_finale=Decimal('1000.00') + i,
+            note='Finitura rovere naturale' if i % 4 == 0 else '',
+        )
+        for i in range(numero_righe)
+    ]
+    preventivo.subtotale = sum((voce.get_totale() for voce in voci), Decimal('0'))
+    preventivo.totale_stimato = preventivo.applica_sconto(preventivo.subtotale)
+    return preventivo, voci
+
+
+class Command(BaseCommand):
+    help = 'Misura tempo e memoria di picco della generazione dei PDF dei preventivi'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--righe',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Numero di voci dei preventivi da generare (default 10 100 1000)',
+        )
+        parser.add_argument(
+            '--ripetizioni',
+            type=int,
+            default=3,
+            help='Generazioni per ogni misura; si riporta la più veloce (default 3)',
+        )
+
+    def handle(self, *args, **options):
+        # Gli stili vengono costruiti una volta per processo: fuori dalle misure
+        pdf.stili()
+        self.stdout.write(f'{"Voci":>6}  {"Tempo (ms)":>11}  {"Picco (MB)":>10}  {"PDF (KB)":>9}')
+        for numero_righe in options['righe']:
+            preventivo, voci = preventivo_di_prova(numero_righe)
+            tempi = []
+            for _ in range(options['ripetizioni']):
+                inizio = time.perf_counter()
+                contenuto = pdf.genera_pdf(preventivo, voci)
+                tempi.append(time.perf_counter() - inizio)
+            # tracemalloc rallenta l'esecuzione: la memoria si misura a parte
+            tracemalloc.start()
+            pdf.genera_pdf(preventivo, voci)
+            picco = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.stdout.write(
+                f'{numero_righe:>6}  {min(tempi) * 1000:>11.1f}  '
+                f'{picco / 1024 / 1024:>10.2f}  {len(contenuto) / 1024:>9.1f}'
+            )
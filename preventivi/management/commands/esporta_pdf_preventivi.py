@@ -0,0 +1,65 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from preventivi import esportazione
+from preventivi.models import Preventivo
+
+
+class Command(BaseCommand):
+    help = 'Esporta in un archivio ZIP i PDF dei preventivi, generati in parallelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Percorso del file ZIP da creare')
+        parser.add_argument(
+            '--dal',
+            type=date.fromisoformat,
+            help='Data di creazione minima (AAAA-MM-GG)',
+        )
+        parser.add_argument(
+            '--al',
+            type=date.fromisoformat,
+            help='Data di creazione massima, inclusa (AAAA-MM-GG)',
+        )
+        parser.add_argument(
+            '--stato',
+            action='append',
+            choices=[codice for codice, _ in Preventivo.STATO_CHOICES],
+            help='Stato dei preventivi da esportare (ripetibile)',
+        )
+        parser.add_argument(
+            '--processi',
+            type=int,
+            help='Processi di generazione (default: uno per CPU, 0 = nessun pool)',
+        )
+
+    def handle(self, *args, **options):
+        if options['dal'] and options['al'] and options['dal'] > options['al']:
+            raise CommandError('--dal deve precedere --al')
+
+        preventivi = Preventivo.objects.all()
+        if options['dal']:
+            preventivi = preventivi.filter(data_creazione__date__gte=options['dal'])
+        if options['al']:
+            preventivi = preventivi.filter(data_creazione__date__lte=options['al'])
+        if options['stato']:
+            preventivi = preventivi.filter(stato__in=options['stato'])
+
+        ids = list(preventivi.order_by('pk').values_list('pk', flat=True))
+        self.stdout.write(f'📄 {len(ids)} preventivi da esportare...')
+
+        esportati = 0
+        file_pdf = esportazione.pdf_in_parallelo(ids, processi=options['processi'])
+
+        def conta(file_pdf):
+            nonlocal esportati
+            for elemento in file_pdf:
+                esportati += 1
+                if esportati % 50 == 0:
+                    self.stdout.write(f'  {esportati}/{len(ids)}')
+                yield elemento
+
+        with open(options['output'], 'wb') as archivio:
+            for pezzo in esportazione.flusso_zip(conta(file_pdf)):
+                archivio.write(pezzo)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ {esportati} PDF esportati in {options["output"]}'))
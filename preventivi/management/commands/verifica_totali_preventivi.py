@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from preventivi.models import Preventivo
+from negozio_cucine import segnali
+
+
+class Command(BaseCommand):
+    help = 'Verifica i totali dei preventivi e ricostruisce quelli disallineati dalle voci'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocco',
+            type=int,
+            default=500,
+            help='Preventivi esaminati per ogni blocco (default 500)',
+        )
+        parser.add_argument(
+            '--solo-verifica',
+            action='store_true',
+            help='Segnala i preventivi disallineati senza correggerli',
+        )
+
+    def _disallineato(self, preventivo):
+        if preventivo.subtotale != preventivo.subtotale_calcolato:
+            return True
+        # Un centesimo di tolleranza: sotto SQLite l'arrotondamento dello
+        # sconto avviene in virgola mobile
+        atteso = preventivo.applica_sconto(preventivo.subtotale_calcolato)
+        return abs(preventivo.totale_stimato - atteso) > Decimal('0.01')
+
+    def handle(self, *args, **options):
+        esaminati = 0
+        disallineati = []
+        ultimo_pk = 0
+        while True:
+            blocco = list(
+                Preventivo.objects.filter(pk__gt=ultimo_pk)
+                .only('subtotale', 'totale_stimato', 'sconto_percentuale')
+                .con_subtotale_calcolato()
+                .order_by('pk')[:options['blocco']]
+            )
+            if not blocco:
+                break
+            ultimo_pk = blocco[-1].pk
+            esaminati += len(blocco)
+
+            ids = [preventivo.pk for preventivo in blocco if self._disallineato(preventivo)]
+            if ids and not options['solo_verifica']:
+                Preventivo.objects.filter(pk__in=ids).ricalcola_totali()
+                segnali.modificati_in_blocco.send(sender=Preventivo, pks=ids)
+            disallineati.extend(ids)
+
+        for pk in disallineati[:20]:
+            self.stdout.write(f'  ⚠ preventivo {pk} disallineato')
+        azione = 'trovati' if options['solo_verifica'] else 'ricostruiti'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {esaminati} preventivi esaminati, {len(disallineati)} {azione}'
+        ))
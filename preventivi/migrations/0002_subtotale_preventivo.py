@@ -0,0 +1,47 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:10
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def popola_subtotali(apps, schema_editor):
+    Preventivo = apps.get_model('preventivi', 'Preventivo')
+    VocePreventivo = apps.get_model('preventivi', 'VocePreventivo')
+    subtotale = Coalesce(
+        Subquery(
+            VocePreventivo.objects.filter(preventivo=OuterRef('pk'))
+            .order_by().values('preventivo')
+            .annotate(somma=Sum(F('quantita') * F('prezzo_unitario_finale')))
+            .values('somma')
+        ),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    Preventivo.objects.update(
+        subtotale=subtotale,
+        # Per 0.01 e non diviso 100: sotto SQLite la divisione fra NUMERIC
+        # interi è una divisione intera (come _totale_scontato nel modello)
+        totale_stimato=Round(
+            subtotale * (100 - F('sconto_percentuale')) * Value(Decimal('0.01')), 2,
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preventivi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='preventivo',
+            name='subtotale',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Subtotale (€)'),
+        ),
+        migrations.RunPython(popola_subtotali, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preventivi', '0002_subtotale_preventivo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContatorePreventivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serie', models.CharField(max_length=20, unique=True, verbose_name='Serie')),
+                ('ultimo_numero', models.PositiveIntegerField(default=0, verbose_name='Ultimo numero')),
+            ],
+            options={
+                'verbose_name': 'Contatore Preventivi',
+                'verbose_name_plural': 'Contatori Preventivi',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preventivi', '0003_contatore_preventivo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='preventivo',
+            name='data_creazione',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
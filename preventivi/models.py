@@ -1,8 +1,133 @@
-from django.db import models
+from collections import Counter
+from django.db import IntegrityError, models, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
 from django.core.validators import MinValueValidator
-from decimal import Decimal
+from django.utils import timezone
+from decimal import Decimal, ROUND_HALF_UP
 from clienti.models import Cliente
+from negozio_cucine import segnali
 from prodotti.models import Prodotto
+from . import cache_pdf
+
+# Campi di VocePreventivo che concorrono al totale del preventivo
+CAMPI_TOTALE = {'preventivo', 'preventivo_id', 'quantita', 'prezzo_unitario_finale'}
+# Campi che cambiano anche la ripartizione per categoria delle statistiche
+CAMPI_STATISTICHE = CAMPI_TOTALE | {'prodotto', 'prodotto_id'}
+
+def _importo(espressione):
+    return Coalesce(
+        espressione,
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+def _totale_scontato(subtotale):
+    # Moltiplicare per 0.01 invece di dividere per 100: sotto SQLite la
+    # divisione fra NUMERIC interi è una divisione intera
+    return Round(subtotale * (100 - F('sconto_percentuale')) * Value(Decimal('0.01')), 2)
+
+class PreventivoQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # update() non invia pre_save/post_save: le azioni admin che
+        # cambiano lo stato in blocco arrivano alle statistiche da qui
+        segnali.pre_update.send(sender=self.model, queryset=self, campi=set(kwargs))
+        return super().update(**kwargs)
+    
+    def applica_variazione(self, variazione):
+        """Somma `variazione` al subtotale dei preventivi selezionati e
+        ricalcola il totale scontato nello stesso UPDATE."""
+        subtotale = F('subtotale') + Value(Decimal(variazione))
+        return self.update(
+            subtotale=subtotale,
+            totale_stimato=_totale_scontato(subtotale),
+            data_aggiornamento=timezone.now(),
+        )
+    
+    def ricalcola_totali(self):
+        """Ricalcola da zero i totali dei preventivi selezionati con un
+        solo UPDATE e una subquery aggregata sulle voci."""
+        subtotale = _importo(Subquery(
+            VocePreventivo.objects.filter(preventivo=OuterRef('pk'))
+            .order_by().values('preventivo')
+            .annotate(somma=Sum(F('quantita') * F('prezzo_unitario_finale')))
+            .values('somma')
+        ))
+        return self.update(
+            subtotale=subtotale,
+            totale_stimato=_totale_scontato(subtotale),
+            data_aggiornamento=timezone.now(),
+        )
+    
+    def duplica(self):
+        """Crea una bozza per ogni preventivo selezionato, con le stesse voci.
+        
+        I nuovi preventivi ricevono ciascuno il proprio numero; le voci di
+        tutti vengono copiate con un solo bulk_create, che ricalcola i
+        totali una volta sola. Restituisce le copie nell'ordine degli originali.
+        """
+        originali = list(self.order_by('pk'))
+        with transaction.atomic():
+            copie = {}
+            for originale in originali:
+                copie[originale.pk] = Preventivo.objects.create(
+                    cliente_id=originale.cliente_id,
+                    sconto_percentuale=originale.sconto_percentuale,
+                    validita_giorni=originale.validita_giorni,
+                    note=originale.note,
+                )
+            VocePreventivo.objects.bulk_create([
+                VocePreventivo(
+                    preventivo=copie[voce['preventivo_id']],
+                    prodotto_id=voce['prodotto_id'],
+                    quantita=voce['quantita'],
+                    prezzo_unitario_finale=voce['prezzo_unitario_finale'],
+                    note=voce['note'],
+                    ordine=voce['ordine'],
+                )
+                for voce in VocePreventivo.objects.filter(preventivo_id__in=list(copie)).values(
+                    'preventivo_id', 'prodotto_id', 'quantita', 'prezzo_unitario_finale', 'note', 'ordine'
+                ).order_by('preventivo_id', 'ordine', 'pk')
+            ])
+        # Riletti con i totali calcolati dal bulk_create
+        return list(Preventivo.objects.filter(pk__in=[c.pk for c in copie.values()]).order_by('pk'))
+    
+    def con_subtotale_calcolato(self):
+        return self.annotate(
+            subtotale_calcolato=_importo(Sum(F('voci__quantita') * F('voci__prezzo_unitario_finale')))
+        )
+
+class ContatorePreventivo(models.Model):
+    """Ultimo numero assegnato per ogni serie di numerazione (una per anno)."""
+    serie = models.CharField(max_length=20, unique=True, verbose_name="Serie")
+    ultimo_numero = models.PositiveIntegerField(default=0, verbose_name="Ultimo numero")
+    
+    class Meta:
+        verbose_name = "Contatore Preventivi"
+        verbose_name_plural = "Contatori Preventivi"
+    
+    def __str__(self):
+        return f"{self.serie}: {self.ultimo_numero}"
+    
+    @classmethod
+    def prossimo_numero(cls, serie):
+        """Incrementa il contatore della serie e restituisce il nuovo numero.
+        
+        L'UPDATE blocca la riga fino alla fine della transazione del
+        chiamante: due transazioni concorrenti non leggono mai lo stesso
+        valore e un salvataggio annullato non consuma il numero.
+        """
+        with transaction.atomic():
+            contatore = cls.objects.filter(serie=serie)
+            if not contatore.update(ultimo_numero=F('ultimo_numero') + 1):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(serie=serie, ultimo_numero=1)
+                    return 1
+                except IntegrityError:
+                    # Serie creata nel frattempo da un'altra transazione
+                    contatore.update(ultimo_numero=F('ultimo_numero') + 1)
+            return contatore.values_list('ultimo_numero', flat=True).get()
 
 class Preventivo(models.Model):
     STATO_CHOICES = [
@@ -23,7 +148,8 @@ class Preventivo(models.Model):
         unique=True,
         verbose_name="Numero Preventivo"
     )
-    data_creazione = models.DateTimeField(auto_now_add=True)
+    # Indicizzata per i ricalcoli per giorno delle statistiche
+    data_creazione = models.DateTimeField(auto_now_add=True, db_index=True)
     data_aggiornamento = models.DateTimeField(auto_now=True)
     stato = models.CharField(
         max_length=20,
@@ -31,6 +157,13 @@ class Preventivo(models.Model):
         default='BOZZA',
         verbose_name="Stato"
     )
+    subtotale = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name="Subtotale (€)"
+    )
     totale_stimato = models.DecimalField(
         max_digits=10,
         decimal_places=2,
@@ -50,6 +183,8 @@ class Preventivo(models.Model):
         verbose_name="Validità (giorni)"
     )
     
+    objects = PreventivoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Preventivo"
         verbose_name_plural = "Preventivi"
@@ -59,23 +194,126 @@ class Preventivo(models.Model):
         return f"Preventivo {self.numero_preventivo} - {self.cliente}"
     
     def save(self, *args, **kwargs):
-        if not self.numero_preventivo:
-            ultimo = Preventivo.objects.order_by('-id').first()
-            if ultimo:
-                numero = int(ultimo.numero_preventivo.split('-')[1]) + 1
-            else:
-                numero = 1
-            self.numero_preventivo = f"PREV-{numero:05d}"
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            return self._salva_esistente(*args, **kwargs)
+        self.totale_stimato = self.applica_sconto(self.subtotale)
+        if self.numero_preventivo:
+            return super().save(*args, **kwargs)
+        serie = f"PREV-{timezone.localdate().year}"
+        try:
+            with transaction.atomic():
+                numero = ContatorePreventivo.prossimo_numero(serie)
+                self.numero_preventivo = f"{serie}-{numero:05d}"
+                super().save(*args, **kwargs)
+        except Exception:
+            # Il numero è stato annullato con la transazione: non va riusato
+            self.numero_preventivo = ''
+            raise
+    
+    def _salva_esistente(self, *args, **kwargs):
+        """Salva senza scrivere subtotale e totale: il subtotale in memoria
+        può essere più vecchio di quello mantenuto dalle voci (modificate
+        nel frattempo da un'altra richiesta). Se lo sconto può essere
+        cambiato, il totale è ricalcolato in SQL dal subtotale memorizzato."""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = [
+                campo.name for campo in self._meta.concrete_fields if not campo.primary_key
+            ]
+        campi = [campo for campo in update_fields if campo not in ('subtotale', 'totale_stimato')]
+        kwargs['update_fields'] = campi
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if 'sconto_percentuale' in campi or 'totale_stimato' in update_fields:
+                models.QuerySet.update(
+                    Preventivo.objects.filter(pk=self.pk),
+                    totale_stimato=_totale_scontato(F('subtotale')),
+                )
+            self.refresh_from_db(fields=['subtotale', 'totale_stimato'])
+    
+    def applica_sconto(self, subtotale):
+        sconto = Decimal(str(self.sconto_percentuale or 0))
+        totale = Decimal(str(subtotale)) * (100 - sconto) / 100
+        # Stesso arrotondamento di ROUND() nel database
+        return totale.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    def get_importo_sconto(self):
+        return Decimal(str(self.subtotale)) - Decimal(str(self.totale_stimato))
     
     def calcola_totale(self):
-        subtotale = sum(voce.get_totale() for voce in self.voci.all())
-        sconto = subtotale * (self.sconto_percentuale / 100)
-        return subtotale - sconto
+        subtotale = sum((voce.get_totale() for voce in self.voci.all()), Decimal('0'))
+        return self.applica_sconto(subtotale)
     
     def aggiorna_totale(self):
-        self.totale_stimato = self.calcola_totale()
-        self.save(update_fields=['totale_stimato'])
+        """Ricalcola subtotale e totale con un aggregato sul database."""
+        Preventivo.objects.filter(pk=self.pk).ricalcola_totali()
+        self.refresh_from_db(fields=['subtotale', 'totale_stimato', 'data_aggiornamento'])
+
+class VocePreventivoQuerySet(models.QuerySet):
+    """Le operazioni in blocco non passano da save()/delete(): ricalcolano
+    una sola volta il totale dei preventivi coinvolti, ne invalidano i PDF
+    e segnano le statistiche da aggiornare."""
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        senza_prezzo = {voce.prodotto_id for voce in objs if not voce.prezzo_unitario_finale}
+        if senza_prezzo:
+            prezzi = Prodotto.objects.in_bulk(senza_prezzo)
+            for voce in objs:
+                if not voce.prezzo_unitario_finale:
+                    voce.prezzo_unitario_finale = prezzi[voce.prodotto_id].prezzo_base
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            ids = {voce.preventivo_id for voce in objs}
+            Preventivo.objects.filter(pk__in=ids).ricalcola_totali()
+            cache_pdf.invalida(ids)
+            segnali.modificati_in_blocco.send(sender=Preventivo, pks=ids)
+        return objs
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not CAMPI_TOTALE.intersection(fields):
+            if CAMPI_STATISTICHE.intersection(fields):
+                segnali.modificati_in_blocco.send(sender=Preventivo, pks={voce.preventivo_id for voce in objs})
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic():
+            ids = self._preventivi_di(voce.pk for voce in objs)
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            ids.update(voce.preventivo_id for voce in objs)
+            Preventivo.objects.filter(pk__in=ids).ricalcola_totali()
+            cache_pdf.invalida(ids)
+            segnali.modificati_in_blocco.send(sender=Preventivo, pks=ids)
+        return updated
+    
+    def update(self, **kwargs):
+        if not CAMPI_TOTALE.intersection(kwargs):
+            if CAMPI_STATISTICHE.intersection(kwargs):
+                segnali.modificati_in_blocco.send(
+                    sender=Preventivo, pks=set(self.values_list('preventivo_id', flat=True).distinct())
+                )
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            ids = self._preventivi_di(pks)
+            updated = super().update(**kwargs)
+            ids.update(self._preventivi_di(pks))
+            Preventivo.objects.filter(pk__in=ids).ricalcola_totali()
+            cache_pdf.invalida(ids)
+            segnali.modificati_in_blocco.send(sender=Preventivo, pks=ids)
+        return updated
+    
+    def delete(self):
+        with transaction.atomic():
+            ids = set(self.values_list('preventivo_id', flat=True).distinct())
+            risultato = super().delete()
+            Preventivo.objects.filter(pk__in=ids).ricalcola_totali()
+            segnali.modificati_in_blocco.send(sender=Preventivo, pks=ids)
+        return risultato
+    
+    def _preventivi_di(self, pks):
+        return set(
+            VocePreventivo.objects.filter(pk__in=list(pks))
+            .values_list('preventivo_id', flat=True).distinct()
+        )
 
 class VocePreventivo(models.Model):
     preventivo = models.ForeignKey(
@@ -106,6 +344,8 @@ class VocePreventivo(models.Model):
     )
     ordine = models.IntegerField(default=0, verbose_name="Ordine")
     
+    objects = VocePreventivoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Voce Preventivo"
         verbose_name_plural = "Voci Preventivo"
@@ -114,16 +354,64 @@ class VocePreventivo(models.Model):
     def __str__(self):
         return f"{self.prodotto.nome} x {self.quantita}"
     
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        voce = super().from_db(db, field_names, values)
+        # Valori letti dal database: la variazione al salvataggio si calcola
+        # senza rileggere la riga
+        if {'preventivo_id', 'quantita', 'prezzo_unitario_finale'}.issubset(field_names):
+            voce._contributo_caricato = voce._contributo()
+        return voce
+    
+    def save(self, *args, aggiorna_totale=True, **kwargs):
+        """Salva la voce e corregge il totale del preventivo per differenza.
+        Con aggiorna_totale=False il chiamante ricalcola il totale da sé
+        (per esempio una sola volta dopo il salvataggio di un formset)."""
         if not self.prezzo_unitario_finale:
             self.prezzo_unitario_finale = self.prodotto.prezzo_base
-        super().save(*args, **kwargs)
-        self.preventivo.aggiorna_totale()
+        with transaction.atomic():
+            precedente = None if self._state.adding else self._contributo_salvato()
+            super().save(*args, **kwargs)
+            if aggiorna_totale:
+                self._applica_variazioni(precedente, self._contributo())
+        self._contributo_caricato = self._contributo()
     
-    def delete(self, *args, **kwargs):
-        preventivo = self.preventivo
-        super().delete(*args, **kwargs)
-        preventivo.aggiorna_totale()
+    def delete(self, *args, aggiorna_totale=True, **kwargs):
+        with transaction.atomic():
+            precedente = self._contributo_salvato()
+            risultato = super().delete(*args, **kwargs)
+            if aggiorna_totale:
+                self._applica_variazioni(precedente, None)
+        return risultato
     
     def get_totale(self):
         return self.quantita * self.prezzo_unitario_finale
+    
+    def _contributo(self):
+        """(preventivo, importo) con cui la voce concorre al subtotale."""
+        return self.preventivo_id, Decimal(str(self.get_totale()))
+    
+    def _contributo_salvato(self):
+        contributo = getattr(self, '_contributo_caricato', None)
+        if contributo is None:
+            riga = VocePreventivo.objects.filter(pk=self.pk).values_list(
+                'preventivo_id', 'quantita', 'prezzo_unitario_finale'
+            ).first()
+            if riga:
+                contributo = (riga[0], riga[1] * riga[2])
+        return contributo
+    
+    def _applica_variazioni(self, precedente, attuale):
+        variazioni = Counter()
+        if precedente:
+            variazioni[precedente[0]] -= precedente[1]
+        if attuale:
+            variazioni[attuale[0]] += attuale[1]
+        for preventivo_id, variazione in variazioni.items():
+            if not variazione:
+                continue
+            Preventivo.objects.filter(pk=preventivo_id).applica_variazione(variazione)
+            # Tiene allineata l'istanza già caricata, come faceva aggiorna_totale()
+            if VocePreventivo.preventivo.is_cached(self) and self.preventivo.pk == preventivo_id:
+                self.preventivo.subtotale = Decimal(str(self.preventivo.subtotale)) + variazione
+                self.preventivo.totale_stimato = self.preventivo.applica_sconto(self.preventivo.subtotale)
@@ -0,0 +1,173 @@
+"""
+Generazione del PDF dei preventivi con ReportLab.
+
+Gli stili vengono costruiti una sola volta per processo. Le voci vengono
+lette con il prodotto nella stessa query, o dal prefetch se già presente.
+La tabella delle voci si spezza su più pagine e ripete l'intestazione:
+i preventivi con centinaia di righe restano leggibili.
+"""
+import io
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+COLORE = colors.HexColor('#667eea')
+LARGHEZZE_COLONNE = [8 * cm, 2 * cm, 3 * cm, 3 * cm]
+INTESTAZIONE = ['Prodotto', 'Qtà', 'Prezzo Unit.', 'Totale']
+# Larghezza utile della colonna prodotto (padding predefinito di 6 punti per lato)
+LARGHEZZA_TESTO = LARGHEZZE_COLONNE[0] - 12
+
+
+@lru_cache(maxsize=None)
+def stili():
+    """Stili del documento, condivisi da tutti i PDF del processo."""
+    base = getSampleStyleSheet()
+    return {
+        'normale': base['Normal'],
+        'sezione': base['Heading2'],
+        'titolo': ParagraphStyle(
+            'CustomTitle',
+            parent=base['Heading1'],
+            fontSize=24,
+            textColor=COLORE,
+            spaceAfter=30,
+            alignment=1  # Center
+        ),
+        # Stesso carattere delle celle di testo semplice della tabella
+        'cella': ParagraphStyle('Cella', parent=base['Normal'], fontName='Helvetica', fontSize=10, leading=12),
+        'totale': ParagraphStyle(
+            'Totale',
+            parent=base['Normal'],
+            fontSize=16,
+            textColor=COLORE,
+            spaceAfter=20,
+            alignment=2  # Right
+        ),
+        'footer': ParagraphStyle(
+            'Footer',
+            parent=base['Normal'],
+            fontSize=9,
+            textColor=colors.grey,
+            alignment=1  # Center
+        ),
+        'tabella': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), COLORE),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+            ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+    }
+
+
+def voci_di(preventivo):
+    """Voci del preventivo con il prodotto, senza una query per riga."""
+    if 'voci' in getattr(preventivo, '_prefetched_objects_cache', {}):
+        return list(preventivo.voci.all())
+    return list(preventivo.voci.select_related('prodotto'))
+
+
+def _cella_prodotto(voce, stile):
+    righe = [voce.prodotto.nome]
+    if voce.note:
+        righe.append(voce.note)
+    # Un Paragraph va a capo ma costa molto più di una stringa: si usa solo
+    # per i testi più larghi della colonna
+    cella = stile['cella']
+    if all(stringWidth(riga, cella.fontName, cella.fontSize) <= LARGHEZZA_TESTO for riga in righe):
+        return '\n'.join(righe)
+    return Paragraph('<br/>'.join(escape(riga) for riga in righe), cella)
+
+
+def _tabella_voci(voci, stile):
+    righe = [INTESTAZIONE]
+    for voce in voci:
+        righe.append([
+            _cella_prodotto(voce, stile),
+            str(voce.quantita),
+            f"€ {voce.prezzo_unitario_finale}",
+            f"€ {voce.get_totale()}"
+        ])
+    # repeatRows: l'intestazione viene ripetuta su ogni pagina della tabella
+    tabella = Table(righe, colWidths=LARGHEZZE_COLONNE, repeatRows=1)
+    tabella.setStyle(stile['tabella'])
+    return tabella
+
+
+def genera_pdf(preventivo, voci=None):
+    """Byte del PDF di `preventivo`. `voci` evita di leggerle dal database."""
+    stile = stili()
+    voci = voci_di(preventivo) if voci is None else voci
+    cliente = preventivo.cliente
+
+    elements = [
+        Paragraph("PREVENTIVO", stile['titolo']),
+        Paragraph(f"N. {escape(preventivo.numero_preventivo)}", stile['normale']),
+        Paragraph(f"Data: {preventivo.data_creazione.strftime('%d/%m/%Y')}", stile['normale']),
+        Spacer(1, 20),
+    ]
+
+    # Dati Cliente
+    elements.append(Paragraph("<b>Dati Cliente</b>", stile['sezione']))
+    cliente_info = f"""
+    <b>Nome:</b> {escape(cliente.get_nome_completo())}<br/>
+    <b>Email:</b> {escape(cliente.email)}<br/>
+    <b>Telefono:</b> {escape(cliente.telefono)}<br/>
+    """
+    if cliente.indirizzo:
+        cliente_info += (
+            f"<b>Indirizzo:</b> {escape(cliente.indirizzo)}, "
+            f"{escape(cliente.cap)} {escape(cliente.citta)}"
+        )
+    elements.append(Paragraph(cliente_info, stile['normale']))
+    elements.append(Spacer(1, 20))
+
+    # Tabella Prodotti
+    elements.append(Paragraph("<b>Dettaglio Prodotti</b>", stile['sezione']))
+    elements.append(Spacer(1, 10))
+    elements.append(_tabella_voci(voci, stile))
+    elements.append(Spacer(1, 20))
+
+    # Sconto e Totale
+    if preventivo.sconto_percentuale > 0:
+        sconto_text = f"""
+        <b>Subtotale:</b> € {preventivo.subtotale:.2f}<br/>
+        <b>Sconto {preventivo.sconto_percentuale}%:</b> - € {preventivo.get_importo_sconto():.2f}<br/>
+        """
+        elements.append(Paragraph(sconto_text, stile['normale']))
+    elements.append(Paragraph(f"<b>TOTALE: € {preventivo.totale_stimato}</b>", stile['totale']))
+
+    # Note
+    if preventivo.note:
+        elements.append(Spacer(1, 20))
+        elements.append(Paragraph("<b>Note</b>", stile['sezione']))
+        elements.append(Paragraph(escape(preventivo.note).replace('\n', '<br/>'), stile['normale']))
+
+    # Footer
+    elements.append(Spacer(1, 30))
+    footer_text = f"""
+    <b>Negozio Cucine</b><br/>
+    Via Example 123, 00100 Roma<br/>
+    Tel: +39 123 456 7890 | Email: info@negoziocucine.it<br/>
+    P.IVA: 12345678900<br/>
+    <br/>
+    Il presente preventivo ha validità di <b>{preventivo.validita_giorni} giorni</b> dalla data di emissione.
+    """
+    elements.append(Paragraph(footer_text, stile['footer']))
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
+    doc.build(elements)
+    return buffer.getvalue()
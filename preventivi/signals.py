@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from clienti.models import Cliente
+
+from . import cache_pdf
+from .models import Preventivo, VocePreventivo
+
+
+# Un PDF in cache non viene mai servito per uno stato diverso (l'impronta
+# cambia); questi segnali liberano subito i file non più validi
+
+# Campi di Preventivo che non compaiono nel PDF
+CAMPI_FUORI_PDF = {'stato', 'data_aggiornamento'}
+
+
+@receiver(post_save, sender=Preventivo)
+@receiver(post_delete, sender=Preventivo)
+def invalida_pdf_preventivo(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and CAMPI_FUORI_PDF.issuperset(update_fields):
+        return
+    cache_pdf.invalida([instance.pk])
+
+
+@receiver(post_save, sender=VocePreventivo)
+@receiver(post_delete, sender=VocePreventivo)
+def invalida_pdf_voce(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache_pdf.invalida([instance.preventivo_id])
+
+
+@receiver(post_save, sender=Cliente)
+def invalida_pdf_cliente(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        cache_pdf.invalida(instance.preventivi.values_list('pk', flat=True))
@@ -1,3 +1,627 @@
-from django.test import TestCase
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from reportlab.platypus import Paragraph
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, close_old_connections, connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from negozio_cucine.test_utils import QueryListaMixin, crea_cliente
+from prodotti.models import Categoria, Prodotto
+
+from . import cache_pdf, esportazione, pdf
+from .forms import ImportaVociForm
+from .management.commands.benchmark_pdf_preventivi import preventivo_di_prova
+from .models import ContatorePreventivo, Preventivo, VocePreventivo
+
+
+def crea_prodotti(numero):
+    categoria = Categoria.objects.create(nome='Cucine Moderne')
+    return [
+        Prodotto.objects.create(
+            categoria=categoria,
+            nome=f'Cucina {i}',
+            descrizione='Cucina componibile',
+            prezzo_base=Decimal('1000.00') + i,
+        )
+        for i in range(numero)
+    ]
+
+
+class TotalePreventivoTest(TestCase):
+    def setUp(self):
+        self.prodotti = crea_prodotti(3)
+        self.preventivo = Preventivo.objects.create(
+            cliente=crea_cliente(), sconto_percentuale=Decimal('10'),
+        )
+
+    def assertTotaleCoerente(self, preventivo):
+        preventivo.refresh_from_db()
+        atteso = sum(
+            (voce.get_totale() for voce in preventivo.voci.all()), Decimal('0')
+        )
+        self.assertEqual(preventivo.subtotale, atteso)
+        self.assertEqual(preventivo.totale_stimato, preventivo.applica_sconto(atteso))
+
+    def test_sconto_predefinito_intero(self):
+        preventivo = Preventivo(cliente=self.preventivo.cliente)
+        preventivo.save()
+        self.assertEqual(preventivo.calcola_totale(), Decimal('0.00'))
+
+    def test_variazioni_su_salvataggio_ed_eliminazione(self):
+        voce = VocePreventivo.objects.create(
+            preventivo=self.preventivo, prodotto=self.prodotti[0], quantita=2,
+        )
+        self.assertEqual(self.preventivo.subtotale, Decimal('2000.00'))
+        self.assertEqual(self.preventivo.totale_stimato, Decimal('1800.00'))
+        self.assertTotaleCoerente(self.preventivo)
+
+        voce = VocePreventivo.objects.get(pk=voce.pk)
+        voce.quantita = 3
+        voce.prezzo_unitario_finale = Decimal('999.99')
+        # UPDATE della voce e del preventivo, senza rileggere nulla
+        with self.assertNumQueries(4):
+            voce.save()
+        self.assertTotaleCoerente(self.preventivo)
+
+        voce.delete()
+        self.assertTotaleCoerente(self.preventivo)
+        self.assertEqual(self.preventivo.totale_stimato, Decimal('0.00'))
+
+    def test_spostamento_voce_fra_preventivi(self):
+        altro = Preventivo.objects.create(cliente=self.preventivo.cliente)
+        voce = VocePreventivo.objects.create(
+            preventivo=self.preventivo, prodotto=self.prodotti[1], quantita=1,
+        )
+        voce.preventivo = altro
+        voce.save()
+        self.assertTotaleCoerente(self.preventivo)
+        self.assertTotaleCoerente(altro)
+        self.assertEqual(altro.subtotale, Decimal('1001.00'))
+
+    def test_cambio_sconto_ricalcola_totale(self):
+        VocePreventivo.objects.create(
+            preventivo=self.preventivo, prodotto=self.prodotti[0], quantita=1,
+        )
+        self.preventivo.sconto_percentuale = Decimal('25')
+        self.preventivo.save()
+        self.assertTotaleCoerente(self.preventivo)
+        self.assertEqual(self.preventivo.totale_stimato, Decimal('750.00'))
+
+    def test_salvataggio_di_istanza_vecchia_non_sovrascrive_subtotale(self):
+        # Istanza caricata prima che un'altra richiesta aggiunga una voce
+        vecchia = Preventivo.objects.get(pk=self.preventivo.pk)
+        VocePreventivo.objects.create(
+            preventivo=self.preventivo, prodotto=self.prodotti[0], quantita=1,
+        )
+        vecchia.stato = 'INVIATO'
+        vecchia.save()
+        self.assertTotaleCoerente(self.preventivo)
+        self.assertEqual(vecchia.subtotale, Decimal('1000.00'))
+        vecchia.sconto_percentuale = Decimal('20')
+        vecchia.save()
+        self.assertEqual(vecchia.totale_stimato, Decimal('800.00'))
+        self.assertTotaleCoerente(self.preventivo)
+
+    def test_import_in_blocco_un_solo_ricalcolo(self):
+        voci = [
+            VocePreventivo(preventivo=self.preventivo, prodotto=prodotto, quantita=i + 1)
+            for i, prodotto in enumerate(self.prodotti * 10)
+        ]
+        # Prezzi dei prodotti, INSERT, ricalcolo del totale (più il savepoint)
+        with self.assertNumQueries(5):
+            VocePreventivo.objects.bulk_create(voci)
+        self.assertTotaleCoerente(self.preventivo)
+
+    def test_operazioni_in_blocco_sulle_voci(self):
+        VocePreventivo.objects.bulk_create([
+            VocePreventivo(preventivo=self.preventivo, prodotto=prodotto)
+            for prodotto in self.prodotti
+        ])
+        VocePreventivo.objects.filter(prodotto=self.prodotti[0]).update(quantita=5)
+        self.assertTotaleCoerente(self.preventivo)
+        VocePreventivo.objects.filter(prodotto=self.prodotti[1]).delete()
+        self.assertTotaleCoerente(self.preventivo)
+
+    def test_verifica_ricostruisce_totali_disallineati(self):
+        VocePreventivo.objects.create(
+            preventivo=self.preventivo, prodotto=self.prodotti[0], quantita=1,
+        )
+        integro = Preventivo.objects.create(cliente=self.preventivo.cliente)
+        Preventivo.objects.filter(pk=self.preventivo.pk).update(
+            subtotale=Decimal('1.00'), totale_stimato=Decimal('1.00'),
+        )
+        output = io.StringIO()
+        call_command('verifica_totali_preventivi', '--solo-verifica', stdout=output)
+        self.assertIn('1 trovati', output.getvalue())
+        self.preventivo.refresh_from_db()
+        self.assertEqual(self.preventivo.subtotale, Decimal('1.00'))
+
+        call_command('verifica_totali_preventivi', '--blocco', '1', stdout=output)
+        self.assertIn('2 preventivi esaminati, 1 ricostruiti', output.getvalue())
+        self.assertTotaleCoerente(self.preventivo)
+        self.assertTotaleCoerente(integro)
+
+    def test_migrazione_subtotali_non_tronca_lo_sconto(self):
+        prodotto = self.prodotti[0]
+        prodotto.prezzo_base = Decimal('1999.00')
+        prodotto.save()
+        self.preventivo.sconto_percentuale = Decimal('15')
+        self.preventivo.save()
+        VocePreventivo.objects.create(preventivo=self.preventivo, prodotto=prodotto, quantita=1)
+        Preventivo.objects.filter(pk=self.preventivo.pk).update(
+            subtotale=Decimal('0'), totale_stimato=Decimal('0'),
+        )
+
+        migrazione = import_module('preventivi.migrations.0002_subtotale_preventivo')
+        stato = MigrationLoader(connection).project_state(('preventivi', '0002_subtotale_preventivo'))
+        migrazione.popola_subtotali(stato.apps, connection.schema_editor())
+        self.preventivo.refresh_from_db()
+        self.assertEqual(self.preventivo.subtotale, Decimal('1999.00'))
+        self.assertEqual(self.preventivo.totale_stimato, Decimal('1699.15'))
+
+
+class FormsetPreventivoAdminTest(TestCase):
+    def setUp(self):
+        self.prodotti = crea_prodotti(20)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.cliente = crea_cliente()
+
+    def test_salvataggio_formset_ricalcola_una_volta(self):
+        dati = {
+            'cliente': self.cliente.pk,
+            'stato': 'BOZZA',
+            'sconto_percentuale': '5',
+            'validita_giorni': '30',
+            'note': '',
+            'voci-TOTAL_FORMS': str(len(self.prodotti)),
+            'voci-INITIAL_FORMS': '0',
+            'voci-MIN_NUM_FORMS': '0',
+            'voci-MAX_NUM_FORMS': '1000',
+        }
+        for i, prodotto in enumerate(self.prodotti):
+            dati.update({
+                f'voci-{i}-prodotto': prodotto.pk,
+                f'voci-{i}-quantita': '2',
+                f'voci-{i}-prezzo_unitario_finale': str(prodotto.prezzo_base),
+                f'voci-{i}-note': '',
+                f'voci-{i}-ordine': str(i),
+            })
+        with CaptureQueriesContext(connection) as query:
+            response = self.client.post(reverse('admin:preventivi_preventivo_add'), dati)
+        self.assertEqual(response.status_code, 302)
+        aggiornamenti = [q for q in query if q['sql'].startswith('UPDATE "preventivi_preventivo"')]
+        self.assertEqual(len(aggiornamenti), 1)
+
+        preventivo = Preventivo.objects.get()
+        subtotale = sum(2 * prodotto.prezzo_base for prodotto in self.prodotti)
+        self.assertEqual(preventivo.voci.count(), len(self.prodotti))
+        self.assertEqual(preventivo.subtotale, subtotale)
+        self.assertEqual(preventivo.totale_stimato, preventivo.applica_sconto(subtotale))
+
+
+class NumerazionePreventivoTest(TestCase):
+    def setUp(self):
+        self.cliente = crea_cliente()
+
+    def test_numeri_per_anno(self):
+        primo = Preventivo.objects.create(cliente=self.cliente)
+        secondo = Preventivo.objects.create(cliente=self.cliente)
+        anno = timezone.localdate().year
+        self.assertEqual(primo.numero_preventivo, f'PREV-{anno}-00001')
+        self.assertEqual(secondo.numero_preventivo, f'PREV-{anno}-00002')
+
+    def test_nuova_serie_ogni_anno(self):
+        Preventivo.objects.create(cliente=self.cliente)
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2031, 1, 2)):
+            preventivo = Preventivo.objects.create(cliente=self.cliente)
+        self.assertEqual(preventivo.numero_preventivo, 'PREV-2031-00001')
+
+    def test_eliminazione_non_riusa_il_numero(self):
+        Preventivo.objects.create(cliente=self.cliente)
+        ultimo = Preventivo.objects.create(cliente=self.cliente)
+        ultimo.delete()
+        nuovo = Preventivo.objects.create(cliente=self.cliente)
+        self.assertTrue(nuovo.numero_preventivo.endswith('-00003'))
+
+    def test_salvataggio_fallito_non_consuma_il_numero(self):
+        preventivo = Preventivo(cliente=None)
+        with self.assertRaises(IntegrityError):
+            preventivo.save()
+        self.assertEqual(preventivo.numero_preventivo, '')
+        nuovo = Preventivo.objects.create(cliente=self.cliente)
+        self.assertTrue(nuovo.numero_preventivo.endswith('-00001'))
+
+    def test_numero_senza_scansione_dei_preventivi(self):
+        Preventivo.objects.create(cliente=self.cliente)
+        with CaptureQueriesContext(connection) as query:
+            Preventivo.objects.create(cliente=self.cliente)
+        self.assertFalse([
+            q for q in query
+            if q['sql'].startswith('SELECT') and 'preventivi_preventivo' in q['sql']
+        ])
+
+
+class NumerazioneConcorrenteTest(TransactionTestCase):
+    WORKER = 8
+    PER_WORKER = 250
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest(
+                'SQLite in memoria usa lock di tabella senza attesa: '
+                'serve un database con scritture concorrenti'
+            )
+
+    def test_nessun_numero_duplicato(self):
+        cliente = crea_cliente()
+        partenza = threading.Barrier(self.WORKER)
+
+        def crea_preventivi(_):
+            partenza.wait()
+            try:
+                return [
+                    Preventivo.objects.create(cliente=cliente).numero_preventivo
+                    for _ in range(self.PER_WORKER)
+                ]
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.WORKER) as pool:
+            numeri = [n for blocco in pool.map(crea_preventivi, range(self.WORKER)) for n in blocco]
+
+        totale = self.WORKER * self.PER_WORKER
+        self.assertEqual(len(set(numeri)), totale)
+        self.assertEqual(Preventivo.objects.count(), totale)
+        self.assertEqual(ContatorePreventivo.objects.get().ultimo_numero, totale)
+
+
+class CachePdfPreventivoTest(TestCase):
+    def setUp(self):
+        self.cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cartella, ignore_errors=True)
+        impostazioni = override_settings(PREVENTIVI_PDF_CACHE_DIR=self.cartella)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.prodotti = crea_prodotti(2)
+        self.cliente = crea_cliente()
+        self.preventivo = Preventivo.objects.create(cliente=self.cliente, sconto_percentuale=Decimal('0'))
+        VocePreventivo.objects.bulk_create([
+            VocePreventivo(preventivo=self.preventivo, prodotto=prodotto) for prodotto in self.prodotti
+        ])
+        self.url = reverse('admin:preventivi_preventivo_pdf', args=[self.preventivo.pk])
+
+    def _file_in_cache(self):
+        return sorted(os.listdir(self.cartella))
+
+    def _scarica(self, **headers):
+        response = self.client.get(self.url, **headers)
+        if response.status_code == 200:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_pdf_generato_una_volta_e_servito_con_etag(self):
+        with mock.patch.object(pdf, 'genera_pdf', wraps=pdf.genera_pdf) as genera:
+            prima = self._scarica()
+            seconda = self._scarica()
+        self.assertEqual(genera.call_count, 1)
+        self.assertEqual(prima['Content-Type'], 'application/pdf')
+        self.assertEqual(prima['ETag'], seconda['ETag'])
+        self.assertEqual(len(self._file_in_cache()), 1)
+
+        response = self._scarica(HTTP_IF_NONE_MATCH=prima['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_modifica_voce_invalida(self):
+        etag = self._scarica()['ETag']
+        voce = self.preventivo.voci.first()
+        voce.quantita = 4
+        with self.captureOnCommitCallbacks(execute=True):
+            voce.save()
+        self.assertEqual(self._file_in_cache(), [])
+        self.assertNotEqual(self._scarica()['ETag'], etag)
+
+    def test_import_in_blocco_invalida(self):
+        self._scarica()
+        with self.captureOnCommitCallbacks(execute=True):
+            VocePreventivo.objects.bulk_create([
+                VocePreventivo(preventivo=self.preventivo, prodotto=self.prodotti[0], quantita=2)
+            ])
+        self.assertEqual(self._file_in_cache(), [])
+
+    def test_modifica_cliente_invalida(self):
+        etag = self._scarica()['ETag']
+        self.cliente.indirizzo = 'Via Roma 1'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente.save()
+        self.assertEqual(self._file_in_cache(), [])
+        self.assertNotEqual(self._scarica()['ETag'], etag)
+
+    def test_cambio_stato_mantiene_il_pdf(self):
+        self._scarica()
+        self.preventivo.stato = 'INVIATO'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.preventivo.save(update_fields=['stato', 'data_aggiornamento'])
+        self.assertEqual(len(self._file_in_cache()), 1)
+
+    def test_espulsione_lru(self):
+        for i, nome in enumerate(['1-a.pdf', '2-b.pdf', '3-c.pdf']):
+            percorso = os.path.join(self.cartella, nome)
+            with open(percorso, 'wb') as file_pdf:
+                file_pdf.write(b'x' * 100)
+            os.utime(percorso, (1000 + i, 1000 + i))
+        # Il file più vecchio, appena letto, diventa il più recente
+        os.utime(os.path.join(self.cartella, '1-a.pdf'))
+        self.assertEqual(cache_pdf.espelli(limite=200), 1)
+        self.assertEqual(self._file_in_cache(), ['1-a.pdf', '3-c.pdf'])
+
+
+@override_settings(PREVENTIVI_EXPORT_PROCESSI=0)
+class EsportazionePdfTest(TestCase):
+    def setUp(self):
+        self.cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cartella, ignore_errors=True)
+        impostazioni = override_settings(PREVENTIVI_PDF_CACHE_DIR=os.path.join(self.cartella, 'cache'))
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+
+        prodotti = crea_prodotti(2)
+        cliente = crea_cliente()
+        self.preventivi = []
+        for stato in ['BOZZA', 'INVIATO', 'INVIATO']:
+            preventivo = Preventivo.objects.create(
+                cliente=cliente, stato=stato, sconto_percentuale=Decimal('0'),
+            )
+            VocePreventivo.objects.bulk_create([
+                VocePreventivo(preventivo=preventivo, prodotto=prodotto) for prodotto in prodotti
+            ])
+            self.preventivi.append(preventivo)
+
+    def _nomi_attesi(self, preventivi):
+        return sorted(f'preventivo_{p.numero_preventivo}.pdf' for p in preventivi)
+
+    def test_azione_admin_zip_in_streaming(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post(reverse('admin:preventivi_preventivo_changelist'), {
+            'action': 'genera_pdf',
+            '_selected_action': [p.pk for p in self.preventivi],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archivio = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archivio.namelist()), self._nomi_attesi(self.preventivi))
+        for nome in archivio.namelist():
+            self.assertTrue(archivio.read(nome).startswith(b'%PDF'))
+
+    def test_zip_prodotto_a_pezzi(self):
+        pezzi = esportazione.flusso_zip(
+            (f'{i}.pdf', b'%PDF' + bytes(1000)) for i in range(3)
+        )
+        primo = next(pezzi)
+        # Il primo PDF è già stato emesso prima di leggere gli altri
+        self.assertGreater(len(primo), 1000)
+        archivio = zipfile.ZipFile(io.BytesIO(primo + b''.join(pezzi)))
+        self.assertEqual(archivio.namelist(), ['0.pdf', '1.pdf', '2.pdf'])
+
+    def test_comando_per_stato(self):
+        output = os.path.join(self.cartella, 'inviati.zip')
+        call_command('esporta_pdf_preventivi', output, '--stato', 'INVIATO', stdout=io.StringIO())
+        with zipfile.ZipFile(output) as archivio:
+            self.assertEqual(sorted(archivio.namelist()), self._nomi_attesi(self.preventivi[1:]))
+
+    def test_comando_per_intervallo_di_date(self):
+        Preventivo.objects.filter(pk=self.preventivi[0].pk).update(
+            data_creazione=timezone.now() - timedelta(days=40)
+        )
+        output = os.path.join(self.cartella, 'recenti.zip')
+        dal = (timezone.localdate() - timedelta(days=7)).isoformat()
+        call_command('esporta_pdf_preventivi', output, '--dal', dal, stdout=io.StringIO())
+        with zipfile.ZipFile(output) as archivio:
+            self.assertEqual(sorted(archivio.namelist()), self._nomi_attesi(self.preventivi[1:]))
+
+
+class RendererPdfTest(TestCase):
+    def _pagine(self, contenuto):
+        return len(re.findall(rb'/Type /Page\b(?!s)', contenuto))
+
+    def test_preventivo_scontato(self):
+        preventivo, voci = preventivo_di_prova(3)
+        contenuto = pdf.genera_pdf(preventivo, voci)
+        self.assertTrue(contenuto.startswith(b'%PDF'))
+        self.assertEqual(preventivo.get_importo_sconto(), preventivo.subtotale / 10)
+
+    def test_voci_con_prodotto_in_una_query(self):
+        prodotti = crea_prodotti(5)
+        preventivo = Preventivo.objects.create(cliente=crea_cliente(), sconto_percentuale=Decimal('5'))
+        VocePreventivo.objects.bulk_create([
+            VocePreventivo(preventivo=preventivo, prodotto=prodotto, note='Montaggio & trasporto <inclusi>')
+            for prodotto in prodotti * 6
+        ])
+        preventivo = Preventivo.objects.select_related('cliente').get(pk=preventivo.pk)
+        with self.assertNumQueries(1):
+            pdf.genera_pdf(preventivo)
+
+    def test_tabella_lunga_su_piu_pagine(self):
+        preventivo, voci = preventivo_di_prova(300)
+        tabella = pdf._tabella_voci(voci, pdf.stili())
+        self.assertEqual(tabella.repeatRows, 1)
+        self.assertGreater(self._pagine(pdf.genera_pdf(preventivo, voci)), 5)
+
+    def test_nomi_lunghi_vanno_a_capo(self):
+        preventivo, voci = preventivo_di_prova(2)
+        voci[0].prodotto.nome = 'Cucina ' * 40
+        self.assertIsInstance(pdf._cella_prodotto(voci[0], pdf.stili()), Paragraph)
+        self.assertIsInstance(pdf._cella_prodotto(voci[1], pdf.stili()), str)
+        pdf.genera_pdf(preventivo, voci)
+
+    def test_stili_costruiti_una_volta(self):
+        self.assertIs(pdf.stili(), pdf.stili())
+
+    def test_benchmark(self):
+        output = io.StringIO()
+        call_command('benchmark_pdf_preventivi', '--righe', '10', '--ripetizioni', '1', stdout=output)
+        self.assertIn('Picco (MB)', output.getvalue())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class DuplicazioneImportazioneTest(TestCase):
+    def setUp(self):
+        self.prodotti = crea_prodotti(3)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.preventivo = Preventivo.objects.create(
+            cliente=crea_cliente(), sconto_percentuale=Decimal('10'), note='Cucina su misura',
+        )
+        VocePreventivo.objects.bulk_create([
+            VocePreventivo(preventivo=self.preventivo, prodotto=prodotto, quantita=i + 1, ordine=i)
+            for i, prodotto in enumerate(self.prodotti)
+        ])
+        self.preventivo.refresh_from_db()
+        self.url_importa = reverse('admin:preventivi_preventivo_importa_voci', args=[self.preventivo.pk])
+
+    def test_duplica_voci_e_totali(self):
+        self.preventivo.stato = 'ACCETTATO'
+        self.preventivo.save()
+        response = self.client.post(reverse('admin:preventivi_preventivo_changelist'), {
+            'action': 'duplica_preventivi', '_selected_action': [self.preventivo.pk],
+        })
+        copia = Preventivo.objects.exclude(pk=self.preventivo.pk).get()
+        self.assertRedirects(response, reverse('admin:preventivi_preventivo_change', args=[copia.pk]))
+        self.assertEqual(copia.stato, 'BOZZA')
+        self.assertNotEqual(copia.numero_preventivo, self.preventivo.numero_preventivo)
+        self.assertEqual(copia.note, self.preventivo.note)
+        self.assertEqual(copia.subtotale, self.preventivo.subtotale)
+        self.assertEqual(copia.totale_stimato, self.preventivo.totale_stimato)
+        self.assertEqual(
+            list(copia.voci.values_list('prodotto', 'quantita', 'prezzo_unitario_finale', 'ordine')),
+            list(self.preventivo.voci.values_list('prodotto', 'quantita', 'prezzo_unitario_finale', 'ordine')),
+        )
+
+    def test_duplica_molti_con_un_solo_inserimento_di_voci(self):
+        altro = Preventivo.objects.create(cliente=self.preventivo.cliente)
+        VocePreventivo.objects.bulk_create([
+            VocePreventivo(preventivo=altro, prodotto=self.prodotti[0], quantita=5)
+        ])
+        with CaptureQueriesContext(connection) as query:
+            copie = Preventivo.objects.filter(pk__in=[self.preventivo.pk, altro.pk]).duplica()
+        self.assertEqual([copia.voci.count() for copia in copie], [3, 1])
+        inserimenti = [q for q in query if q['sql'].startswith('INSERT INTO "preventivi_vocepreventivo"')]
+        self.assertEqual(len(inserimenti), 1)
+
+    def test_importa_per_slug_e_id(self):
+        testo = (
+            'prodotto;quantita;prezzo;note\n'
+            f'{self.prodotti[0].slug};2\n'
+            f'{self.prodotti[1].pk};1;1.500,00\n'
+            f'{self.prodotti[2].slug};3;99,90;Finitura rovere; laccata\n'
+        )
+        response = self.client.post(self.url_importa, {'righe': testo.replace('1.500,00', '1500,00')})
+        self.assertEqual(response.status_code, 302)
+        nuove = list(self.preventivo.voci.order_by('ordine')[3:])
+        self.assertEqual(
+            [(v.prodotto_id, v.quantita, v.prezzo_unitario_finale, v.note) for v in nuove],
+            [
+                (self.prodotti[0].pk, 2, self.prodotti[0].prezzo_base, ''),
+                (self.prodotti[1].pk, 1, Decimal('1500.00'), ''),
+                (self.prodotti[2].pk, 3, Decimal('99.90'), 'Finitura rovere; laccata'),
+            ],
+        )
+        self.preventivo.refresh_from_db()
+        subtotale = sum((v.get_totale() for v in self.preventivo.voci.all()), Decimal('0'))
+        self.assertEqual(self.preventivo.subtotale, subtotale)
+
+    def test_importa_file_csv(self):
+        file_csv = io.BytesIO(f'﻿{self.prodotti[0].slug},4\n'.encode('utf-8'))
+        file_csv.name = 'voci.csv'
+        self.client.post(self.url_importa, {'file': file_csv})
+        self.assertEqual(self.preventivo.voci.filter(quantita=4).count(), 1)
+
+    def test_righe_non_valide_non_importano_nulla(self):
+        testo = f'{self.prodotti[0].slug};2\ninesistente;1\n{self.prodotti[1].slug};zero\n'
+        response = self.client.post(self.url_importa, {'righe': testo})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Riga 3: quantità non valida')
+        self.assertEqual(self.preventivo.voci.count(), 3)
+
+        response = self.client.post(self.url_importa, {'righe': f'{self.prodotti[0].slug};2\ninesistente;1\n'})
+        self.assertContains(response, 'Riga 2: prodotto &quot;inesistente&quot; non trovato')
+        self.assertEqual(self.preventivo.voci.count(), 3)
+
+    def test_importazione_grande_con_query_costanti(self):
+        testo = '\n'.join(
+            f'{prodotto.slug};{i % 5 + 1}' for i, prodotto in enumerate(self.prodotti * 200)
+        )
+        with CaptureQueriesContext(connection) as query:
+            form = ImportaVociForm({'righe': testo}, preventivo=self.preventivo)
+            self.assertTrue(form.is_valid())
+            voci = form.save()
+        self.assertEqual(len(voci), 600)
+        # Prodotti, ordine massimo, INSERT e ricalcolo del totale (più il savepoint)
+        sql = [q['sql'] for q in query]
+        # Una lettura dei prodotti, un ricalcolo del totale; gli INSERT sono
+        # divisi in lotti solo per il limite di parametri del database
+        self.assertEqual(len([q for q in sql if 'FROM "prodotti_prodotto"' in q]), 1)
+        self.assertEqual(len([q for q in sql if q.startswith('UPDATE "preventivi_preventivo"')]), 1)
+        self.assertLessEqual(len([q for q in sql if q.startswith('INSERT')]), 4)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ChangelistPreventiviTest(QueryListaMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.prodotti = crea_prodotti(2)
+        self.cliente = crea_cliente()
+
+    def _crea_preventivi(self, n):
+        for _ in range(n):
+            preventivo = Preventivo.objects.create(cliente=self.cliente)
+            VocePreventivo.objects.bulk_create([
+                VocePreventivo(preventivo=preventivo, prodotto=prodotto) for prodotto in self.prodotti
+            ])
+
+    def test_liste_con_query_costanti(self):
+        for nome in ('preventivo', 'vocepreventivo'):
+            with self.subTest(nome):
+                Preventivo.objects.all().delete()
+                url = reverse(f'admin:preventivi_{nome}_changelist')
+                self._crea_preventivi(2)
+                poche = self._query_lista(url)[1]
+                self._crea_preventivi(15)
+                self.assertEqual(self._query_lista(url)[1], poche)
+
+    def test_relazioni_caricate_in_join(self):
+        voce_admin = admin.site._registry[VocePreventivo]
+        self.assertEqual(
+            voce_admin.get_list_select_related(None), ('preventivo', 'prodotto', 'preventivo__cliente')
+        )
+        self.assertEqual(admin.site._registry[Preventivo].get_list_select_related(None), ('cliente',))
+
+    def test_link_di_riga_da_modello_url(self):
+        self._crea_preventivi(1)
+        preventivo = Preventivo.objects.get()
+        preventivo_admin = admin.site._registry[Preventivo]
+        for nome in ('pdf', 'email', 'importa_voci'):
+            self.assertEqual(
+                preventivo_admin.url_riga(f'preventivi_preventivo_{nome}', preventivo.pk),
+                reverse(f'admin:preventivi_preventivo_{nome}', args=[preventivo.pk]),
+            )
+        response = self.client.get(reverse('admin:preventivi_preventivo_changelist'))
+        self.assertContains(response, reverse('admin:preventivi_preventivo_pdf', args=[preventivo.pk]))
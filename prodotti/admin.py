@@ -1,9 +1,17 @@
 from django.contrib import admin
-from .models import Categoria, Prodotto, ImmagineProdotto
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from negozio_cucine.changelist import ChangelistScalabileMixin
+from . import listino, ricerca
+from .forms import RevisioneListinoForm
+from .models import Categoria, Prodotto, ImmagineProdotto, RevisioneListino
 
 @admin.register(Categoria)
-class CategoriaAdmin(admin.ModelAdmin):
-    list_display = ['nome', 'slug', 'ordine']
+class CategoriaAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
+    list_display = ['nome', 'slug', 'ordine', 'numero_prodotti', 'numero_in_evidenza', 'prezzo_minimo']
     prepopulated_fields = {'slug': ('nome',)}
     search_fields = ['nome']
     list_editable = ['ordine']
@@ -14,7 +22,7 @@ class ImmagineInline(admin.TabularInline):
     fields = ['file_immagine', 'alt_text', 'ordine', 'is_principale']
 
 @admin.register(Prodotto)
-class ProdottoAdmin(admin.ModelAdmin):
+class ProdottoAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
     list_display = ['nome', 'categoria', 'prezzo_base', 'disponibile', 'in_evidenza']
     list_filter = ['categoria', 'disponibile', 'in_evidenza', 'data_creazione']
     search_fields = ['nome', 'descrizione']
@@ -33,6 +41,9 @@ class ProdottoAdmin(admin.ModelAdmin):
         }),
     )
     
+    # Indice full-text, anche per l'autocompletamento delle voci di preventivo
+    ricerca_indicizzata = staticmethod(ricerca.cerca_ids)
+    
     actions = ['marca_disponibile', 'marca_non_disponibile', 'marca_in_evidenza']
     
     @admin.action(description='Marca come disponibile')
@@ -49,3 +60,76 @@ class ProdottoAdmin(admin.ModelAdmin):
     def marca_in_evidenza(self, request, queryset):
         updated = queryset.update(in_evidenza=True)
         self.message_user(request, f'{updated} prodotti messi in evidenza.')
+    
+    def get_urls(self):
+        custom_urls = [
+            path(
+                'revisione-listino/',
+                self.admin_site.admin_view(self.revisione_listino_view),
+                name='prodotti_prodotto_revisione_listino',
+            ),
+        ]
+        return custom_urls + super().get_urls()
+    
+    def revisione_listino_view(self, request):
+        """Anteprima e applicazione di una revisione dei prezzi: il primo
+        invio mostra i prodotti interessati, la conferma applica."""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        form = RevisioneListinoForm(request.POST or None)
+        totale, righe = None, []
+        if request.method == 'POST' and form.is_valid():
+            try:
+                if '_applica' in request.POST:
+                    revisione = form.applica(eseguita_da=request.user.get_username())
+                    self.message_user(
+                        request, f'Prezzi aggiornati per {revisione.numero_prodotti} prodotti.'
+                    )
+                    return HttpResponseRedirect(
+                        reverse('admin:prodotti_revisionelistino_change', args=[revisione.pk])
+                    )
+                totale, righe = form.anteprima()
+            except ValidationError as e:
+                form.add_error(None, e)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Revisione listino prezzi',
+            'opts': self.model._meta,
+            'form': form,
+            'totale': totale,
+            'righe': righe,
+        }
+        return TemplateResponse(request, 'admin/prodotti/revisione_listino.html', context)
+
+@admin.register(RevisioneListino)
+class RevisioneListinoAdmin(ChangelistScalabileMixin, admin.ModelAdmin):
+    list_display = [
+        '__str__', 'tipo', 'valore', 'numero_prodotti', 'eseguita_da',
+        'data_applicazione', 'data_annullamento',
+    ]
+    list_filter = ['tipo', 'data_applicazione']
+    readonly_fields = [
+        'descrizione', 'tipo', 'valore', 'filtri', 'numero_prodotti',
+        'eseguita_da', 'data_applicazione', 'data_annullamento',
+    ]
+    
+    actions = ['annulla_revisioni']
+    
+    @admin.action(description='Annulla le revisioni selezionate', permissions=['change'])
+    def annulla_revisioni(self, request, queryset):
+        # L'annullamento riscrive i prezzi: serve anche il permesso di
+        # modifica dei prodotti, come per revisione_listino_view
+        permesso = get_permission_codename('change', Prodotto._meta)
+        if not request.user.has_perm(f'{Prodotto._meta.app_label}.{permesso}'):
+            raise PermissionDenied
+        # Dalla più recente: i prodotti toccati da più revisioni tornano
+        # al prezzo di partenza
+        for revisione in queryset.filter(data_annullamento__isnull=True).order_by('-data_applicazione', '-pk'):
+            ripristinati, saltati = listino.annulla(revisione)
+            messaggio = f'{revisione}: {ripristinati} prezzi ripristinati.'
+            if saltati:
+                messaggio += f' {saltati} prodotti modificati in seguito non sono stati toccati.'
+            self.message_user(request, messaggio)
+    
+    def has_add_permission(self, request):
+        return False
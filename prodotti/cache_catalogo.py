@@ -0,0 +1,195 @@
+"""
+Cache delle pagine pubbliche del catalogo per gli utenti anonimi.
+
+Le chiavi includono un numero di versione del catalogo: ogni modifica a
+Prodotto, Categoria o ImmagineProdotto incrementa la versione e rende
+obsolete in un colpo solo tutte le pagine salvate.
+
+Le stesse viste rispondono alle GET condizionali (ETag/Last-Modified)
+degli utenti anonimi con un validatore unico per tutto il catalogo,
+ricavato da data_aggiornamento delle tre tabelle.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Subquery
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+CHIAVE_VERSIONE = 'catalogo:versione'
+
+# Secondi in cui una pagina è considerata fresca
+TIMEOUT = getattr(settings, 'CATALOGO_CACHE_TIMEOUT', 600)
+# Secondi oltre la scadenza in cui la copia vecchia può ancora essere servita
+TIMEOUT_STALE = getattr(settings, 'CATALOGO_CACHE_STALE', 300)
+# Durata massima del lock di ricostruzione
+TIMEOUT_LOCK = 30
+# Attesa massima di chi trova il lock occupato e nessuna copia disponibile
+ATTESA_MASSIMA = 2.0
+INTERVALLO_ATTESA = 0.05
+
+
+def get_versione_catalogo():
+    versione = cache.get(CHIAVE_VERSIONE)
+    if versione is None:
+        cache.add(CHIAVE_VERSIONE, 1, timeout=None)
+        versione = cache.get(CHIAVE_VERSIONE, 1)
+    return versione
+
+
+def incrementa_versione_catalogo():
+    try:
+        return cache.incr(CHIAVE_VERSIONE)
+    except ValueError:
+        # Chiave assente (cache svuotata): si riparte da una versione nuova
+        cache.add(CHIAVE_VERSIONE, int(time.time()), timeout=None)
+        return cache.get(CHIAVE_VERSIONE)
+
+
+def invalida_cache_catalogo():
+    """Incrementa la versione dopo il commit della transazione corrente,
+    così nessuna richiesta concorrente salva dati non ancora committati
+    sotto la nuova versione."""
+    transaction.on_commit(incrementa_versione_catalogo)
+
+
+def _chiave_pagina(request):
+    percorso = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'catalogo:pagina:{get_versione_catalogo()}:{percorso}'
+
+
+def _cacheabile(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Le pagine includono i messaggi flash: non vanno né servite né salvate
+    return len(messages.get_messages(request)) == 0
+
+
+def _risposta_da_voce(voce):
+    return HttpResponse(voce['contenuto'], content_type=voce['content_type'])
+
+
+def _genera_e_salva(view, chiave, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if response.status_code == 200 and not response.streaming:
+        cache.set(chiave, {
+            'contenuto': response.content,
+            'content_type': response['Content-Type'],
+            'scadenza': time.time() + TIMEOUT,
+        }, timeout=TIMEOUT + TIMEOUT_STALE)
+    return response
+
+
+def cache_pagina_catalogo(view):
+    """
+    Salva la risposta completa delle viste pubbliche del catalogo.
+
+    Quando una pagina scade una sola richiesta la ricostruisce (lock con
+    cache.add); le altre ricevono la copia scaduta oppure, se non esiste,
+    attendono brevemente che la ricostruzione termini.
+    """
+    @wraps(view)
+    def _wrapped_view(request, *args, **kwargs):
+        if not _cacheabile(request):
+            return view(request, *args, **kwargs)
+
+        chiave = _chiave_pagina(request)
+        voce = cache.get(chiave)
+        if voce is not None and voce['scadenza'] > time.time():
+            return _risposta_da_voce(voce)
+
+        chiave_lock = f'{chiave}:lock'
+        if cache.add(chiave_lock, 1, timeout=TIMEOUT_LOCK):
+            try:
+                return _genera_e_salva(view, chiave, request, *args, **kwargs)
+            finally:
+                cache.delete(chiave_lock)
+
+        if voce is not None:
+            return _risposta_da_voce(voce)
+
+        limite = time.monotonic() + ATTESA_MASSIMA
+        while time.monotonic() < limite:
+            time.sleep(INTERVALLO_ATTESA)
+            voce = cache.get(chiave)
+            if voce is not None:
+                return _risposta_da_voce(voce)
+        return view(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
+def _calcola_validatore():
+    from .models import Categoria, ImmagineProdotto, Prodotto
+
+    def ultimo(model):
+        return Subquery(
+            model.objects.order_by('-data_aggiornamento').values('data_aggiornamento')[:1]
+        )
+
+    # Una sola query, servita dagli indici su data_aggiornamento. Il numero
+    # di categorie cattura l'eliminazione di una categoria, l'unica che non
+    # aggiorna data_aggiornamento di un'altra riga.
+    valori = Categoria.objects.aggregate(
+        categorie=Max('data_aggiornamento'),
+        numero_categorie=Count('pk'),
+        prodotti=Max(ultimo(Prodotto)),
+        immagini=Max(ultimo(ImmagineProdotto)),
+    )
+    date = [valori[c] for c in ('categorie', 'prodotti', 'immagini') if valori[c]]
+    ultima_modifica = max(date) if date else None
+    impronta = '|'.join(str(valori[c]) for c in sorted(valori))
+    return ultima_modifica, hashlib.md5(impronta.encode()).hexdigest()
+
+
+def validatore_catalogo():
+    """(ultima modifica, etag) del catalogo, salvati in cache per versione."""
+    chiave = f'catalogo:validatore:{get_versione_catalogo()}'
+    validatore = cache.get(chiave)
+    if validatore is None:
+        validatore = _calcola_validatore()
+        cache.set(chiave, validatore, timeout=TIMEOUT)
+    return validatore
+
+
+def _validatore_richiesta(request):
+    if not hasattr(request, '_validatore_catalogo'):
+        request._validatore_catalogo = validatore_catalogo()
+    return request._validatore_catalogo
+
+
+def condizionale_catalogo(view):
+    """
+    Risponde 304 Not Modified senza eseguire la vista quando il client
+    ha già la versione corrente del catalogo.
+
+    Il validatore è volutamente unico per tutte le pagine, come la versione
+    che invalida cache_pagina_catalogo: elenco, facet e ricerca dipendono
+    da tutto il catalogo, e un validatore per pagina costerebbe a ogni
+    richiesta le query che il 304 deve evitare. Una modifica a un prodotto
+    fa quindi rigenerare anche le pagine che non lo mostrano.
+
+    Le richieste che la cache delle pagine non serve (utenti autenticati,
+    messaggi flash in sospeso) vanno direttamente alla vista, senza ETag.
+    """
+    vista_condizionale = condition(
+        etag_func=lambda request, *args, **kwargs: _validatore_richiesta(request)[1],
+        last_modified_func=lambda request, *args, **kwargs: _validatore_richiesta(request)[0],
+    )(view)
+
+    @wraps(view)
+    def _wrapped_view(request, *args, **kwargs):
+        if not _cacheabile(request):
+            return view(request, *args, **kwargs)
+        return vista_condizionale(request, *args, **kwargs)
+
+    return _wrapped_view
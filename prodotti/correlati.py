@@ -0,0 +1,182 @@
+"""
+Motore dei prodotti correlati.
+
+Il punteggio di una coppia di prodotti combina:
+- la similarità coseno dei vettori TF-IDF di descrizione e specifiche
+  tecniche (stessa normalizzazione e radici dell'indice di ricerca);
+- la frequenza con cui i due prodotti compaiono nello stesso preventivo,
+  normalizzata come coseno sui vettori di incidenza preventivo/prodotto.
+
+I primi NUMERO_CORRELATI vicini di ogni prodotto sono salvati in
+ProdottoCorrelato, così la pagina di dettaglio li legge con una query.
+Il calcolo gira offline (comando aggiorna_correlati) e ricalcola solo i
+prodotti modificati dall'ultimo passaggio.
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .ricerca import termini
+
+NUMERO_CORRELATI = 8
+PESO_TESTO = 0.6
+PESO_PREVENTIVI = 0.4
+
+# Parole vuote già ridotte alla radice da ricerca.termini()
+PAROLE_VUOTE = {
+    'a', 'ad', 'al', 'all', 'con', 'cm', 'da', 'dal', 'dall', 'de', 'degl', 'del',
+    'dell', 'di', 'e', 'ed', 'il', 'in', 'la', 'le', 'lo', 'gli', 'i', 'l', 'nel',
+    'nell', 'per', 'su', 'sul', 'sull', 'tra', 'un', 'una', 'uno', 'o', 'x',
+}
+
+
+def _documenti():
+    from .models import Prodotto
+
+    documenti = {}
+    for pk, descrizione, specifiche in Prodotto.objects.values_list(
+        'pk', 'descrizione', 'specifiche_tecniche'
+    ).iterator():
+        documenti[pk] = Counter(
+            termine for termine in termini(f'{descrizione} {specifiche}')
+            if termine not in PAROLE_VUOTE
+        )
+    return documenti
+
+
+def vettori_tfidf(documenti):
+    """Vettori TF-IDF sparsi ({termine: peso}) normalizzati L2, più
+    l'indice inverso {termine: [(pk, peso)]} usato per i prodotti scalari."""
+    numero = len(documenti)
+    frequenze = Counter()
+    for conteggi in documenti.values():
+        frequenze.update(conteggi.keys())
+    idf = {
+        termine: math.log((1 + numero) / (1 + frequenza)) + 1
+        for termine, frequenza in frequenze.items()
+    }
+
+    vettori = {}
+    indice_inverso = defaultdict(list)
+    for pk, conteggi in documenti.items():
+        vettore = {termine: (1 + math.log(tf)) * idf[termine] for termine, tf in conteggi.items()}
+        norma = math.sqrt(sum(peso * peso for peso in vettore.values())) or 1.0
+        vettore = {termine: peso / norma for termine, peso in vettore.items()}
+        vettori[pk] = vettore
+        for termine, peso in vettore.items():
+            indice_inverso[termine].append((pk, peso))
+    return vettori, indice_inverso
+
+
+def similarita_testo(vettore, indice_inverso):
+    """Coseno fra `vettore` e tutti i documenti che condividono almeno un termine."""
+    punteggi = defaultdict(float)
+    for termine, peso in vettore.items():
+        for pk, peso_altro in indice_inverso.get(termine, ()):
+            punteggi[pk] += peso * peso_altro
+    return punteggi
+
+
+def incidenza_preventivi():
+    """Per ogni prodotto, il numero di preventivi in cui compare e le
+    co-occorrenze con gli altri prodotti."""
+    VocePreventivo = apps.get_model('preventivi', 'VocePreventivo')
+    per_preventivo = defaultdict(set)
+    for preventivo_id, prodotto_id in VocePreventivo.objects.values_list(
+        'preventivo_id', 'prodotto_id'
+    ).distinct().iterator():
+        per_preventivo[preventivo_id].add(prodotto_id)
+
+    occorrenze = Counter()
+    coppie = defaultdict(Counter)
+    for prodotti in per_preventivo.values():
+        occorrenze.update(prodotti)
+        for prodotto_id in prodotti:
+            for altro_id in prodotti:
+                if altro_id != prodotto_id:
+                    coppie[prodotto_id][altro_id] += 1
+    return occorrenze, coppie
+
+
+def calcola_vicini(pks, vettori, indice_inverso, occorrenze, coppie, numero=NUMERO_CORRELATI):
+    risultato = {}
+    for pk in pks:
+        punteggi = defaultdict(float)
+        for altro, coseno in similarita_testo(vettori.get(pk, {}), indice_inverso).items():
+            punteggi[altro] += PESO_TESTO * coseno
+        for altro, insieme in coppie.get(pk, {}).items():
+            punteggi[altro] += PESO_PREVENTIVI * insieme / math.sqrt(occorrenze[pk] * occorrenze[altro])
+        punteggi.pop(pk, None)
+        migliori = sorted(
+            ((altro, punteggio) for altro, punteggio in punteggi.items() if punteggio > 0),
+            key=lambda coppia: (-coppia[1], coppia[0]),
+        )
+        risultato[pk] = migliori[:numero]
+    return risultato
+
+
+def prodotti_da_aggiornare():
+    """Prodotti modificati dopo l'ultimo calcolo, quelli che li hanno fra i
+    propri vicini e quelli presenti nei preventivi modificati nel frattempo."""
+    from .models import Prodotto, ProdottoCorrelato
+
+    Preventivo = apps.get_model('preventivi', 'Preventivo')
+    modificati = set(Prodotto.objects.filter(
+        Q(correlati_calcolati_il__isnull=True)
+        | Q(data_aggiornamento__gt=F('correlati_calcolati_il'))
+    ).values_list('pk', flat=True))
+
+    ultimo_calcolo = Prodotto.objects.aggregate(ultimo=Max('correlati_calcolati_il'))['ultimo']
+    if ultimo_calcolo:
+        modificati.update(Preventivo.objects.filter(
+            data_aggiornamento__gt=ultimo_calcolo
+        ).values_list('voci__prodotto_id', flat=True).distinct())
+        modificati.discard(None)
+
+    if modificati:
+        modificati.update(ProdottoCorrelato.objects.filter(
+            correlato_id__in=modificati
+        ).values_list('prodotto_id', flat=True))
+    return modificati
+
+
+def aggiorna_correlati(pks=None):
+    """Ricalcola i vicini di `pks` (di default i prodotti modificati).
+    Restituisce il numero di prodotti aggiornati."""
+    from .models import Prodotto, ProdottoCorrelato
+
+    if pks is None:
+        pks = prodotti_da_aggiornare()
+    pks = set(pks)
+    if not pks:
+        return 0
+
+    vettori, indice_inverso = vettori_tfidf(_documenti())
+    occorrenze, coppie = incidenza_preventivi()
+    pks &= set(vettori)
+    vicini = calcola_vicini(pks, vettori, indice_inverso, occorrenze, coppie)
+
+    with transaction.atomic():
+        ProdottoCorrelato.objects.filter(prodotto_id__in=pks).delete()
+        ProdottoCorrelato.objects.bulk_create([
+            ProdottoCorrelato(
+                prodotto_id=pk,
+                correlato_id=altro,
+                punteggio=punteggio,
+                posizione=posizione,
+            )
+            for pk, lista in vicini.items()
+            for posizione, (altro, punteggio) in enumerate(lista)
+        ])
+        # Stesso istante per i due campi: la pagina cambia (nuovi correlati)
+        # ma il prodotto non risulta di nuovo da ricalcolare
+        adesso = timezone.now()
+        Prodotto.objects.filter(pk__in=pks).update(
+            correlati_calcolati_il=adesso,
+            data_aggiornamento=adesso,
+        )
+    return len(pks)
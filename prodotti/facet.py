@@ -0,0 +1,234 @@
+"""
+Filtri a faccette del catalogo e relativi conteggi.
+
+I conteggi non vengono calcolati con un COUNT per ogni valore: la tabella
+ConteggioFacet contiene il numero di prodotti per ogni combinazione di
+(categoria, fascia di prezzo, disponibile, in_evidenza) ed è mantenuta
+per differenza a ogni modifica dei prodotti. Il catalogo legge l'intera
+tabella (poche decine di righe) con una query e somma le celle in Python.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.http import QueryDict
+
+# (codice URL, etichetta, prezzo minimo incluso, prezzo massimo escluso)
+FASCE_PREZZO = [
+    ('fino-2000', 'Fino a € 2.000', None, Decimal('2000')),
+    ('2000-5000', '€ 2.000 - 5.000', Decimal('2000'), Decimal('5000')),
+    ('5000-10000', '€ 5.000 - 10.000', Decimal('5000'), Decimal('10000')),
+    ('oltre-10000', 'Oltre € 10.000', Decimal('10000'), None),
+]
+
+# Campi di Prodotto che determinano la cella di appartenenza
+CAMPI = {'categoria', 'categoria_id', 'prezzo_base', 'disponibile', 'in_evidenza'}
+
+
+def fascia_di(prezzo):
+    for indice, (_, _, minimo, massimo) in enumerate(FASCE_PREZZO):
+        if (minimo is None or prezzo >= minimo) and (massimo is None or prezzo < massimo):
+            return indice
+    return len(FASCE_PREZZO) - 1
+
+
+def espressione_fascia():
+    casi = [
+        When(prezzo_base__lt=massimo, then=Value(indice))
+        for indice, (_, _, _, massimo) in enumerate(FASCE_PREZZO[:-1])
+    ]
+    return Case(*casi, default=Value(len(FASCE_PREZZO) - 1), output_field=IntegerField())
+
+
+def filtro_fascia(indice):
+    _, _, minimo, massimo = FASCE_PREZZO[indice]
+    filtro = {}
+    if minimo is not None:
+        filtro['prezzo_base__gte'] = minimo
+    if massimo is not None:
+        filtro['prezzo_base__lt'] = massimo
+    return filtro
+
+
+def chiave_prodotto(prodotto):
+    return (
+        prodotto.categoria_id,
+        fascia_di(prodotto.prezzo_base),
+        prodotto.disponibile,
+        prodotto.in_evidenza,
+    )
+
+
+def conteggi_per_chiave(queryset):
+    righe = (
+        queryset.order_by()
+        .annotate(fascia=espressione_fascia())
+        .values('categoria_id', 'fascia', 'disponibile', 'in_evidenza')
+        .annotate(numero=Count('pk'))
+    )
+    return Counter({
+        (r['categoria_id'], r['fascia'], r['disponibile'], r['in_evidenza']): r['numero']
+        for r in righe
+    })
+
+
+def applica_delta(delta):
+    """Somma `delta` ({chiave: variazione}) alle celle della tabella."""
+    from .models import ConteggioFacet
+
+    for (categoria_id, fascia, disponibile, in_evidenza), variazione in delta.items():
+        if not variazione:
+            continue
+        cella = ConteggioFacet.objects.filter(
+            categoria_id=categoria_id,
+            fascia_prezzo=fascia,
+            disponibile=disponibile,
+            in_evidenza=in_evidenza,
+        )
+        if cella.update(numero=F('numero') + variazione) or variazione < 0:
+            # Una cella mancante con variazione negativa è stata eliminata
+            # insieme alla sua categoria
+            continue
+        try:
+            with transaction.atomic():
+                ConteggioFacet.objects.create(
+                    categoria_id=categoria_id,
+                    fascia_prezzo=fascia,
+                    disponibile=disponibile,
+                    in_evidenza=in_evidenza,
+                    numero=variazione,
+                )
+        except IntegrityError:
+            # Cella creata nel frattempo da un'altra transazione
+            cella.update(numero=F('numero') + variazione)
+
+
+def differenza(prima, dopo):
+    delta = Counter(dopo)
+    delta.subtract(prima)
+    return delta
+
+
+def ricalcola_tutto():
+    from .models import ConteggioFacet, Prodotto
+
+    with transaction.atomic():
+        ConteggioFacet.objects.all().delete()
+        ConteggioFacet.objects.bulk_create([
+            ConteggioFacet(
+                categoria_id=categoria_id,
+                fascia_prezzo=fascia,
+                disponibile=disponibile,
+                in_evidenza=in_evidenza,
+                numero=numero,
+            )
+            for (categoria_id, fascia, disponibile, in_evidenza), numero
+            in conteggi_per_chiave(Prodotto.objects.all()).items()
+        ])
+
+
+class FiltriCatalogo:
+    """Filtri selezionati nella querystring del catalogo."""
+
+    def __init__(self, params, categorie):
+        self.params = params
+        self.categorie = list(categorie)
+        slug_validi = {categoria.slug: categoria.pk for categoria in self.categorie}
+        self.categoria_slugs = [s for s in params.getlist('categoria') if s in slug_validi]
+        self.categoria_ids = {slug_validi[s] for s in self.categoria_slugs}
+        codici = [codice for codice, _, _, _ in FASCE_PREZZO]
+        self.fasce = {codici.index(c) for c in params.getlist('prezzo') if c in codici}
+        # Come in passato, senza filtro il catalogo mostra solo i prodotti disponibili
+        self.disponibile = params.get('disponibile', '1') != '0'
+        self.in_evidenza = params.get('evidenza') == '1'
+
+    def applica(self, queryset):
+        queryset = queryset.filter(disponibile=self.disponibile)
+        if self.categoria_ids:
+            queryset = queryset.filter(categoria_id__in=self.categoria_ids)
+        if self.fasce:
+            filtro = Q()
+            for indice in self.fasce:
+                filtro |= Q(**filtro_fascia(indice))
+            queryset = queryset.filter(filtro)
+        if self.in_evidenza:
+            queryset = queryset.filter(in_evidenza=True)
+        return queryset
+
+    def _corrisponde(self, chiave, escludi):
+        categoria_id, fascia, disponibile, in_evidenza = chiave
+        if escludi != 'categoria' and self.categoria_ids and categoria_id not in self.categoria_ids:
+            return False
+        if escludi != 'prezzo' and self.fasce and fascia not in self.fasce:
+            return False
+        if escludi != 'disponibile' and disponibile != self.disponibile:
+            return False
+        if escludi != 'evidenza' and self.in_evidenza and not in_evidenza:
+            return False
+        return True
+
+    def querystring(self, **modifiche):
+        """Querystring attuale con le modifiche indicate, senza paginazione."""
+        params = QueryDict(mutable=True)
+        for chiave in ('categoria', 'prezzo', 'disponibile', 'evidenza'):
+            valori = modifiche.get(chiave, self.params.getlist(chiave))
+            if valori:
+                params.setlist(chiave, valori)
+        return params.urlencode()
+
+    def _alterna(self, chiave, valore):
+        valori = self.params.getlist(chiave)
+        if valore in valori:
+            return [v for v in valori if v != valore]
+        return valori + [valore]
+
+    def facet(self, celle):
+        """Valori di ogni faccetta con conteggio e link per attivarli o
+        disattivarli. `celle` è {chiave: numero} da ConteggioFacet."""
+        def somma(escludi, condizione):
+            return sum(
+                numero for chiave, numero in celle.items()
+                if condizione(chiave) and self._corrisponde(chiave, escludi)
+            )
+
+        categorie = [
+            {
+                'etichetta': categoria.nome,
+                'slug': categoria.slug,
+                'conteggio': somma('categoria', lambda k, pk=categoria.pk: k[0] == pk),
+                'selezionato': categoria.slug in self.categoria_slugs,
+                'querystring': self.querystring(categoria=self._alterna('categoria', categoria.slug)),
+            }
+            for categoria in self.categorie
+        ]
+        prezzi = [
+            {
+                'etichetta': etichetta,
+                'conteggio': somma('prezzo', lambda k, i=indice: k[1] == i),
+                'selezionato': indice in self.fasce,
+                'querystring': self.querystring(prezzo=self._alterna('prezzo', codice)),
+            }
+            for indice, (codice, etichetta, _, _) in enumerate(FASCE_PREZZO)
+        ]
+        disponibilita = [
+            {
+                'etichetta': etichetta,
+                'conteggio': somma('disponibile', lambda k, v=valore: k[2] == v),
+                'selezionato': self.disponibile == valore,
+                'querystring': self.querystring(disponibile=[] if valore else ['0']),
+            }
+            for valore, etichetta in ((True, 'Disponibili'), (False, 'Non disponibili'))
+        ]
+        evidenza = {
+            'etichetta': 'In evidenza',
+            'conteggio': somma('evidenza', lambda k: k[3]),
+            'selezionato': self.in_evidenza,
+            'querystring': self.querystring(evidenza=[] if self.in_evidenza else ['1']),
+        }
+        return {
+            'categorie': categorie,
+            'prezzi': prezzi,
+            'disponibilita': disponibilita,
+            'evidenza': evidenza,
+        }
@@ -0,0 +1,76 @@
+from django import forms
+
+from . import listino
+from .models import Categoria, RevisioneListino
+
+class RevisioneListinoForm(forms.Form):
+    tipo = forms.ChoiceField(choices=RevisioneListino.TIPO_CHOICES, label="Tipo di variazione")
+    valore = forms.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        label="Valore",
+        help_text="Percentuale (es. 4 per +4%) o importo in euro; negativo per una riduzione.",
+    )
+    categorie = forms.ModelMultipleChoiceField(
+        queryset=Categoria.objects.all(),
+        required=False,
+        label="Categorie",
+        help_text="Nessuna selezione: tutte le categorie.",
+    )
+    prezzo_minimo = forms.DecimalField(max_digits=10, decimal_places=2, required=False, label="Prezzo da (€)")
+    prezzo_massimo = forms.DecimalField(
+        max_digits=10, decimal_places=2, required=False, label="Prezzo fino a (€, escluso)"
+    )
+    disponibilita = forms.ChoiceField(
+        choices=[('', 'Tutti i prodotti'), ('1', 'Solo disponibili'), ('0', 'Solo non disponibili')],
+        required=False,
+        label="Disponibilità",
+    )
+    descrizione = forms.CharField(max_length=200, required=False, label="Descrizione")
+    
+    def clean_valore(self):
+        valore = self.cleaned_data['valore']
+        if not valore:
+            raise forms.ValidationError("Indica una variazione diversa da zero")
+        return valore
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        minimo, massimo = cleaned_data.get('prezzo_minimo'), cleaned_data.get('prezzo_massimo')
+        if minimo is not None and massimo is not None and minimo >= massimo:
+            raise forms.ValidationError("Il prezzo minimo deve essere inferiore al massimo")
+        return cleaned_data
+    
+    def prodotti(self):
+        disponibilita = self.cleaned_data['disponibilita']
+        return listino.seleziona(
+            categorie=self.cleaned_data['categorie'],
+            prezzo_minimo=self.cleaned_data['prezzo_minimo'],
+            prezzo_massimo=self.cleaned_data['prezzo_massimo'],
+            disponibile=None if disponibilita == '' else disponibilita == '1',
+        )
+    
+    def filtri(self):
+        """Filtri in forma leggibile, salvati con la revisione."""
+        filtri = {}
+        if self.cleaned_data['categorie']:
+            filtri['categorie'] = [categoria.slug for categoria in self.cleaned_data['categorie']]
+        for campo in ('prezzo_minimo', 'prezzo_massimo'):
+            if self.cleaned_data[campo] is not None:
+                filtri[campo] = str(self.cleaned_data[campo])
+        if self.cleaned_data['disponibilita']:
+            filtri['disponibile'] = self.cleaned_data['disponibilita'] == '1'
+        return filtri
+    
+    def anteprima(self):
+        return listino.anteprima(self.prodotti(), self.cleaned_data['tipo'], self.cleaned_data['valore'])
+    
+    def applica(self, eseguita_da=''):
+        return listino.applica(
+            self.prodotti(),
+            self.cleaned_data['tipo'],
+            self.cleaned_data['valore'],
+            descrizione=self.cleaned_data['descrizione'],
+            filtri=self.filtri(),
+            eseguita_da=eseguita_da,
+        )
@@ -0,0 +1,160 @@
+"""
+Revisione in blocco del listino prezzi.
+
+Una revisione aumenta o riduce di una percentuale o di un importo fisso il
+prezzo base dei prodotti selezionati (per categoria, intervallo di prezzo,
+disponibilità). Il nuovo prezzo è calcolato dal database con la stessa
+espressione sia nell'anteprima sia nell'applicazione, e gli UPDATE sono
+eseguiti a blocchi di chiavi primarie, senza save() per prodotto.
+
+Ogni revisione registra in VariazionePrezzo il prezzo precedente e il nuovo
+di ogni prodotto, così può essere annullata. Conteggi delle faccette,
+statistiche delle categorie e cache del catalogo vengono aggiornati una
+volta sola alla fine, non a ogni blocco.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from . import facet
+from .cache_catalogo import invalida_cache_catalogo
+from .models import Prodotto, RevisioneListino, VariazionePrezzo, _aggiorna_statistiche_categorie
+
+DIMENSIONE_BLOCCO = 500
+RIGHE_ANTEPRIMA = 50
+
+
+def seleziona(categorie=(), prezzo_minimo=None, prezzo_massimo=None, disponibile=None):
+    """Prodotti interessati dalla revisione; l'intervallo di prezzo include
+    il minimo ed esclude il massimo, come le fasce del catalogo."""
+    prodotti = Prodotto.objects.all()
+    if categorie:
+        prodotti = prodotti.filter(categoria__in=categorie)
+    if prezzo_minimo is not None:
+        prodotti = prodotti.filter(prezzo_base__gte=prezzo_minimo)
+    if prezzo_massimo is not None:
+        prodotti = prodotti.filter(prezzo_base__lt=prezzo_massimo)
+    if disponibile is not None:
+        prodotti = prodotti.filter(disponibile=disponibile)
+    return prodotti
+
+
+def nuovo_prezzo(tipo, valore):
+    """Espressione del nuovo prezzo base, arrotondato al centesimo."""
+    if tipo == RevisioneListino.PERCENTUALE:
+        nuovo = F('prezzo_base') * Value(1 + Decimal(valore) / 100)
+    else:
+        nuovo = F('prezzo_base') + Value(Decimal(valore))
+    return Round(ExpressionWrapper(nuovo, output_field=DecimalField(max_digits=14, decimal_places=4)), 2)
+
+
+def _valida(prodotti, tipo, valore):
+    if tipo == RevisioneListino.PERCENTUALE and Decimal(valore) <= -100:
+        raise ValidationError('Una riduzione percentuale deve essere inferiore al 100%.')
+    negativi = prodotti.annotate(nuovo=nuovo_prezzo(tipo, valore)).filter(nuovo__lt=0)
+    if negativi.exists():
+        raise ValidationError(
+            f'La revisione porterebbe sotto zero il prezzo di {negativi.count()} prodotti.'
+        )
+
+
+def anteprima(prodotti, tipo, valore, limite=RIGHE_ANTEPRIMA):
+    """(numero di prodotti interessati, prime righe con prezzo attuale e
+    nuovo prezzo). Solleva ValidationError se la revisione non è valida."""
+    _valida(prodotti, tipo, valore)
+    righe = list(
+        prodotti.select_related('categoria').order_by('categoria__nome', 'nome', 'pk')
+        .annotate(nuovo_prezzo=nuovo_prezzo(tipo, valore))
+        .only('nome', 'prezzo_base', 'categoria__nome')[:limite]
+    )
+    return prodotti.count(), righe
+
+
+def _blocchi(ids):
+    for inizio in range(0, len(ids), DIMENSIONE_BLOCCO):
+        yield ids[inizio:inizio + DIMENSIONE_BLOCCO]
+
+
+def _aggiorna(ids_blocco, delta, nuovo, **filtri):
+    """UPDATE dei prodotti di un blocco, accumulando in `delta` la
+    variazione delle faccette. Aggira ProdottoQuerySet.update, che
+    invaliderebbe la cache e ricalcolerebbe le categorie a ogni blocco."""
+    blocco = Prodotto.objects.filter(pk__in=ids_blocco)
+    prima = facet.conteggi_per_chiave(blocco)
+    aggiornati = models.QuerySet.update(
+        blocco.filter(**filtri), prezzo_base=nuovo, data_aggiornamento=timezone.now()
+    )
+    delta.update(facet.differenza(prima, facet.conteggi_per_chiave(blocco)))
+    return aggiornati
+
+
+def _concludi(delta):
+    facet.applica_delta(delta)
+    # Anche le chiavi con variazione nulla: il prezzo minimo della
+    # categoria può cambiare restando nella stessa fascia
+    _aggiorna_statistiche_categorie(delta)
+    invalida_cache_catalogo()
+
+
+def applica(prodotti, tipo, valore, descrizione='', filtri=None, eseguita_da=''):
+    """Applica la revisione ai prodotti selezionati e restituisce la
+    RevisioneListino creata, con le variazioni registrate."""
+    with transaction.atomic():
+        _valida(prodotti, tipo, valore)
+        # La selezione è fissata prima degli UPDATE: un filtro per prezzo
+        # non deve cambiare risultato mentre i prezzi cambiano
+        ids = list(prodotti.order_by('pk').values_list('pk', flat=True))
+        revisione = RevisioneListino.objects.create(
+            descrizione=descrizione, tipo=tipo, valore=valore,
+            filtri=filtri or {}, eseguita_da=eseguita_da,
+        )
+        variazioni = VariazionePrezzo.objects.filter(revisione=revisione, prodotto=OuterRef('pk'))
+        delta = Counter()
+        for ids_blocco in _blocchi(ids):
+            blocco = Prodotto.objects.filter(pk__in=ids_blocco).select_for_update()
+            VariazionePrezzo.objects.bulk_create([
+                VariazionePrezzo(
+                    revisione=revisione, prodotto_id=pk,
+                    prezzo_precedente=precedente, prezzo_nuovo=nuovo,
+                )
+                for pk, precedente, nuovo in blocco.annotate(
+                    nuovo=nuovo_prezzo(tipo, valore)
+                ).values_list('pk', 'prezzo_base', 'nuovo')
+            ])
+            # Il prezzo scritto è quello registrato: l'annullamento lo
+            # riconosce confrontandolo con prezzo_nuovo
+            _aggiorna(ids_blocco, delta, Subquery(variazioni.values('prezzo_nuovo')[:1]))
+        revisione.numero_prodotti = len(ids)
+        revisione.save(update_fields=['numero_prodotti'])
+        _concludi(delta)
+    return revisione
+
+
+def annulla(revisione):
+    """Riporta al prezzo precedente i prodotti della revisione, tranne
+    quelli modificati di nuovo dopo di essa. Restituisce (ripristinati,
+    saltati)."""
+    with transaction.atomic():
+        revisione = RevisioneListino.objects.select_for_update().get(pk=revisione.pk)
+        if revisione.data_annullamento:
+            raise ValidationError('La revisione è già stata annullata.')
+        variazioni = VariazionePrezzo.objects.filter(revisione=revisione, prodotto=OuterRef('pk'))
+        ids = list(
+            revisione.variazioni.order_by('prodotto_id').values_list('prodotto_id', flat=True)
+        )
+        ripristinati = 0
+        delta = Counter()
+        for ids_blocco in _blocchi(ids):
+            ripristinati += _aggiorna(
+                ids_blocco, delta, Subquery(variazioni.values('prezzo_precedente')[:1]),
+                prezzo_base=Subquery(variazioni.values('prezzo_nuovo')[:1]),
+            )
+        revisione.data_annullamento = timezone.now()
+        revisione.save(update_fields=['data_annullamento'])
+        _concludi(delta)
+    return ripristinati, len(ids) - ripristinati
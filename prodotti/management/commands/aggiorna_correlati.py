@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from prodotti import correlati
+from prodotti.models import Prodotto
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola i prodotti correlati (solo quelli modificati, salvo --tutti)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tutti',
+            action='store_true',
+            help='Ricalcola i correlati di tutti i prodotti',
+        )
+
+    def handle(self, *args, **options):
+        pks = None
+        if options['tutti']:
+            pks = Prodotto.objects.values_list('pk', flat=True)
+        aggiornati = correlati.aggiorna_correlati(pks)
+        self.stdout.write(self.style.SUCCESS(f'✓ Correlati aggiornati per {aggiornati} prodotti'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from prodotti import rendition
+from prodotti.models import ImmagineProdotto
+
+
+class Command(BaseCommand):
+    help = 'Genera le versioni ridimensionate delle immagini prodotto esistenti'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tutte',
+            action='store_true',
+            help='Rigenera anche le immagini che hanno già le rendition',
+        )
+
+    def handle(self, *args, **options):
+        immagini = ImmagineProdotto.objects.all()
+        if not options['tutte']:
+            immagini = immagini.filter(rendition={})
+        ids = list(immagini.values_list('pk', flat=True))
+        self.stdout.write(f'🖼️  {len(ids)} immagini da elaborare...')
+
+        for completati, _ in enumerate(rendition.genera_in_blocco(ids), start=1):
+            if completati % 50 == 0:
+                self.stdout.write(f'  {completati}/{len(ids)}')
+
+        mancanti = ImmagineProdotto.objects.filter(pk__in=ids, rendition={}).count()
+        if mancanti:
+            self.stdout.write(self.style.WARNING(f'⚠ {mancanti} immagini non elaborate (vedi log)'))
+        self.stdout.write(self.style.SUCCESS(f'✓ Rendition generate per {len(ids) - mancanti} immagini'))
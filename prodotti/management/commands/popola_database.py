@@ -4,6 +4,7 @@ from prodotti.models import Categoria, Prodotto, ImmagineProdotto
 from clienti.models import Cliente, Appuntamento
 from preventivi.models import Preventivo, VocePreventivo
 from datetime import datetime, timedelta
+from decimal import Decimal
 import random
 
 class Command(BaseCommand):
@@ -244,16 +245,20 @@ class Command(BaseCommand):
                 num_prodotti = random.randint(2, 4)
                 prodotti_scelti = random.sample(prodotti, num_prodotti)
                 
-                for j, prodotto in enumerate(prodotti_scelti):
-                    VocePreventivo.objects.create(
+                # bulk_create ricalcola il totale del preventivo una sola volta
+                VocePreventivo.objects.bulk_create([
+                    VocePreventivo(
                         preventivo=preventivo,
                         prodotto=prodotto,
                         quantita=random.randint(1, 3) if prodotto.categoria.nome == 'Accessori' else 1,
-                        prezzo_unitario_finale=prodotto.prezzo_base * random.uniform(0.9, 1.0),  # Piccolo sconto
+                        prezzo_unitario_finale=(
+                            prodotto.prezzo_base * Decimal(str(random.uniform(0.9, 1.0)))  # Piccolo sconto
+                        ).quantize(Decimal('0.01')),
                         ordine=j,
                     )
-                
-                preventivo.aggiorna_totale()
+                    for j, prodotto in enumerate(prodotti_scelti)
+                ])
+                preventivo.refresh_from_db()
             
             status = '✓ Creato' if created else '→ Esistente'
             self.stdout.write(f'  {status}: {preventivo.numero_preventivo} - {cliente.cognome} - €{preventivo.totale_stimato} [{preventivo.stato}]')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from clienti import ricerca as ricerca_clienti
+from prodotti import ricerca
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce da zero gli indici di ricerca di prodotti e clienti"
+
+    def handle(self, *args, **kwargs):
+        if not ricerca.supportata():
+            self.stdout.write(self.style.WARNING('Database non supportato: indice non necessario.'))
+            return
+        with transaction.atomic():
+            totale = ricerca.ricostruisci_indice()
+            clienti = ricerca_clienti.ricostruisci_indice()
+        self.stdout.write(self.style.SUCCESS(f'✓ {totale} prodotti indicizzati'))
+        self.stdout.write(self.style.SUCCESS(f'✓ {clienti} clienti indicizzati'))
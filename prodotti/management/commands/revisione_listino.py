@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from prodotti import listino
+from prodotti.models import Categoria, RevisioneListino
+
+
+class Command(BaseCommand):
+    help = 'Aumenta o riduce in blocco i prezzi base del catalogo, oppure annulla una revisione'
+
+    def add_arguments(self, parser):
+        variazione = parser.add_mutually_exclusive_group(required=True)
+        variazione.add_argument('--percentuale', type=Decimal, help='Variazione percentuale (es. 4 o -2.5)')
+        variazione.add_argument('--importo', type=Decimal, help='Variazione in euro (es. 50 o -20)')
+        variazione.add_argument('--annulla', type=int, metavar='ID', help='Annulla la revisione indicata')
+        parser.add_argument(
+            '--categoria',
+            action='append',
+            default=[],
+            metavar='SLUG',
+            help='Limita alle categorie indicate (ripetibile)',
+        )
+        parser.add_argument('--prezzo-minimo', type=Decimal, help='Solo prodotti con prezzo da questo valore')
+        parser.add_argument('--prezzo-massimo', type=Decimal, help='Solo prodotti con prezzo sotto questo valore')
+        disponibilita = parser.add_mutually_exclusive_group()
+        disponibilita.add_argument('--solo-disponibili', action='store_true')
+        disponibilita.add_argument('--solo-non-disponibili', action='store_true')
+        parser.add_argument('--descrizione', default='', help='Descrizione salvata con la revisione')
+        parser.add_argument(
+            '--anteprima',
+            action='store_true',
+            help='Mostra i prodotti interessati senza modificare i prezzi',
+        )
+
+    def handle(self, *args, **options):
+        if options['annulla']:
+            return self._annulla(options['annulla'])
+
+        categorie = list(Categoria.objects.filter(slug__in=options['categoria']))
+        mancanti = set(options['categoria']) - {categoria.slug for categoria in categorie}
+        if mancanti:
+            raise CommandError(f'Categorie inesistenti: {", ".join(sorted(mancanti))}')
+        disponibile = None
+        if options['solo_disponibili'] or options['solo_non_disponibili']:
+            disponibile = options['solo_disponibili']
+        prodotti = listino.seleziona(
+            categorie=categorie,
+            prezzo_minimo=options['prezzo_minimo'],
+            prezzo_massimo=options['prezzo_massimo'],
+            disponibile=disponibile,
+        )
+        # Stessa forma dei filtri salvati dalla revisione in admin
+        filtri = {}
+        if options['categoria']:
+            filtri['categorie'] = sorted(options['categoria'])
+        for campo in ('prezzo_minimo', 'prezzo_massimo'):
+            if options[campo] is not None:
+                filtri[campo] = str(options[campo])
+        if disponibile is not None:
+            filtri['disponibile'] = disponibile
+
+        if options['percentuale'] is not None:
+            tipo, valore = RevisioneListino.PERCENTUALE, options['percentuale']
+        else:
+            tipo, valore = RevisioneListino.IMPORTO, options['importo']
+
+        try:
+            if options['anteprima']:
+                totale, righe = listino.anteprima(prodotti, tipo, valore)
+                for prodotto in righe:
+                    self.stdout.write(
+                        f'{prodotto.categoria.nome} / {prodotto.nome}: '
+                        f'{prodotto.prezzo_base} → {prodotto.nuovo_prezzo:.2f}'
+                    )
+                self.stdout.write(f'{totale} prodotti interessati (nessuna modifica applicata)')
+                return
+            revisione = listino.applica(prodotti, tipo, valore, descrizione=options['descrizione'], filtri=filtri)
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Revisione {revisione.pk}: prezzi aggiornati per {revisione.numero_prodotti} prodotti'
+        ))
+
+    def _annulla(self, revisione_id):
+        try:
+            revisione = RevisioneListino.objects.get(pk=revisione_id)
+            ripristinati, saltati = listino.annulla(revisione)
+        except RevisioneListino.DoesNotExist:
+            raise CommandError(f'Revisione {revisione_id} inesistente')
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        self.stdout.write(self.style.SUCCESS(f'✓ {ripristinati} prezzi ripristinati'))
+        if saltati:
+            self.stdout.write(self.style.WARNING(
+                f'{saltati} prodotti modificati dopo la revisione non sono stati toccati'
+            ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from prodotti import facet
+from prodotti.models import ConteggioFacet
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola da zero i conteggi delle faccette del catalogo'
+
+    def handle(self, *args, **kwargs):
+        facet.ricalcola_tutto()
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {ConteggioFacet.objects.count()} celle ricalcolate'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from prodotti.cache_catalogo import invalida_cache_catalogo
+from prodotti.models import Categoria
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola da zero le statistiche denormalizzate delle categorie'
+
+    def handle(self, *args, **kwargs):
+        aggiornate = Categoria.objects.all().aggiorna_statistiche()
+        invalida_cache_catalogo()
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {aggiornate} categorie ricalcolate'
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prodotto',
+            index=models.Index(fields=['disponibile', '-in_evidenza', 'nome', 'id'], name='prodotto_catalogo_idx'),
+        ),
+    ]
@@ -0,0 +1,99 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+DIMENSIONE_BLOCCO = 500
+
+SQLITE_CREA = (
+    "CREATE VIRTUAL TABLE prodotti_ricerca USING fts5("
+    "nome, categoria, descrizione, specifiche_tecniche, "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+
+POSTGRESQL_CREA = [
+    "CREATE TABLE prodotti_ricerca ("
+    "prodotto_id bigint PRIMARY KEY REFERENCES prodotti_prodotto (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "documento tsvector NOT NULL)",
+    "CREATE INDEX prodotti_ricerca_documento_idx ON prodotti_ricerca USING GIN (documento)",
+]
+
+POSTGRESQL_POPOLA = (
+    "INSERT INTO prodotti_ricerca (prodotto_id, documento) "
+    "SELECT p.id, "
+    "setweight(to_tsvector('italian', p.nome), 'A') || "
+    "setweight(to_tsvector('italian', c.nome), 'B') || "
+    "setweight(to_tsvector('italian', p.descrizione), 'C') || "
+    "setweight(to_tsvector('italian', p.specifiche_tecniche), 'D') "
+    "FROM prodotti_prodotto p JOIN prodotti_categoria c ON c.id = p.categoria_id"
+)
+
+# Copia di ricerca.normalizza, radice e termini come erano a questa
+# migrazione: le migrazioni non dipendono dal codice corrente
+_PAROLA = re.compile(r'\w+')
+
+
+def normalizza(testo):
+    testo = unicodedata.normalize('NFKD', testo.lower())
+    return ''.join(c for c in testo if not unicodedata.combining(c))
+
+
+def radice(parola):
+    if len(parola) <= 3 or parola.isdigit():
+        return parola
+    if parola.endswith(('che', 'chi', 'ghe', 'ghi')):
+        return parola[:-2]
+    if parola[-1] in 'aeiou':
+        return parola[:-1]
+    return parola
+
+
+def testo_indicizzato(testo):
+    return ' '.join(radice(parola) for parola in _PAROLA.findall(normalizza(testo or '')))
+
+
+def popola_sqlite(apps, schema_editor):
+    Prodotto = apps.get_model('prodotti', 'Prodotto')
+    ultimo_pk = 0
+    while True:
+        blocco = list(
+            Prodotto.objects.filter(pk__gt=ultimo_pk).order_by('pk')
+            .values_list('pk', 'nome', 'categoria__nome', 'descrizione', 'specifiche_tecniche')[:DIMENSIONE_BLOCCO]
+        )
+        if not blocco:
+            break
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO prodotti_ricerca (rowid, nome, categoria, descrizione, specifiche_tecniche) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                [(pk, *(testo_indicizzato(campo) for campo in campi)) for pk, *campi in blocco],
+            )
+        ultimo_pk = blocco[-1][0]
+
+
+def crea_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREA)
+        popola_sqlite(apps, schema_editor)
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_CREA:
+            schema_editor.execute(sql)
+        schema_editor.execute(POSTGRESQL_POPOLA)
+
+
+def elimina_indice(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS prodotti_ricerca")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0002_prodotto_indice_catalogo'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice, elimina_indice),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:02
+
+from collections import Counter
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copia di facet.fascia_di con le fasce di prezzo di questa migrazione: le
+# migrazioni non dipendono dal codice corrente
+LIMITI_FASCE = [Decimal('2000'), Decimal('5000'), Decimal('10000')]
+
+
+def fascia_di(prezzo):
+    for indice, limite in enumerate(LIMITI_FASCE):
+        if prezzo < limite:
+            return indice
+    return len(LIMITI_FASCE)
+
+
+def popola_conteggi(apps, schema_editor):
+    Prodotto = apps.get_model('prodotti', 'Prodotto')
+    ConteggioFacet = apps.get_model('prodotti', 'ConteggioFacet')
+    celle = Counter(
+        (categoria_id, fascia_di(prezzo), disponibile, in_evidenza)
+        for categoria_id, prezzo, disponibile, in_evidenza in Prodotto.objects.values_list(
+            'categoria_id', 'prezzo_base', 'disponibile', 'in_evidenza'
+        ).iterator()
+    )
+    ConteggioFacet.objects.bulk_create([
+        ConteggioFacet(
+            categoria_id=categoria_id,
+            fascia_prezzo=fascia,
+            disponibile=disponibile,
+            in_evidenza=in_evidenza,
+            numero=numero,
+        )
+        for (categoria_id, fascia, disponibile, in_evidenza), numero in celle.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0003_indice_ricerca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteggioFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fascia_prezzo', models.PositiveSmallIntegerField(verbose_name='Fascia di prezzo')),
+                ('disponibile', models.BooleanField(verbose_name='Disponibile')),
+                ('in_evidenza', models.BooleanField(verbose_name='In Evidenza')),
+                ('numero', models.IntegerField(default=0, verbose_name='Numero prodotti')),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conteggi_facet', to='prodotti.categoria', verbose_name='Categoria')),
+            ],
+            options={
+                'verbose_name': 'Conteggio Faccetta',
+                'verbose_name_plural': 'Conteggi Faccette',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conteggiofacet',
+            constraint=models.UniqueConstraint(fields=('categoria', 'fascia_prezzo', 'disponibile', 'in_evidenza'), name='conteggio_facet_unico'),
+        ),
+        migrations.RunPython(popola_conteggi, migrations.RunPython.noop),
+    ]
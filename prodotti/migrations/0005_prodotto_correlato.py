@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0004_conteggio_facet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prodotto',
+            name='correlati_calcolati_il',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ProdottoCorrelato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('punteggio', models.FloatField(verbose_name='Punteggio')),
+                ('posizione', models.PositiveSmallIntegerField(verbose_name='Posizione')),
+                ('correlato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='correlato_di', to='prodotti.prodotto', verbose_name='Prodotto correlato')),
+                ('prodotto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='correlati', to='prodotti.prodotto', verbose_name='Prodotto')),
+            ],
+            options={
+                'verbose_name': 'Prodotto Correlato',
+                'verbose_name_plural': 'Prodotti Correlati',
+                'ordering': ['prodotto', 'posizione'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='prodottocorrelato',
+            constraint=models.UniqueConstraint(fields=('prodotto', 'posizione'), name='prodotto_correlato_posizione_unica'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0005_prodotto_correlato'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='immagineprodotto',
+            name='rendition',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Versioni ridimensionate'),
+        ),
+    ]
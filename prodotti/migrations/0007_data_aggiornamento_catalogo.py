@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0006_immagine_rendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='data_aggiornamento',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='immagineprodotto',
+            name='data_aggiornamento',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='prodotto',
+            name='data_aggiornamento',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
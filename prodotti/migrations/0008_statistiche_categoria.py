@@ -0,0 +1,46 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:08
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def popola_statistiche(apps, schema_editor):
+    Categoria = apps.get_model('prodotti', 'Categoria')
+    Prodotto = apps.get_model('prodotti', 'Prodotto')
+    disponibili = Prodotto.objects.filter(
+        categoria=OuterRef('pk'), disponibile=True
+    ).order_by().values('categoria')
+    Categoria.objects.update(
+        numero_prodotti=Coalesce(Subquery(disponibili.annotate(n=Count('pk')).values('n')), 0),
+        numero_in_evidenza=Coalesce(
+            Subquery(disponibili.annotate(n=Count('pk', filter=Q(in_evidenza=True))).values('n')), 0
+        ),
+        prezzo_minimo=Subquery(disponibili.annotate(m=Min('prezzo_base')).values('m')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0007_data_aggiornamento_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='numero_in_evidenza',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Prodotti in evidenza'),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='numero_prodotti',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Prodotti disponibili'),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='prezzo_minimo',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Prezzo a partire da (€)'),
+        ),
+        migrations.RunPython(popola_statistiche, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prodotti', '0008_statistiche_categoria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisioneListino',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('descrizione', models.CharField(blank=True, max_length=200, verbose_name='Descrizione')),
+                ('tipo', models.CharField(choices=[('PERCENTUALE', 'Percentuale'), ('IMPORTO', 'Importo fisso')], max_length=20, verbose_name='Tipo di variazione')),
+                ('valore', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Valore')),
+                ('filtri', models.JSONField(blank=True, default=dict, verbose_name='Filtri applicati')),
+                ('numero_prodotti', models.PositiveIntegerField(default=0, verbose_name='Prodotti modificati')),
+                ('eseguita_da', models.CharField(blank=True, max_length=150, verbose_name='Eseguita da')),
+                ('data_applicazione', models.DateTimeField(auto_now_add=True, verbose_name='Applicata il')),
+                ('data_annullamento', models.DateTimeField(blank=True, null=True, verbose_name='Annullata il')),
+            ],
+            options={
+                'verbose_name': 'Revisione Listino',
+                'verbose_name_plural': 'Revisioni Listino',
+                'ordering': ['-data_applicazione'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VariazionePrezzo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prezzo_precedente', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('prezzo_nuovo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('prodotto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variazioni_prezzo', to='prodotti.prodotto', verbose_name='Prodotto')),
+                ('revisione', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variazioni', to='prodotti.revisionelistino', verbose_name='Revisione')),
+            ],
+            options={
+                'verbose_name': 'Variazione Prezzo',
+                'verbose_name_plural': 'Variazioni Prezzo',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='variazioneprezzo',
+            constraint=models.UniqueConstraint(fields=('revisione', 'prodotto'), name='variazione_prezzo_unica'),
+        ),
+    ]
@@ -1,11 +1,84 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Min
+from django.db.models.functions import Coalesce, Substr
+from django.utils import timezone
 from django.utils.text import slugify
+from . import facet, ricerca
+from .cache_catalogo import invalida_cache_catalogo
+
+class CatalogoQuerySet(models.QuerySet):
+    """Le operazioni in blocco non inviano segnali: invalidano la cache
+    del catalogo esplicitamente."""
+
+    def update(self, **kwargs):
+        # update() non applica auto_now: i validatori ETag/Last-Modified
+        # si basano su data_aggiornamento
+        kwargs.setdefault('data_aggiornamento', timezone.now())
+        updated = super().update(**kwargs)
+        if updated:
+            invalida_cache_catalogo()
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            invalida_cache_catalogo()
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        updated = super().bulk_update(objs, fields, *args, **kwargs)
+        if updated:
+            invalida_cache_catalogo()
+        return updated
+
+class CategoriaQuerySet(CatalogoQuerySet):
+    def aggiorna_statistiche(self):
+        """Ricalcola con un solo UPDATE le statistiche delle categorie
+        selezionate a partire dai loro prodotti disponibili.
+
+        Viene chiamato insieme a una modifica dei prodotti che invalida già
+        la cache del catalogo: l'UPDATE non la invalida una seconda volta.
+        """
+        disponibili = Prodotto.objects.filter(
+            categoria=OuterRef('pk'), disponibile=True
+        ).order_by().values('categoria')
+        return models.QuerySet.update(
+            self,
+            data_aggiornamento=timezone.now(),
+            numero_prodotti=Coalesce(
+                Subquery(disponibili.annotate(n=Count('pk')).values('n')), 0
+            ),
+            numero_in_evidenza=Coalesce(
+                Subquery(disponibili.annotate(n=Count('pk', filter=Q(in_evidenza=True))).values('n')), 0
+            ),
+            prezzo_minimo=Subquery(disponibili.annotate(m=Min('prezzo_base')).values('m')),
+        )
 
 class Categoria(models.Model):
     nome = models.CharField(max_length=100, verbose_name="Nome Categoria")
     slug = models.SlugField(max_length=120, unique=True, blank=True)
     descrizione = models.TextField(blank=True, verbose_name="Descrizione")
     ordine = models.IntegerField(default=0, verbose_name="Ordine di visualizzazione")
+    data_aggiornamento = models.DateTimeField(auto_now=True, db_index=True)
+    # Statistiche denormalizzate, mantenute da CategoriaQuerySet.aggiorna_statistiche()
+    numero_prodotti = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Prodotti disponibili"
+    )
+    numero_in_evidenza = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Prodotti in evidenza"
+    )
+    prezzo_minimo = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Prezzo a partire da (€)"
+    )
+    
+    objects = CategoriaQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Categoria"
@@ -20,6 +93,73 @@ class Categoria(models.Model):
             self.slug = slugify(self.nome)
         super().save(*args, **kwargs)
 
+def _aggiorna_statistiche_categorie(*conteggi):
+    """Aggiorna le statistiche delle categorie presenti nelle chiavi dei
+    conteggi delle faccette (il primo elemento è l'id categoria)."""
+    ids = {chiave[0] for conteggio in conteggi for chiave in conteggio}
+    if ids:
+        Categoria.objects.filter(pk__in=ids).aggiorna_statistiche()
+
+class ProdottoQuerySet(CatalogoQuerySet):
+    # Campi letti dalle card prodotto (homepage, catalogo, correlati)
+    CAMPI_CARD = [
+        'nome', 'slug', 'prezzo_base', 'disponibile', 'in_evidenza',
+        'categoria', 'categoria__nome', 'categoria__slug',
+    ]
+    LUNGHEZZA_ANTEPRIMA = 300
+
+    def per_card(self):
+        """Prodotti pronti per le card: categoria e immagine principale
+        nella stessa query, senza caricare i campi di testo lunghi."""
+        immagini = ImmagineProdotto.objects.filter(
+            prodotto=OuterRef('pk')
+        ).order_by('-is_principale', 'ordine')
+        return self.select_related('categoria').only(*self.CAMPI_CARD).annotate(
+            immagine_principale_file=Subquery(immagini.values('file_immagine')[:1]),
+            immagine_principale_rendition=Subquery(
+                immagini.values('rendition')[:1], output_field=models.JSONField()
+            ),
+            descrizione_breve=Substr('descrizione', 1, self.LUNGHEZZA_ANTEPRIMA),
+        )
+
+    # Le operazioni in blocco non inviano segnali: i conteggi delle faccette
+    # vengono corretti confrontando le celle prima e dopo la modifica
+    def update(self, **kwargs):
+        if not facet.CAMPI.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            prima = facet.conteggi_per_chiave(Prodotto.objects.filter(pk__in=pks))
+            updated = super().update(**kwargs)
+            dopo = facet.conteggi_per_chiave(Prodotto.objects.filter(pk__in=pks))
+            facet.applica_delta(facet.differenza(prima, dopo))
+            _aggiorna_statistiche_categorie(prima, dopo)
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            delta = Counter(facet.chiave_prodotto(obj) for obj in objs)
+            facet.applica_delta(delta)
+            _aggiorna_statistiche_categorie(delta)
+            # Indice full-text: le categorie con una sola query
+            ricerca.indicizza(Prodotto.objects.filter(
+                pk__in=[obj.pk for obj in objs if obj.pk is not None]
+            ).select_related('categoria'))
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not facet.CAMPI.intersection(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic():
+            pks = [obj.pk for obj in objs]
+            prima = facet.conteggi_per_chiave(Prodotto.objects.filter(pk__in=pks))
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            dopo = facet.conteggi_per_chiave(Prodotto.objects.filter(pk__in=pks))
+            facet.applica_delta(facet.differenza(prima, dopo))
+            _aggiorna_statistiche_categorie(prima, dopo)
+        return updated
+
 class Prodotto(models.Model):
     categoria = models.ForeignKey(
         Categoria, 
@@ -39,12 +179,22 @@ class Prodotto(models.Model):
     disponibile = models.BooleanField(default=True, verbose_name="Disponibile")
     in_evidenza = models.BooleanField(default=False, verbose_name="In Evidenza")
     data_creazione = models.DateTimeField(auto_now_add=True)
-    data_aggiornamento = models.DateTimeField(auto_now=True)
+    data_aggiornamento = models.DateTimeField(auto_now=True, db_index=True)
+    correlati_calcolati_il = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = ProdottoQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Prodotto"
         verbose_name_plural = "Prodotti"
         ordering = ['-in_evidenza', 'nome']
+        indexes = [
+            # Intervalli della paginazione a cursore del catalogo
+            models.Index(
+                fields=['disponibile', '-in_evidenza', 'nome', 'id'],
+                name='prodotto_catalogo_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.nome
@@ -55,8 +205,21 @@ class Prodotto(models.Model):
         super().save(*args, **kwargs)
     
     def get_immagine_principale(self):
+        # Valorizzato da ProdottoQuerySet.per_card(): nessuna query aggiuntiva
+        if hasattr(self, 'immagine_principale_file'):
+            if not self.immagine_principale_file:
+                return None
+            storage = ImmagineProdotto._meta.get_field('file_immagine').storage
+            return storage.url(self.immagine_principale_file)
         immagine = self.immagini.first()
         return immagine.file_immagine.url if immagine else None
+    
+    def get_rendition(self):
+        """Rendition dell'immagine principale (vedi ImmagineProdotto.rendition)."""
+        if hasattr(self, 'immagine_principale_rendition'):
+            return self.immagine_principale_rendition or {}
+        immagine = self.immagini.first()
+        return immagine.rendition if immagine else {}
 
 class ImmagineProdotto(models.Model):
     prodotto = models.ForeignKey(
@@ -79,6 +242,15 @@ class ImmagineProdotto(models.Model):
         default=False,
         verbose_name="Immagine Principale"
     )
+    rendition = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Versioni ridimensionate"
+    )
+    data_aggiornamento = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = CatalogoQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Immagine Prodotto"
@@ -87,3 +259,122 @@ class ImmagineProdotto(models.Model):
     
     def __str__(self):
         return f"Immagine di {self.prodotto.nome}"
+    
+    def get_rendition(self):
+        return self.rendition
+
+class ConteggioFacet(models.Model):
+    """Numero di prodotti per combinazione di valori delle faccette del
+    catalogo, mantenuto per differenza (vedi facet.py)."""
+    categoria = models.ForeignKey(
+        Categoria,
+        on_delete=models.CASCADE,
+        related_name='conteggi_facet',
+        verbose_name="Categoria"
+    )
+    fascia_prezzo = models.PositiveSmallIntegerField(verbose_name="Fascia di prezzo")
+    disponibile = models.BooleanField(verbose_name="Disponibile")
+    in_evidenza = models.BooleanField(verbose_name="In Evidenza")
+    numero = models.IntegerField(default=0, verbose_name="Numero prodotti")
+    
+    class Meta:
+        verbose_name = "Conteggio Faccetta"
+        verbose_name_plural = "Conteggi Faccette"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['categoria', 'fascia_prezzo', 'disponibile', 'in_evidenza'],
+                name='conteggio_facet_unico',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.categoria_id}/{self.fascia_prezzo}/{self.disponibile}/{self.in_evidenza}: {self.numero}"
+
+class ProdottoCorrelato(models.Model):
+    """Vicini precalcolati di un prodotto (vedi correlati.py)."""
+    prodotto = models.ForeignKey(
+        Prodotto,
+        on_delete=models.CASCADE,
+        related_name='correlati',
+        verbose_name="Prodotto"
+    )
+    correlato = models.ForeignKey(
+        Prodotto,
+        on_delete=models.CASCADE,
+        related_name='correlato_di',
+        verbose_name="Prodotto correlato"
+    )
+    punteggio = models.FloatField(verbose_name="Punteggio")
+    posizione = models.PositiveSmallIntegerField(verbose_name="Posizione")
+    
+    class Meta:
+        verbose_name = "Prodotto Correlato"
+        verbose_name_plural = "Prodotti Correlati"
+        ordering = ['prodotto', 'posizione']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['prodotto', 'posizione'],
+                name='prodotto_correlato_posizione_unica',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.prodotto_id} -> {self.correlato_id} ({self.punteggio:.3f})"
+
+class RevisioneListino(models.Model):
+    """Modifica in blocco dei prezzi base (vedi listino.py)."""
+    PERCENTUALE = 'PERCENTUALE'
+    IMPORTO = 'IMPORTO'
+    TIPO_CHOICES = [
+        (PERCENTUALE, 'Percentuale'),
+        (IMPORTO, 'Importo fisso'),
+    ]
+    
+    descrizione = models.CharField(max_length=200, blank=True, verbose_name="Descrizione")
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo di variazione")
+    valore = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Valore")
+    filtri = models.JSONField(default=dict, blank=True, verbose_name="Filtri applicati")
+    numero_prodotti = models.PositiveIntegerField(default=0, verbose_name="Prodotti modificati")
+    eseguita_da = models.CharField(max_length=150, blank=True, verbose_name="Eseguita da")
+    data_applicazione = models.DateTimeField(auto_now_add=True, verbose_name="Applicata il")
+    data_annullamento = models.DateTimeField(null=True, blank=True, verbose_name="Annullata il")
+    
+    class Meta:
+        verbose_name = "Revisione Listino"
+        verbose_name_plural = "Revisioni Listino"
+        ordering = ['-data_applicazione']
+    
+    def __str__(self):
+        segno = '+' if self.valore >= 0 else ''
+        unita = '%' if self.tipo == self.PERCENTUALE else ' €'
+        return f"{self.descrizione or 'Revisione'} ({segno}{self.valore}{unita})"
+
+class VariazionePrezzo(models.Model):
+    """Prezzo di un prodotto prima e dopo una revisione del listino."""
+    revisione = models.ForeignKey(
+        RevisioneListino,
+        on_delete=models.CASCADE,
+        related_name='variazioni',
+        verbose_name="Revisione"
+    )
+    prodotto = models.ForeignKey(
+        Prodotto,
+        on_delete=models.CASCADE,
+        related_name='variazioni_prezzo',
+        verbose_name="Prodotto"
+    )
+    prezzo_precedente = models.DecimalField(max_digits=10, decimal_places=2)
+    prezzo_nuovo = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        verbose_name = "Variazione Prezzo"
+        verbose_name_plural = "Variazioni Prezzo"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['revisione', 'prodotto'],
+                name='variazione_prezzo_unica',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.prodotto_id}: {self.prezzo_precedente} -> {self.prezzo_nuovo}"
@@ -0,0 +1,118 @@
+"""
+Paginazione a cursore (keyset) per il catalogo.
+
+Ogni pagina è una singola query su un intervallo dell'indice di
+ordinamento: niente COUNT(*) e niente OFFSET crescente. I cursori sono
+token firmati con i valori di ordinamento dell'ultimo (o primo) prodotto
+della pagina.
+"""
+from django.core import signing
+from django.db.models import Q
+from django.http import Http404
+
+SALT_CURSORE = 'prodotti.paginazione.cursore'
+
+
+class PaginaKeyset:
+    keyset = True
+
+    def __init__(self, object_list, cursore_successivo=None, cursore_precedente=None):
+        self.object_list = object_list
+        self.cursore_successivo = cursore_successivo
+        self.cursore_precedente = cursore_precedente
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.cursore_successivo is not None
+
+    def has_previous(self):
+        return self.cursore_precedente is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Pagina un queryset secondo `ordinamento`, che deve terminare con un
+    campo univoco (di norma 'id') perché il cursore identifichi una
+    posizione esatta.
+    """
+
+    def __init__(self, queryset, per_page, ordinamento=('-in_evidenza', 'nome', 'id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordinamento = list(ordinamento)
+        self.campi = [campo.lstrip('-') for campo in self.ordinamento]
+
+    def _codifica(self, oggetto, direzione):
+        valori = [getattr(oggetto, campo) for campo in self.campi]
+        return signing.dumps([direzione, valori], salt=SALT_CURSORE)
+
+    def _decodifica(self, cursore):
+        try:
+            direzione, valori = signing.loads(cursore, salt=SALT_CURSORE)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise Http404('Cursore di paginazione non valido.')
+        if direzione not in ('avanti', 'indietro') or len(valori) != len(self.campi):
+            raise Http404('Cursore di paginazione non valido.')
+        return direzione, valori
+
+    def _filtro(self, valori, indietro):
+        # (a, b, c) > (x, y, z) espanso come
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        filtro = Q()
+        uguali = {}
+        for campo_ordinamento, campo, valore in zip(self.ordinamento, self.campi, valori):
+            decrescente = campo_ordinamento.startswith('-')
+            lookup = 'lt' if decrescente != indietro else 'gt'
+            filtro |= Q(**uguali, **{f'{campo}__{lookup}': valore})
+            uguali[campo] = valore
+        return filtro
+
+    def _ordinamento_inverso(self):
+        return [
+            campo[1:] if campo.startswith('-') else f'-{campo}'
+            for campo in self.ordinamento
+        ]
+
+    def pagina(self, cursore=None):
+        if not cursore:
+            oggetti = list(self.queryset.order_by(*self.ordinamento)[:self.per_page + 1])
+            altri = len(oggetti) > self.per_page
+            oggetti = oggetti[:self.per_page]
+            return PaginaKeyset(
+                oggetti,
+                cursore_successivo=self._codifica(oggetti[-1], 'avanti') if altri else None,
+            )
+
+        direzione, valori = self._decodifica(cursore)
+        indietro = direzione == 'indietro'
+        ordinamento = self._ordinamento_inverso() if indietro else self.ordinamento
+        oggetti = list(
+            self.queryset.filter(self._filtro(valori, indietro))
+            .order_by(*ordinamento)[:self.per_page + 1]
+        )
+        altri = len(oggetti) > self.per_page
+        oggetti = oggetti[:self.per_page]
+        if indietro:
+            oggetti.reverse()
+        if not oggetti:
+            return PaginaKeyset(oggetti)
+
+        # Nella direzione di provenienza esiste sempre almeno un elemento
+        successivo = altri or indietro
+        precedente = altri or not indietro
+        return PaginaKeyset(
+            oggetti,
+            cursore_successivo=self._codifica(oggetti[-1], 'avanti') if successivo else None,
+            cursore_precedente=self._codifica(oggetti[0], 'indietro') if precedente else None,
+        )
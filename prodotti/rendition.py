@@ -0,0 +1,155 @@
+"""
+Versioni ridimensionate (rendition) delle immagini prodotto.
+
+Al caricamento di un'immagine vengono generate le larghezze in
+LARGHEZZE, in WebP e JPEG, in un pool di thread separato dalla
+richiesta. I percorsi generati sono registrati nel campo JSON
+ImmagineProdotto.rendition ({formato: {larghezza: percorso}}) e i
+template li usano per costruire gli attributi srcset.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+LARGHEZZE = (320, 640, 960, 1280)
+
+# formato: (estensione, formato Pillow, opzioni di salvataggio)
+FORMATI = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_esecutore = None
+_lock_esecutore = threading.Lock()
+
+
+def esecutore():
+    global _esecutore
+    with _lock_esecutore:
+        if _esecutore is None:
+            _esecutore = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'RENDITION_WORKERS', 2),
+                thread_name_prefix='rendition',
+            )
+    return _esecutore
+
+
+def _storage():
+    from .models import ImmagineProdotto
+    return ImmagineProdotto._meta.get_field('file_immagine').storage
+
+
+def _converti(originale, formato):
+    if formato == 'JPEG' and originale.mode != 'RGB':
+        sfondo = Image.new('RGB', originale.size, (255, 255, 255))
+        if originale.mode in ('RGBA', 'LA', 'P'):
+            originale = originale.convert('RGBA')
+            sfondo.paste(originale, mask=originale.split()[-1])
+        else:
+            sfondo.paste(originale.convert('RGB'))
+        return sfondo
+    if originale.mode not in ('RGB', 'RGBA'):
+        return originale.convert('RGBA' if 'A' in originale.getbands() else 'RGB')
+    return originale
+
+
+def genera_rendition(immagine):
+    """Genera e registra le rendition di `immagine`; restituisce il dizionario salvato."""
+    from .models import ImmagineProdotto
+
+    storage = _storage()
+    with storage.open(immagine.file_immagine.name, 'rb') as sorgente:
+        originale = ImageOps.exif_transpose(Image.open(sorgente))
+        originale.load()
+
+    # Mai ingrandire: le immagini strette hanno come ultima versione l'originale
+    larghezze = [l for l in LARGHEZZE if l <= originale.width]
+    if originale.width < LARGHEZZE[-1] and originale.width not in larghezze:
+        larghezze.append(originale.width)
+
+    base = os.path.splitext(os.path.basename(immagine.file_immagine.name))[0]
+    rendition = {}
+    for formato, (estensione, formato_pil, opzioni) in FORMATI.items():
+        convertita = _converti(originale, formato_pil)
+        rendition[formato] = {}
+        for larghezza in larghezze:
+            altezza = round(originale.height * larghezza / originale.width)
+            ridotta = convertita.resize((larghezza, altezza), Image.LANCZOS)
+            buffer = io.BytesIO()
+            ridotta.save(buffer, formato_pil, **opzioni)
+            percorso = f'prodotti/rendition/{immagine.pk}/{base}-{larghezza}.{estensione}'
+            if storage.exists(percorso):
+                storage.delete(percorso)
+            rendition[formato][str(larghezza)] = storage.save(percorso, ContentFile(buffer.getvalue()))
+
+    elimina_file(immagine.rendition, mantieni=rendition)
+    ImmagineProdotto.objects.filter(pk=immagine.pk).update(rendition=rendition)
+    immagine.rendition = rendition
+    return rendition
+
+
+def elimina_file(rendition, mantieni=None):
+    mantenuti = {
+        percorso for per_formato in (mantieni or {}).values() for percorso in per_formato.values()
+    }
+    storage = _storage()
+    for per_formato in (rendition or {}).values():
+        for percorso in per_formato.values():
+            if percorso not in mantenuti and storage.exists(percorso):
+                storage.delete(percorso)
+
+
+def genera_per_id(immagine_id):
+    from .models import ImmagineProdotto
+
+    try:
+        immagine = ImmagineProdotto.objects.filter(pk=immagine_id).first()
+        if immagine is not None:
+            genera_rendition(immagine)
+    except Exception:
+        logger.exception('Generazione rendition fallita per immagine %s', immagine_id)
+
+
+def genera_in_background(immagine_id):
+    try:
+        genera_per_id(immagine_id)
+    finally:
+        # I thread del pool non passano dal ciclo richiesta/risposta
+        close_old_connections()
+
+
+def pianifica_rendition(immagine_id):
+    """Accoda la generazione dopo il commit, fuori dal thread della richiesta.
+    Con RENDITION_SINCRONE (test) la generazione avviene nel thread corrente."""
+    if getattr(settings, 'RENDITION_SINCRONE', False):
+        transaction.on_commit(lambda: genera_per_id(immagine_id))
+    else:
+        transaction.on_commit(lambda: esecutore().submit(genera_in_background, immagine_id))
+
+
+def genera_in_blocco(ids):
+    """Genera le rendition di più immagini nel pool; restituisce un
+    iteratore che avanza a ogni immagine completata."""
+    if getattr(settings, 'RENDITION_SINCRONE', False):
+        for immagine_id in ids:
+            genera_per_id(immagine_id)
+            yield immagine_id
+        return
+    futuri = {esecutore().submit(genera_in_background, pk): pk for pk in ids}
+    for futuro in as_completed(futuri):
+        yield futuri[futuro]
+
+
+def srcset(rendition, formato):
+    storage = _storage()
+    voci = sorted((rendition or {}).get(formato, {}).items(), key=lambda voce: int(voce[0]))
+    return ', '.join(f'{storage.url(percorso)} {larghezza}w' for larghezza, percorso in voci)
@@ -0,0 +1,188 @@
+"""
+Indice di ricerca full-text dei prodotti.
+
+Sotto SQLite l'indice è una tabella virtuale FTS5, sotto PostgreSQL una
+tabella con un tsvector pesato e indice GIN. In entrambi i casi la
+tabella si chiama `prodotti_ricerca`, è indicizzata per id prodotto e
+viene aggiornata dai segnali di salvataggio (vedi signals.py).
+
+FTS5 non ha uno stemmer italiano: i testi e le query vengono ridotti alla
+radice in Python con uno stemmer leggero prima di arrivare all'indice.
+PostgreSQL usa la configurazione 'italian' nativa.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+
+TABELLA = 'prodotti_ricerca'
+RISULTATI_MASSIMI = 50
+DIMENSIONE_BLOCCO = 500
+
+# Pesi BM25 di FTS5, nell'ordine delle colonne della tabella virtuale
+PESI_FTS5 = (10.0, 5.0, 2.0, 1.0)
+
+_PAROLA = re.compile(r'\w+')
+
+
+def normalizza(testo):
+    testo = unicodedata.normalize('NFKD', testo.lower())
+    return ''.join(c for c in testo if not unicodedata.combining(c))
+
+
+def radice(parola):
+    """Stemmer leggero per l'italiano: unifica singolare/plurale e
+    maschile/femminile (cucina, cucine -> cucin; bianco, bianchi -> bianc)."""
+    if len(parola) <= 3 or parola.isdigit():
+        return parola
+    if parola.endswith(('che', 'chi', 'ghe', 'ghi')):
+        return parola[:-2]
+    if parola[-1] in 'aeiou':
+        return parola[:-1]
+    return parola
+
+
+def termini(testo):
+    return [radice(parola) for parola in _PAROLA.findall(normalizza(testo or ''))]
+
+
+def _testo_indicizzato(testo):
+    return ' '.join(termini(testo))
+
+
+def _campi(prodotto):
+    return (
+        prodotto.nome,
+        prodotto.categoria.nome,
+        prodotto.descrizione,
+        prodotto.specifiche_tecniche,
+    )
+
+
+def supportata():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def indicizza(prodotti):
+    """Inserisce o aggiorna i prodotti nell'indice (categoria già caricata)."""
+    if not supportata():
+        return
+    prodotti = list(prodotti)
+    if not prodotti:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                f'DELETE FROM {TABELLA} WHERE rowid = %s',
+                [(prodotto.pk,) for prodotto in prodotti],
+            )
+            cursor.executemany(
+                f'INSERT INTO {TABELLA} (rowid, nome, categoria, descrizione, specifiche_tecniche) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                [
+                    (prodotto.pk, *(_testo_indicizzato(campo) for campo in _campi(prodotto)))
+                    for prodotto in prodotti
+                ],
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {TABELLA} (prodotto_id, documento) VALUES (%s, '
+                "setweight(to_tsvector('italian', %s), 'A') || "
+                "setweight(to_tsvector('italian', %s), 'B') || "
+                "setweight(to_tsvector('italian', %s), 'C') || "
+                "setweight(to_tsvector('italian', %s), 'D')) "
+                'ON CONFLICT (prodotto_id) DO UPDATE SET documento = EXCLUDED.documento',
+                [(prodotto.pk, *_campi(prodotto)) for prodotto in prodotti],
+            )
+
+
+def rimuovi(ids):
+    if not supportata() or not ids:
+        return
+    colonna = 'rowid' if connection.vendor == 'sqlite' else 'prodotto_id'
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {TABELLA} WHERE {colonna} = %s',
+            [(pk,) for pk in ids],
+        )
+
+
+def ricostruisci_indice():
+    from .models import Prodotto
+
+    if not supportata():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABELLA}')
+    totale = 0
+    blocco = []
+    for prodotto in Prodotto.objects.select_related('categoria').iterator(chunk_size=DIMENSIONE_BLOCCO):
+        blocco.append(prodotto)
+        if len(blocco) == DIMENSIONE_BLOCCO:
+            indicizza(blocco)
+            totale += len(blocco)
+            blocco = []
+    indicizza(blocco)
+    return totale + len(blocco)
+
+
+def cerca_ids(testo, limite=RISULTATI_MASSIMI, solo_disponibili=False):
+    """Id dei prodotti che corrispondono a `testo`, dal più rilevante.
+
+    Con `solo_disponibili` il filtro è nella stessa query, in JOIN con la
+    tabella dei prodotti: il limite si applica ai soli prodotti disponibili.
+    """
+    from .models import Prodotto
+
+    parole = termini(testo)
+    if not parole:
+        return []
+
+    prodotti = Prodotto._meta.db_table
+    if connection.vendor == 'sqlite':
+        # Ogni termine è una \w+ già normalizzata: può essere quotato senza escape
+        query = ' '.join(f'"{parola}"*' for parola in parole)
+        pesi = ', '.join(str(peso) for peso in PESI_FTS5)
+        colonna = f'{TABELLA}.rowid'
+        sql = (
+            f'SELECT {colonna} FROM {TABELLA} {{join}}WHERE {TABELLA} MATCH %s {{filtro}}'
+            f'ORDER BY bm25({TABELLA}, {pesi}) LIMIT %s'
+        )
+    elif connection.vendor == 'postgresql':
+        # Lo stemming lo fa la configurazione 'italian': si passano le parole intere
+        query = ' & '.join(f'{parola}:*' for parola in _PAROLA.findall(testo.lower()))
+        colonna = f'{TABELLA}.prodotto_id'
+        sql = (
+            f"SELECT {colonna} FROM {TABELLA} {{join}}CROSS JOIN to_tsquery('italian', %s) query "
+            'WHERE documento @@ query {filtro}ORDER BY ts_rank(documento, query) DESC LIMIT %s'
+        )
+    else:
+        filtro = Q()
+        for parola in testo.split():
+            filtro &= Q(nome__icontains=parola) | Q(descrizione__icontains=parola)
+        if solo_disponibili:
+            filtro &= Q(disponibile=True)
+        return list(Prodotto.objects.filter(filtro).values_list('pk', flat=True)[:limite])
+
+    if solo_disponibili:
+        sql = sql.format(
+            join=f'INNER JOIN {prodotti} ON {prodotti}.id = {colonna} ',
+            filtro=f'AND {prodotti}.disponibile = %s ',
+        )
+        parametri = [query, True, limite]
+    else:
+        sql = sql.format(join='', filtro='')
+        parametri = [query, limite]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametri)
+        return [riga[0] for riga in cursor.fetchall()]
+
+
+def cerca_prodotti(testo, limite=RISULTATI_MASSIMI):
+    """Prodotti disponibili pronti per le card, in ordine di rilevanza."""
+    from .models import Prodotto
+
+    ids = cerca_ids(testo, limite, solo_disponibili=True)
+    trovati = Prodotto.objects.per_card().in_bulk(ids)
+    return [trovati[pk] for pk in ids if pk in trovati]
@@ -0,0 +1,137 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import facet, rendition, ricerca
+from .cache_catalogo import invalida_cache_catalogo
+from .models import Categoria, Prodotto, ImmagineProdotto
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=Prodotto)
+@receiver(post_save, sender=ImmagineProdotto)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_delete, sender=Prodotto)
+@receiver(post_delete, sender=ImmagineProdotto)
+def aggiorna_versione_catalogo(sender, **kwargs):
+    invalida_cache_catalogo()
+
+
+@receiver(post_save, sender=Prodotto)
+def indicizza_prodotto(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ricerca.indicizza([instance])
+
+
+@receiver(post_delete, sender=Prodotto)
+def rimuovi_prodotto_da_indice(sender, instance, **kwargs):
+    ricerca.rimuovi([instance.pk])
+
+
+@receiver(post_save, sender=Categoria)
+def indicizza_prodotti_categoria(sender, instance, created, raw=False, **kwargs):
+    # Il nome della categoria fa parte del documento indicizzato
+    if not created and not raw:
+        ricerca.indicizza(instance.prodotti.select_related('categoria'))
+
+
+@receiver(pre_save, sender=Prodotto)
+def memorizza_chiave_facet(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._chiave_facet_precedente = None
+    instance._prezzo_precedente = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not facet.CAMPI.intersection(update_fields):
+        return
+    precedente = sender.objects.filter(pk=instance.pk).values(
+        'categoria_id', 'prezzo_base', 'disponibile', 'in_evidenza'
+    ).first()
+    if precedente:
+        instance._prezzo_precedente = precedente['prezzo_base']
+        instance._chiave_facet_precedente = (
+            precedente['categoria_id'],
+            facet.fascia_di(precedente['prezzo_base']),
+            precedente['disponibile'],
+            precedente['in_evidenza'],
+        )
+
+
+@receiver(post_save, sender=Prodotto)
+def aggiorna_conteggi_facet(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not facet.CAMPI.intersection(update_fields):
+        return
+    delta = Counter({facet.chiave_prodotto(instance): 1})
+    precedente = getattr(instance, '_chiave_facet_precedente', None)
+    if precedente:
+        delta[precedente] -= 1
+    elif not created:
+        # Riga non trovata in pre_save: il conteggio verrà corretto da ricalcola_facet
+        return
+    facet.applica_delta(delta)
+
+
+@receiver(post_delete, sender=Prodotto)
+def rimuovi_da_conteggi_facet(sender, instance, **kwargs):
+    facet.applica_delta({facet.chiave_prodotto(instance): -1})
+
+
+@receiver(post_save, sender=Prodotto)
+def aggiorna_statistiche_categoria(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not facet.CAMPI.intersection(update_fields):
+        return
+    precedente = getattr(instance, '_chiave_facet_precedente', None)
+    if not created and precedente == facet.chiave_prodotto(instance) and not _prezzo_cambiato(instance):
+        return
+    ids = {instance.categoria_id}
+    if precedente:
+        ids.add(precedente[0])
+    Categoria.objects.filter(pk__in=ids).aggiorna_statistiche()
+
+
+def _prezzo_cambiato(instance):
+    # La chiave delle faccette contiene solo la fascia: il prezzo minimo
+    # può cambiare anche restando nella stessa fascia
+    return getattr(instance, '_prezzo_precedente', None) != instance.prezzo_base
+
+
+@receiver(pre_save, sender=ImmagineProdotto)
+def memorizza_file_precedente(sender, instance, raw=False, **kwargs):
+    instance._file_precedente = None
+    if not raw and not instance._state.adding:
+        instance._file_precedente = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('file_immagine', flat=True).first()
+
+
+@receiver(post_save, sender=ImmagineProdotto)
+def genera_rendition_immagine(sender, instance, created, raw=False, **kwargs):
+    if raw or not instance.file_immagine:
+        return
+    if created or instance.file_immagine.name != getattr(instance, '_file_precedente', None):
+        rendition.pianifica_rendition(instance.pk)
+
+
+@receiver(post_delete, sender=ImmagineProdotto)
+def elimina_rendition_immagine(sender, instance, **kwargs):
+    transaction.on_commit(lambda: rendition.elimina_file(instance.rendition))
+
+
+# Eliminare una riga non aggiorna alcuna data_aggiornamento: si aggiorna
+# quella della riga padre perché i validatori HTTP del catalogo cambino
+
+@receiver(post_delete, sender=Prodotto)
+def aggiorna_categoria_dopo_eliminazione(sender, instance, **kwargs):
+    # Ricalcola anche le statistiche della categoria, con lo stesso UPDATE
+    Categoria.objects.filter(pk=instance.categoria_id).aggiorna_statistiche()
+
+
+@receiver(post_delete, sender=ImmagineProdotto)
+def aggiorna_prodotto_dopo_eliminazione(sender, instance, **kwargs):
+    Prodotto.objects.filter(pk=instance.prodotto_id).update(data_aggiornamento=timezone.now())
@@ -0,0 +1,14 @@
+from django import template
+
+from prodotti import rendition
+
+register = template.Library()
+
+
+@register.filter
+def srcset(oggetto, formato='jpeg'):
+    """Attributo srcset di un ImmagineProdotto o dell'immagine principale
+    di un Prodotto: {{ prodotto|srcset:"webp" }}."""
+    if not oggetto:
+        return ''
+    return rendition.srcset(oggetto.get_rendition(), formato)
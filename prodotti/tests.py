@@ -1,3 +1,894 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from clienti.models import Cliente
+from negozio_cucine.test_utils import QueryListaMixin
+from preventivi.models import Preventivo, VocePreventivo
+
+from . import cache_catalogo, correlati, facet, listino, ricerca
+from .admin import ProdottoAdmin
+from .templatetags.immagini import srcset
+from .models import (
+    Categoria, Prodotto, ProdottoQuerySet, ImmagineProdotto, ConteggioFacet, ProdottoCorrelato,
+    RevisioneListino,
+)
+
+# I test che contano le query usano una cache in memoria: con la cache nel
+# database (il default, vedi settings.CACHES) anche letture e scritture della
+# cache sarebbero query
+CACHE_IN_MEMORIA = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+def crea_catalogo(numero_prodotti, immagini_per_prodotto=2):
+    categoria = Categoria.objects.create(nome='Cucine Moderne')
+    prodotti = []
+    for i in range(numero_prodotti):
+        prodotto = Prodotto.objects.create(
+            categoria=categoria,
+            nome=f'Cucina {i:03d}',
+            descrizione='Descrizione lunga ' * 50,
+            specifiche_tecniche='Specifiche ' * 50,
+            prezzo_base=Decimal('1000.00') + i,
+            in_evidenza=True,
+        )
+        for j in range(immagini_per_prodotto):
+            ImmagineProdotto.objects.create(
+                prodotto=prodotto,
+                file_immagine=f'prodotti/test/{prodotto.slug}-{j}.jpg',
+                alt_text=prodotto.nome,
+                ordine=j,
+                is_principale=(j == immagini_per_prodotto - 1),
+            )
+        prodotti.append(prodotto)
+    return categoria, prodotti
+
+
+def richiesta_admin():
+    request = RequestFactory().post('/')
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    return request
+
+
+class ProdottoCardTest(TestCase):
+    def test_per_card_carica_immagine_principale_senza_query(self):
+        crea_catalogo(3)
+        with self.assertNumQueries(1):
+            prodotti = list(Prodotto.objects.per_card())
+            for prodotto in prodotti:
+                self.assertTrue(prodotto.get_immagine_principale().endswith('-1.jpg'))
+                self.assertEqual(prodotto.categoria.nome, 'Cucine Moderne')
+
+    def test_per_card_non_carica_campi_testo(self):
+        crea_catalogo(1)
+        prodotto = Prodotto.objects.per_card().get()
+        self.assertEqual(
+            prodotto.get_deferred_fields(),
+            {
+                'descrizione', 'specifiche_tecniche', 'data_creazione',
+                'data_aggiornamento', 'correlati_calcolati_il',
+            },
+        )
+        self.assertEqual(len(prodotto.descrizione_breve), ProdottoQuerySet.LUNGHEZZA_ANTEPRIMA)
+
+    def test_prodotto_senza_immagini(self):
+        crea_catalogo(1, immagini_per_prodotto=0)
+        self.assertIsNone(Prodotto.objects.per_card().get().get_immagine_principale())
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class ProdottoQueryCountTest(TestCase):
+    # Le query includono il calcolo del validatore ETag/Last-Modified,
+    # eseguito una volta per versione del catalogo
+    def setUp(self):
+        cache.clear()
+
+    def test_homepage_query_costanti(self):
+        crea_catalogo(6)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('prodotti:homepage'))
+        self.assertEqual(len(response.context['prodotti_evidenza']), 6)
+
+    def test_catalogo_query_costanti(self):
+        crea_catalogo(12)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('prodotti:catalogo'))
+        self.assertEqual(len(response.context['prodotti']), 12)
+
+    def test_dettaglio_query_costanti(self):
+        _, prodotti = crea_catalogo(5)
+        correlati.aggiorna_correlati()
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('prodotti:dettaglio', args=[prodotti[0].slug]))
+        self.assertEqual(len(response.context['prodotti_correlati']), 4)
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class CachePaginaCatalogoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        _, self.prodotti = crea_catalogo(3)
+        self.url = reverse('prodotti:catalogo')
+
+    def test_seconda_richiesta_servita_dalla_cache(self):
+        prima = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            seconda = self.client.get(self.url)
+        self.assertEqual(prima.content, seconda.content)
+
+    def test_querystring_diverse_chiavi_diverse(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(3):
+            self.client.get(self.url + '?categoria=cucine-moderne')
+
+    def test_salvataggio_prodotto_invalida(self):
+        self.client.get(self.url)
+        prodotto = self.prodotti[0]
+        prodotto.nome = 'Cucina Rinominata'
+        with self.captureOnCommitCallbacks(execute=True):
+            prodotto.save()
+        self.assertContains(self.client.get(self.url), 'Cucina Rinominata')
+
+    def test_azione_admin_con_update_invalida(self):
+        self.client.get(self.url)
+        versione = cache_catalogo.get_versione_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProdottoAdmin(Prodotto, admin.site).marca_non_disponibile(
+                richiesta_admin(), Prodotto.objects.all()
+            )
+        self.assertEqual(cache_catalogo.get_versione_catalogo(), versione + 1)
+        self.assertContains(self.client.get(self.url), 'Nessun prodotto disponibile')
+
+    def test_eliminazione_immagine_invalida(self):
+        versione = cache_catalogo.get_versione_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            ImmagineProdotto.objects.first().delete()
+        self.assertGreater(cache_catalogo.get_versione_catalogo(), versione)
+
+    def test_copia_scaduta_servita_durante_ricostruzione(self):
+        self.client.get(self.url)
+        chiave = cache_catalogo._chiave_pagina(self.client.get(self.url).wsgi_request)
+        voce = cache.get(chiave)
+        voce['scadenza'] = 0
+        cache.set(chiave, voce)
+        cache.add(f'{chiave}:lock', 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, voce['contenuto'])
+
+    def test_utente_autenticato_non_usa_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(User.objects.create_user('staff'))
+        chiave = cache_catalogo._chiave_pagina(self.client.get(self.url).wsgi_request)
+        cache.delete(chiave)
+        self.client.get(self.url)
+        self.assertIsNone(cache.get(chiave))
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class PaginazioneKeysetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria, self.prodotti = crea_catalogo(30, immagini_per_prodotto=0)
+        # Nomi duplicati e valori misti di in_evidenza per esercitare il tie-break su id
+        Prodotto.objects.filter(pk__in=[p.pk for p in self.prodotti[::3]]).update(in_evidenza=False)
+        for prodotto in self.prodotti[10:14]:
+            Prodotto.objects.filter(pk=prodotto.pk).update(nome='Cucina Gemella')
+        self.attesi = list(
+            Prodotto.objects.filter(disponibile=True)
+            .order_by('-in_evidenza', 'nome', 'id').values_list('pk', flat=True)
+        )
+        self.url = reverse('prodotti:catalogo')
+
+    def _pagina(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def test_scorrimento_avanti_e_indietro(self):
+        pagine = [self._pagina()]
+        while pagine[-1].has_next():
+            pagine.append(self._pagina(cursore=pagine[-1].cursore_successivo))
+        self.assertEqual([p.pk for pagina in pagine for p in pagina], self.attesi)
+        self.assertEqual(len(pagine), 3)
+        self.assertFalse(pagine[0].has_previous())
+
+        indietro = [pagine[-1]]
+        while indietro[-1].has_previous():
+            indietro.append(self._pagina(cursore=indietro[-1].cursore_precedente))
+        self.assertEqual(
+            [[p.pk for p in pagina] for pagina in reversed(indietro)],
+            [[p.pk for p in pagina] for pagina in pagine],
+        )
+
+    def test_pagina_a_cursore_senza_count(self):
+        cursore = self._pagina().cursore_successivo
+        cache.clear()
+        cache_catalogo.validatore_catalogo()
+        with self.assertNumQueries(3) as contesto:
+            self.client.get(self.url, {'cursore': cursore})
+        sql = ' '.join(query['sql'] for query in contesto.captured_queries)
+        self.assertNotIn('COUNT', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_url_con_numero_pagina_funzionano(self):
+        pagina = self._pagina(page=2)
+        self.assertEqual([p.pk for p in pagina], self.attesi[12:24])
+        self.assertEqual(pagina.paginator.num_pages, 3)
+
+    def test_cursore_non_valido(self):
+        response = self.client.get(self.url, {'cursore': 'manomesso'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RicercaProdottiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.moderne = Categoria.objects.create(nome='Cucine Moderne')
+        self.elettro = Categoria.objects.create(nome='Elettrodomestici')
+        self.linear = Prodotto.objects.create(
+            categoria=self.moderne, nome='Cucina Linear Bianca', prezzo_base=8500,
+            descrizione='Ante laccate lucide.', specifiche_tecniche='Colori: bianco, grigio',
+        )
+        self.forno = Prodotto.objects.create(
+            categoria=self.elettro, nome='Forno Multifunzione', prezzo_base=900,
+            descrizione='Forno da incasso adatto a cucine moderne.',
+            specifiche_tecniche='Classe A+',
+        )
+
+    def test_stemming_italiano(self):
+        self.assertEqual(ricerca.radice('cucine'), ricerca.radice('cucina'))
+        self.assertEqual(ricerca.radice('bianchi'), ricerca.radice('bianco'))
+        self.assertEqual(ricerca.termini('Città'), ricerca.termini('citta'))
+
+    def test_risultati_ordinati_per_rilevanza(self):
+        self.assertEqual(ricerca.cerca_ids('cucina moderna'), [self.linear.pk, self.forno.pk])
+
+    def test_ricerca_su_specifiche_e_prefissi(self):
+        self.assertEqual(ricerca.cerca_ids('grig'), [self.linear.pk])
+
+    def test_indice_aggiornato_al_salvataggio(self):
+        self.forno.nome = 'Piano Cottura Induzione'
+        self.forno.save()
+        self.assertEqual(ricerca.cerca_ids('induzione'), [self.forno.pk])
+        self.assertEqual(ricerca.cerca_ids('multifunzione'), [])
+
+    def test_rinomina_categoria_reindicizza(self):
+        self.elettro.nome = 'Grandi Elettrodomestici'
+        self.elettro.save()
+        self.assertEqual(ricerca.cerca_ids('grandi'), [self.forno.pk])
+
+    def test_eliminazione_rimuove_dall_indice(self):
+        pk = self.forno.pk
+        self.forno.delete()
+        self.assertNotIn(pk, ricerca.cerca_ids('forno'))
+
+    def test_prodotti_creati_in_blocco_indicizzati(self):
+        creati = Prodotto.objects.bulk_create([
+            Prodotto(categoria=self.elettro, nome=f'Cappa Aspirante {i}', slug=f'cappa-{i}',
+                     prezzo_base=400, descrizione='Cappa a parete')
+            for i in range(2)
+        ])
+        self.assertEqual(sorted(ricerca.cerca_ids('cappa')), sorted(p.pk for p in creati))
+        # Anche il nome della categoria, letta in JOIN
+        self.assertIn(creati[0].pk, ricerca.cerca_ids('elettrodomestici'))
+
+    def test_ricostruzione_indice(self):
+        self.assertEqual(ricerca.ricostruisci_indice(), 2)
+        self.assertEqual(ricerca.cerca_ids('forno'), [self.forno.pk])
+
+    def test_vista_ricerca(self):
+        response = self.client.get(reverse('prodotti:ricerca'), {'q': 'bianche'})
+        self.assertEqual(list(response.context['prodotti']), [self.linear])
+        self.assertContains(response, 'Cucina Linear Bianca')
+
+    def test_non_disponibili_esclusi_prima_del_limite(self):
+        # I prodotti non disponibili più rilevanti non consumano il limite
+        for i in range(3):
+            Prodotto.objects.create(
+                categoria=self.elettro, nome=f'Forno Forno Compatto {i}', prezzo_base=700,
+                descrizione='Forno', disponibile=False,
+            )
+        self.assertNotIn(self.forno.pk, ricerca.cerca_ids('forno', limite=3))
+        self.assertEqual(ricerca.cerca_ids('forno', limite=3, solo_disponibili=True), [self.forno.pk])
+        self.assertEqual(ricerca.cerca_prodotti('forno', limite=3), [self.forno])
+
+    def test_vista_ricerca_query_con_sintassi_fts(self):
+        response = self.client.get(reverse('prodotti:ricerca'), {'q': '"forno" OR NEAR( *'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_ricerca_admin_usa_indice(self):
+        model_admin = ProdottoAdmin(Prodotto, admin.site)
+        queryset, duplicati = model_admin.get_search_results(
+            richiesta_admin(), Prodotto.objects.all(), 'specifiche bianco'
+        )
+        self.assertFalse(duplicati)
+        self.assertEqual(list(queryset), [])
+        queryset, _ = model_admin.get_search_results(
+            richiesta_admin(), Prodotto.objects.all(), 'bianco'
+        )
+        self.assertEqual(list(queryset), [self.linear])
+        # Ordine di rilevanza dell'indice, non quello del modello
+        queryset, _ = model_admin.get_search_results(
+            richiesta_admin(), Prodotto.objects.order_by('-nome'), 'cucina moderna'
+        )
+        self.assertEqual(list(queryset), [self.linear, self.forno])
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class FacetCatalogoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.moderne = Categoria.objects.create(nome='Cucine Moderne')
+        self.classiche = Categoria.objects.create(nome='Cucine Classiche')
+        for nome, categoria, prezzo, evidenza in [
+            ('Linear', self.moderne, 8500, True),
+            ('Urban', self.moderne, 4500, False),
+            ('Wood', self.moderne, 1500, False),
+            ('Provenzale', self.classiche, 12500, True),
+            ('Rustica', self.classiche, 4800, False),
+        ]:
+            Prodotto.objects.create(
+                categoria=categoria, nome=nome, prezzo_base=prezzo,
+                descrizione=nome, in_evidenza=evidenza,
+            )
+        self.url = reverse('prodotti:catalogo')
+
+    def _celle(self):
+        return {
+            (c.categoria_id, c.fascia_prezzo, c.disponibile, c.in_evidenza): c.numero
+            for c in ConteggioFacet.objects.exclude(numero=0)
+        }
+
+    def assertConteggiCoerenti(self):
+        self.assertEqual(self._celle(), {
+            chiave: numero
+            for chiave, numero in facet.conteggi_per_chiave(Prodotto.objects.all()).items()
+        })
+
+    def test_conteggi_mantenuti_su_salvataggio_ed_eliminazione(self):
+        self.assertConteggiCoerenti()
+        prodotto = Prodotto.objects.get(nome='Urban')
+        prodotto.prezzo_base = 11000
+        prodotto.categoria = self.classiche
+        prodotto.save()
+        self.assertConteggiCoerenti()
+        prodotto.delete()
+        self.assertConteggiCoerenti()
+
+    def test_conteggi_mantenuti_con_update_in_blocco(self):
+        ProdottoAdmin(Prodotto, admin.site).marca_non_disponibile(
+            richiesta_admin(), Prodotto.objects.filter(categoria=self.moderne)
+        )
+        self.assertConteggiCoerenti()
+        Prodotto.objects.filter(prezzo_base__lt=5000).update(in_evidenza=True)
+        self.assertConteggiCoerenti()
+
+    def test_filtri_combinati(self):
+        response = self.client.get(self.url, {'categoria': 'cucine-moderne', 'prezzo': ['2000-5000', 'fino-2000']})
+        self.assertEqual({p.nome for p in response.context['prodotti']}, {'Urban', 'Wood'})
+        response = self.client.get(self.url, {'evidenza': '1'})
+        self.assertEqual({p.nome for p in response.context['prodotti']}, {'Linear', 'Provenzale'})
+
+    def test_conteggi_facet_escludono_il_proprio_filtro(self):
+        response = self.client.get(self.url, {'categoria': 'cucine-moderne', 'prezzo': '2000-5000'})
+        facet_ctx = response.context['facet']
+        categorie = {v['etichetta']: v['conteggio'] for v in facet_ctx['categorie']}
+        self.assertEqual(categorie, {'Cucine Moderne': 1, 'Cucine Classiche': 1})
+        prezzi = [v['conteggio'] for v in facet_ctx['prezzi']]
+        self.assertEqual(prezzi, [1, 1, 1, 0])
+        self.assertEqual(facet_ctx['evidenza']['conteggio'], 0)
+        self.assertContains(response, 'Cucine Moderne')
+
+    def test_conteggi_senza_count_per_valore(self):
+        with self.assertNumQueries(4):
+            self.client.get(self.url, {'categoria': 'cucine-classiche'})
+
+    def test_ricalcolo_completo(self):
+        ConteggioFacet.objects.all().delete()
+        facet.ricalcola_tutto()
+        self.assertConteggiCoerenti()
+
+
+class StatisticheCategoriaTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.moderne = Categoria.objects.create(nome='Cucine Moderne')
+        self.classiche = Categoria.objects.create(nome='Cucine Classiche')
+        for nome, categoria, prezzo, evidenza in [
+            ('Linear', self.moderne, 8500, True),
+            ('Urban', self.moderne, 4500, False),
+            ('Provenzale', self.classiche, 12500, True),
+        ]:
+            Prodotto.objects.create(
+                categoria=categoria, nome=nome, prezzo_base=prezzo,
+                descrizione=nome, in_evidenza=evidenza,
+            )
+
+    def _statistiche(self, categoria):
+        categoria.refresh_from_db()
+        return categoria.numero_prodotti, categoria.numero_in_evidenza, categoria.prezzo_minimo
+
+    def test_statistiche_iniziali(self):
+        self.assertEqual(self._statistiche(self.moderne), (2, 1, Decimal('4500')))
+        self.assertEqual(self._statistiche(self.classiche), (1, 1, Decimal('12500')))
+
+    def test_cambio_categoria_aggiorna_entrambe(self):
+        urban = Prodotto.objects.get(nome='Urban')
+        urban.categoria = self.classiche
+        urban.save()
+        self.assertEqual(self._statistiche(self.moderne), (1, 1, Decimal('8500')))
+        self.assertEqual(self._statistiche(self.classiche), (2, 1, Decimal('4500')))
+
+    def test_prezzo_nella_stessa_fascia(self):
+        urban = Prodotto.objects.get(nome='Urban')
+        urban.prezzo_base = 4200
+        urban.save()
+        self.assertEqual(self._statistiche(self.moderne)[2], Decimal('4200'))
+
+    def test_salvataggio_senza_campi_rilevanti_non_ricalcola(self):
+        urban = Prodotto.objects.get(nome='Urban')
+        with CaptureQueriesContext(connection) as query:
+            urban.save(update_fields=['descrizione'])
+        self.assertFalse([q for q in query if 'UPDATE "prodotti_categoria"' in q['sql']])
+
+    def test_eliminazione_e_categoria_vuota(self):
+        Prodotto.objects.get(nome='Provenzale').delete()
+        self.assertEqual(self._statistiche(self.classiche), (0, 0, None))
+
+    def test_update_in_blocco(self):
+        ProdottoAdmin(Prodotto, admin.site).marca_non_disponibile(
+            richiesta_admin(), Prodotto.objects.filter(nome='Urban')
+        )
+        self.assertEqual(self._statistiche(self.moderne), (1, 1, Decimal('8500')))
+        Prodotto.objects.filter(categoria=self.moderne).update(in_evidenza=False)
+        self.assertEqual(self._statistiche(self.moderne), (1, 0, Decimal('8500')))
+        Prodotto.objects.bulk_create([
+            Prodotto(categoria=self.classiche, nome='Borgo', slug='borgo', prezzo_base=3000, descrizione='Borgo'),
+        ])
+        self.assertEqual(self._statistiche(self.classiche), (2, 1, Decimal('3000')))
+
+    def test_comando_di_riparazione(self):
+        Categoria.objects.update(numero_prodotti=0, numero_in_evidenza=0, prezzo_minimo=None)
+        with self.assertNumQueries(1):
+            call_command('ricalcola_statistiche_categorie', stdout=io.StringIO())
+        self.assertEqual(self._statistiche(self.moderne), (2, 1, Decimal('4500')))
+
+    def test_homepage_mostra_statistiche(self):
+        response = self.client.get(reverse('prodotti:homepage'))
+        self.assertContains(response, '2 prodotti')
+        self.assertContains(response, 'da € 4500')
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class ProdottiCorrelatiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.categoria = Categoria.objects.create(nome='Cucine')
+        self.accessori = Categoria.objects.create(nome='Accessori')
+
+        def crea(nome, descrizione, categoria=None):
+            return Prodotto.objects.create(
+                categoria=categoria or self.categoria, nome=nome,
+                descrizione=descrizione, prezzo_base=1000,
+            )
+
+        self.linear = crea('Linear', 'Cucina moderna con ante laccate lucide e piano in quarzo.')
+        self.urban = crea('Urban', 'Cucine moderne laccate lucide con isola e piano quarzo.')
+        self.country = crea('Country', 'Cucina rustica in legno massello di rovere.')
+        self.cappa = crea('Cappa Isola', 'Aspirazione silenziosa in acciaio.', self.accessori)
+
+    def _vicini(self, prodotto):
+        return list(prodotto.correlati.values_list('correlato_id', flat=True))
+
+    def test_similarita_testuale(self):
+        correlati.aggiorna_correlati()
+        self.assertEqual(self._vicini(self.linear)[0], self.urban.pk)
+
+    def test_preventivi_comuni_aumentano_il_punteggio(self):
+        cliente = Cliente.objects.create(
+            nome='Mario', cognome='Rossi', email='mario@example.com', telefono='3331234567'
+        )
+        for _ in range(3):
+            preventivo = Preventivo.objects.create(cliente=cliente, sconto_percentuale=Decimal('0'))
+            VocePreventivo.objects.create(preventivo=preventivo, prodotto=self.country)
+            VocePreventivo.objects.create(preventivo=preventivo, prodotto=self.cappa)
+        correlati.aggiorna_correlati()
+        self.assertEqual(self._vicini(self.cappa), [self.country.pk])
+
+    def test_aggiornamento_incrementale(self):
+        correlati.aggiorna_correlati()
+        self.assertEqual(correlati.prodotti_da_aggiornare(), set())
+        self.urban.descrizione = 'Cucina moderna rinnovata'
+        self.urban.save()
+        da_aggiornare = correlati.prodotti_da_aggiornare()
+        self.assertIn(self.urban.pk, da_aggiornare)
+        self.assertIn(self.linear.pk, da_aggiornare)
+        self.assertEqual(correlati.aggiorna_correlati(), len(da_aggiornare))
+        self.assertEqual(correlati.prodotti_da_aggiornare(), set())
+
+    def test_dettaglio_legge_correlati_precalcolati(self):
+        correlati.aggiorna_correlati()
+        response = self.client.get(reverse('prodotti:dettaglio', args=[self.linear.slug]))
+        self.assertEqual(response.context['prodotti_correlati'][0], self.urban)
+
+    def test_dettaglio_senza_correlati_usa_la_categoria(self):
+        ProdottoCorrelato.objects.all().delete()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('prodotti:dettaglio', args=[self.linear.slug]))
+        self.assertEqual(
+            {p.pk for p in response.context['prodotti_correlati']},
+            {self.urban.pk, self.country.pk},
+        )
+
+
+def immagine_di_prova(larghezza, altezza, nome='showroom.jpg'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (larghezza, altezza), (200, 120, 40)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(nome, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(RENDITION_SINCRONE=True)
+class RenditionImmaginiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        impostazioni = override_settings(MEDIA_ROOT=self.media)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.categoria, (self.prodotto,) = crea_catalogo(1, immagini_per_prodotto=0)
+
+    def _carica(self, larghezza, altezza):
+        with self.captureOnCommitCallbacks(execute=True):
+            immagine = ImmagineProdotto.objects.create(
+                prodotto=self.prodotto,
+                file_immagine=immagine_di_prova(larghezza, altezza),
+                alt_text='Showroom',
+            )
+        immagine.refresh_from_db()
+        return immagine
+
+    def test_rendition_generate_al_caricamento(self):
+        immagine = self._carica(2000, 1000)
+        self.assertEqual(set(immagine.rendition), {'webp', 'jpeg'})
+        self.assertEqual(list(immagine.rendition['webp']), ['320', '640', '960', '1280'])
+        percorso = os.path.join(self.media, immagine.rendition['webp']['640'])
+        with Image.open(percorso) as versione:
+            self.assertEqual(versione.format, 'WEBP')
+            self.assertEqual(versione.size, (640, 320))
+
+    def test_immagini_piccole_non_ingrandite(self):
+        immagine = self._carica(500, 400)
+        self.assertEqual(list(immagine.rendition['jpeg']), ['320', '500'])
+
+    def test_srcset_nelle_card_senza_query_aggiuntive(self):
+        self._carica(1000, 800)
+        with self.assertNumQueries(1):
+            prodotto = Prodotto.objects.per_card().get()
+            valore = srcset(prodotto, 'webp')
+        self.assertIn('-320.webp 320w', valore)
+        self.assertIn('-960.webp 960w', valore)
+        response = self.client.get(reverse('prodotti:catalogo'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '-640.jpg 640w')
+
+    def test_comando_backfill(self):
+        ImmagineProdotto.objects.create(
+            prodotto=self.prodotto,
+            file_immagine=ImmagineProdotto._meta.get_field('file_immagine').storage.save(
+                'prodotti/vecchia.jpg', immagine_di_prova(700, 700)
+            ),
+            alt_text='Vecchia',
+        )
+        call_command('genera_rendition', stdout=io.StringIO())
+        immagine = ImmagineProdotto.objects.get()
+        self.assertEqual(list(immagine.rendition['jpeg']), ['320', '640', '700'])
+
+
+@override_settings(CACHES=CACHE_IN_MEMORIA)
+class GetCondizionaleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        _, self.prodotti = crea_catalogo(2)
+        self.url = reverse('prodotti:dettaglio', args=[self.prodotti[0].slug])
+
+    def test_risposta_con_validatori(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_304_senza_query_ne_rendering(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0), self.assertTemplateNotUsed('prodotti/prodotto_dettaglio.html'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(reverse('prodotti:catalogo'))['Last-Modified']
+        response = self.client.get(reverse('prodotti:catalogo'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_utente_autenticato_senza_validatori(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_login(User.objects.create_user('cliente', password='password'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def _etag_dopo(self, modifica):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            modifica()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_modifica_immagine_cambia_validatore(self):
+        def modifica():
+            immagine = ImmagineProdotto.objects.first()
+            immagine.alt_text = 'Nuovo testo'
+            immagine.save()
+        self._etag_dopo(modifica)
+
+    def test_eliminazione_immagine_cambia_validatore(self):
+        self._etag_dopo(lambda: ImmagineProdotto.objects.last().delete())
+
+    def test_azione_in_blocco_cambia_validatore(self):
+        self._etag_dopo(lambda: Prodotto.objects.filter(pk=self.prodotti[1].pk).update(in_evidenza=False))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ChangelistCatalogoTest(QueryListaMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_liste_con_query_costanti(self):
+        categoria, _ = crea_catalogo(3, immagini_per_prodotto=0)
+        url_prodotti = reverse('admin:prodotti_prodotto_changelist')
+        url_categorie = reverse('admin:prodotti_categoria_changelist')
+        _, prodotti = self._query_lista(url_prodotti)
+        _, categorie = self._query_lista(url_categorie)
+        for i in range(20):
+            altra = Categoria.objects.create(nome=f'Categoria {i}')
+            Prodotto.objects.create(
+                categoria=altra if i % 2 else categoria, nome=f'Elettrodomestico {i}',
+                descrizione='Descrizione', prezzo_base=Decimal('100.00') + i,
+            )
+        self.assertEqual(self._query_lista(url_prodotti)[1], prodotti)
+        self.assertEqual(self._query_lista(url_categorie)[1], categorie)
+
+    def test_conteggio_stimato_senza_filtri(self):
+        _, prodotti = crea_catalogo(4, immagini_per_prodotto=0)
+        prodotti[0].delete()
+        url = reverse('admin:prodotti_prodotto_changelist')
+        with mock.patch.object(ProdottoAdmin, 'soglia_conteggio_stimato', 2):
+            response, _ = self._query_lista(url)
+            # MAX(pk) su SQLite: sovrastima dopo un'eliminazione
+            self.assertTrue(response.context['cl'].paginator.stimato)
+            self.assertGreaterEqual(response.context['cl'].result_count, 3)
+            self.assertContains(response, 'circa </span>')
+
+            # Con un filtro il conteggio resta esatto
+            response, _ = self._query_lista(f'{url}?disponibile__exact=1')
+            self.assertFalse(response.context['cl'].paginator.stimato)
+            self.assertEqual(response.context['cl'].result_count, 3)
+
+        response, _ = self._query_lista(url)
+        self.assertFalse(response.context['cl'].paginator.stimato)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertNotContains(response, 'circa </span>')
+
+    def test_pagina_oltre_la_stima_diventa_l_ultima(self):
+        _, prodotti = crea_catalogo(8, immagini_per_prodotto=0)
+        # Restano due prodotti, ma MAX(pk) ne stima ancora otto
+        for prodotto in prodotti[:6]:
+            prodotto.delete()
+        url = reverse('admin:prodotti_prodotto_changelist')
+        with mock.patch.object(ProdottoAdmin, 'soglia_conteggio_stimato', 2), \
+                mock.patch.object(ProdottoAdmin, 'list_per_page', 2):
+            for pagina in (3, 40):
+                response, _ = self._query_lista(f'{url}?p={pagina}')
+                cl = response.context['cl']
+                self.assertEqual(cl.page_num, 1)
+                self.assertEqual(cl.result_count, 2)
+                self.assertFalse(cl.paginator.stimato)
+                self.assertEqual(set(cl.result_list), set(prodotti[6:]))
+
+            # Pagina esistente: la stima resta
+            response, _ = self._query_lista(f'{url}?p=1')
+            self.assertTrue(response.context['cl'].paginator.stimato)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RevisioneListinoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.moderne = Categoria.objects.create(nome='Cucine Moderne')
+        self.classiche = Categoria.objects.create(nome='Cucine Classiche')
+        for nome, categoria, prezzo, disponibile in [
+            ('Linear', self.moderne, '8500.00', True),
+            ('Urban', self.moderne, '4500.00', True),
+            ('Wood', self.moderne, '1099.99', False),
+            ('Provenzale', self.classiche, '12500.00', True),
+        ]:
+            Prodotto.objects.create(
+                categoria=categoria, nome=nome, prezzo_base=Decimal(prezzo),
+                descrizione=nome, disponibile=disponibile,
+            )
+
+    def _prezzi(self):
+        return dict(Prodotto.objects.values_list('nome', 'prezzo_base'))
+
+    def assertConteggiCoerenti(self):
+        celle = {
+            (c.categoria_id, c.fascia_prezzo, c.disponibile, c.in_evidenza): c.numero
+            for c in ConteggioFacet.objects.exclude(numero=0)
+        }
+        self.assertEqual(celle, dict(facet.conteggi_per_chiave(Prodotto.objects.all())))
+
+    def test_anteprima_non_modifica(self):
+        prezzi = self._prezzi()
+        totale, righe = listino.anteprima(
+            listino.seleziona(categorie=[self.moderne]), RevisioneListino.PERCENTUALE, Decimal('4')
+        )
+        self.assertEqual(totale, 3)
+        self.assertEqual(
+            {p.nome: round(p.nuovo_prezzo, 2) for p in righe},
+            {'Linear': Decimal('8840.00'), 'Urban': Decimal('4680.00'), 'Wood': Decimal('1143.99')},
+        )
+        self.assertEqual(self._prezzi(), prezzi)
+
+    def test_applica_a_blocchi_con_una_sola_invalidazione(self):
+        versione = cache_catalogo.get_versione_catalogo()
+        with mock.patch.object(listino, 'DIMENSIONE_BLOCCO', 2), \
+                self.captureOnCommitCallbacks(execute=True) as callbacks, \
+                CaptureQueriesContext(connection) as query:
+            revisione = listino.applica(
+                listino.seleziona(categorie=[self.moderne]), RevisioneListino.PERCENTUALE, Decimal('4'),
+                descrizione='Listino fornitore 2026',
+            )
+        self.assertEqual(revisione.numero_prodotti, 3)
+        self.assertEqual(self._prezzi(), {
+            'Linear': Decimal('8840.00'), 'Urban': Decimal('4680.00'),
+            'Wood': Decimal('1143.99'), 'Provenzale': Decimal('12500.00'),
+        })
+        self.assertEqual(
+            set(revisione.variazioni.values_list('prodotto__nome', 'prezzo_precedente', 'prezzo_nuovo')),
+            {
+                ('Linear', Decimal('8500.00'), Decimal('8840.00')),
+                ('Urban', Decimal('4500.00'), Decimal('4680.00')),
+                ('Wood', Decimal('1099.99'), Decimal('1143.99')),
+            },
+        )
+        # Due blocchi, un UPDATE ciascuno; statistiche e cache una volta sola
+        aggiornamenti = [q for q in query if q['sql'].startswith('UPDATE "prodotti_prodotto"')]
+        self.assertEqual(len(aggiornamenti), 2)
+        self.assertEqual(len([q for q in query if q['sql'].startswith('UPDATE "prodotti_categoria"')]), 1)
+        self.assertEqual(callbacks.count(cache_catalogo.incrementa_versione_catalogo), 1)
+        self.assertEqual(cache_catalogo.get_versione_catalogo(), versione + 1)
+        self.moderne.refresh_from_db()
+        self.assertEqual(self.moderne.prezzo_minimo, Decimal('4680.00'))
+        self.assertConteggiCoerenti()
+
+    def test_intervallo_di_prezzo_fissato_prima_degli_aggiornamenti(self):
+        # Urban passa in un'altra fascia e non deve essere aumentato due volte
+        listino.applica(
+            listino.seleziona(prezzo_minimo=Decimal('2000'), prezzo_massimo=Decimal('10000')),
+            RevisioneListino.IMPORTO, Decimal('600'),
+        )
+        self.assertEqual(self._prezzi()['Urban'], Decimal('5100.00'))
+        self.assertEqual(self._prezzi()['Linear'], Decimal('9100.00'))
+        self.assertConteggiCoerenti()
+
+    def test_prezzi_negativi_rifiutati(self):
+        prezzi = self._prezzi()
+        with self.assertRaises(ValidationError):
+            listino.applica(listino.seleziona(), RevisioneListino.IMPORTO, Decimal('-2000'))
+        with self.assertRaises(ValidationError):
+            listino.applica(listino.seleziona(), RevisioneListino.PERCENTUALE, Decimal('-100'))
+        self.assertEqual(self._prezzi(), prezzi)
+        self.assertFalse(RevisioneListino.objects.exists())
+
+    def test_annullamento_salta_i_prodotti_modificati_dopo(self):
+        prezzi = self._prezzi()
+        revisione = listino.applica(listino.seleziona(), RevisioneListino.PERCENTUALE, Decimal('-10'))
+        urban = Prodotto.objects.get(nome='Urban')
+        urban.prezzo_base = Decimal('3999.00')
+        urban.save()
+
+        self.assertEqual(listino.annulla(revisione), (3, 1))
+        self.assertEqual(self._prezzi(), {**prezzi, 'Urban': Decimal('3999.00')})
+        self.assertConteggiCoerenti()
+        with self.assertRaises(ValidationError):
+            listino.annulla(revisione)
+
+    def test_strumento_admin_anteprima_e_applica(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:prodotti_prodotto_revisione_listino')
+        self.assertContains(self.client.get(reverse('admin:prodotti_prodotto_changelist')), url)
+        dati = {
+            'tipo': RevisioneListino.IMPORTO, 'valore': '100', 'categorie': [self.classiche.pk],
+            'disponibilita': '1', 'descrizione': 'Trasporto',
+        }
+        response = self.client.post(url, {**dati, '_anteprima': '1'})
+        self.assertEqual(response.context['totale'], 1)
+        self.assertContains(response, 'Provenzale')
+        self.assertEqual(self._prezzi()['Provenzale'], Decimal('12500.00'))
+
+        response = self.client.post(url, {**dati, '_applica': '1'})
+        revisione = RevisioneListino.objects.get()
+        self.assertRedirects(response, reverse('admin:prodotti_revisionelistino_change', args=[revisione.pk]))
+        self.assertEqual(revisione.filtri, {'categorie': ['cucine-classiche'], 'disponibile': True})
+        self.assertEqual(revisione.eseguita_da, 'admin')
+        self.assertEqual(self._prezzi()['Provenzale'], Decimal('12600.00'))
+
+        self.client.post(reverse('admin:prodotti_revisionelistino_changelist'), {
+            'action': 'annulla_revisioni', '_selected_action': [revisione.pk],
+        })
+        self.assertEqual(self._prezzi()['Provenzale'], Decimal('12500.00'))
+
+    def test_annullamento_admin_richiede_permessi_di_modifica(self):
+        revisione = listino.applica(listino.seleziona(), RevisioneListino.IMPORTO, Decimal('100'))
+        prezzi = self._prezzi()
+        utente = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        utente.user_permissions.add(Permission.objects.get(codename='view_revisionelistino'))
+        self.client.force_login(utente)
+        url = reverse('admin:prodotti_revisionelistino_changelist')
+        dati = {'action': 'annulla_revisioni', '_selected_action': [revisione.pk]}
+
+        # Senza change_revisionelistino l'azione non è offerta
+        self.assertNotContains(self.client.get(url), 'annulla_revisioni')
+        self.client.post(url, dati)
+        self.assertEqual(self._prezzi(), prezzi)
+
+        # Con change_revisionelistino ma senza change_prodotto è vietata
+        utente.user_permissions.add(Permission.objects.get(codename='change_revisionelistino'))
+        utente = User.objects.get(pk=utente.pk)
+        self.client.force_login(utente)
+        self.assertEqual(self.client.post(url, dati).status_code, 403)
+        self.assertEqual(self._prezzi(), prezzi)
+
+        utente.user_permissions.add(Permission.objects.get(codename='change_prodotto'))
+        self.client.force_login(User.objects.get(pk=utente.pk))
+        self.client.post(url, dati)
+        self.assertEqual(self._prezzi()['Linear'], Decimal('8500.00'))
+
+    def test_comando(self):
+        out = io.StringIO()
+        call_command(
+            'revisione_listino', '--percentuale', '5', '--categoria', 'cucine-moderne',
+            '--solo-disponibili', '--anteprima', stdout=out,
+        )
+        self.assertIn('2 prodotti interessati', out.getvalue())
+        self.assertFalse(RevisioneListino.objects.exists())
+
+        call_command(
+            'revisione_listino', '--percentuale', '5', '--categoria', 'cucine-moderne',
+            '--solo-disponibili', stdout=io.StringIO(),
+        )
+        self.assertEqual(self._prezzi()['Linear'], Decimal('8925.00'))
+        self.assertEqual(self._prezzi()['Wood'], Decimal('1099.99'))
+        revisione = RevisioneListino.objects.get()
+        call_command('revisione_listino', '--annulla', str(revisione.pk), stdout=io.StringIO())
+        self.assertEqual(self._prezzi()['Linear'], Decimal('8500.00'))
@@ -6,5 +6,6 @@ app_name = 'prodotti'
 urlpatterns = [
     path('', views.homepage, name='homepage'),
     path('catalogo/', views.CatalogoListView.as_view(), name='catalogo'),
+    path('cerca/', views.ricerca_prodotti, name='ricerca'),
     path('prodotto/<slug:slug>/', views.ProdottoDetailView.as_view(), name='dettaglio'),
 ]
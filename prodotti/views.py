@@ -1,9 +1,16 @@
 from django.shortcuts import render, get_object_or_404
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView
-from .models import Prodotto, Categoria
+from .cache_catalogo import cache_pagina_catalogo, condizionale_catalogo
+from . import ricerca
+from .facet import FiltriCatalogo
+from .models import Prodotto, Categoria, ConteggioFacet
+from .paginazione import KeysetPaginator
 
+@condizionale_catalogo
+@cache_pagina_catalogo
 def homepage(request):
-    prodotti_evidenza = Prodotto.objects.filter(
+    prodotti_evidenza = Prodotto.objects.per_card().filter(
         in_evidenza=True, 
         disponibile=True
     )[:6]
@@ -14,35 +21,74 @@ def homepage(request):
     }
     return render(request, 'prodotti/homepage.html', context)
 
+@method_decorator(condizionale_catalogo, name='dispatch')
+@method_decorator(cache_pagina_catalogo, name='dispatch')
 class CatalogoListView(ListView):
     model = Prodotto
     template_name = 'prodotti/catalogo.html'
     context_object_name = 'prodotti'
     paginate_by = 12
+    # Senza ?page= la paginazione usa i cursori: nessun COUNT né OFFSET
+    paginazione_keyset = True
+    
+    def paginate_queryset(self, queryset, page_size):
+        if not self.paginazione_keyset or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size)
+        page = paginator.pagina(self.request.GET.get('cursore'))
+        return (paginator, page, page.object_list, page.has_other_pages())
     
     def get_queryset(self):
-        queryset = Prodotto.objects.filter(disponibile=True)
-        categoria_slug = self.request.GET.get('categoria')
-        if categoria_slug:
-            queryset = queryset.filter(categoria__slug=categoria_slug)
-        return queryset
+        self.filtri = FiltriCatalogo(self.request.GET, Categoria.objects.all())
+        return self.filtri.applica(Prodotto.objects.per_card())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categorie'] = Categoria.objects.all()
-        context['categoria_selezionata'] = self.request.GET.get('categoria', '')
+        celle = {
+            (categoria_id, fascia, disponibile, in_evidenza): numero
+            for categoria_id, fascia, disponibile, in_evidenza, numero
+            in ConteggioFacet.objects.values_list(
+                'categoria_id', 'fascia_prezzo', 'disponibile', 'in_evidenza', 'numero'
+            )
+        }
+        context['categorie'] = self.filtri.categorie
+        context['facet'] = self.filtri.facet(celle)
+        context['filtri_querystring'] = self.filtri.querystring()
         return context
 
+@method_decorator(condizionale_catalogo, name='dispatch')
+@method_decorator(cache_pagina_catalogo, name='dispatch')
 class ProdottoDetailView(DetailView):
     model = Prodotto
     template_name = 'prodotti/prodotto_dettaglio.html'
     context_object_name = 'prodotto'
     slug_field = 'slug'
     
+    def get_queryset(self):
+        return Prodotto.objects.select_related('categoria').prefetch_related('immagini')
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['prodotti_correlati'] = Prodotto.objects.filter(
-            categoria=self.object.categoria,
+        correlati = list(Prodotto.objects.per_card().filter(
+            correlato_di__prodotto=self.object,
             disponibile=True
-        ).exclude(id=self.object.id)[:4]
+        ).order_by('correlato_di__posizione')[:4])
+        if not correlati:
+            # Vicini non ancora calcolati: prodotti della stessa categoria
+            correlati = Prodotto.objects.per_card().filter(
+                categoria=self.object.categoria,
+                disponibile=True
+            ).exclude(id=self.object.id)[:4]
+        context['prodotti_correlati'] = correlati
         return context
+
+@condizionale_catalogo
+@cache_pagina_catalogo
+def ricerca_prodotti(request):
+    query = request.GET.get('q', '').strip()
+    prodotti = ricerca.cerca_prodotti(query) if query else []
+    context = {
+        'query': query,
+        'prodotti': prodotti,
+    }
+    return render(request, 'prodotti/ricerca.html', context)
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib import admin
+from django.db.models import Sum
+from django.db.models.functions import ExtractMonth
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+from clienti.models import Appuntamento
+from preventivi.models import Preventivo
+from .models import RiepilogoAppuntamenti, RiepilogoPreventivi
+
+MESI = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
+
+def _per_mese(righe, chiavi, campo):
+    """{(valori delle chiavi): [valore per ogni mese]} dalle righe aggregate per mese."""
+    tabella = defaultdict(lambda: [0] * 12)
+    for riga in righe:
+        tabella[tuple(riga[c] for c in chiavi)][riga['mese'] - 1] += riga[campo] or 0
+    return tabella
+
+@admin.register(RiepilogoPreventivi)
+class CruscottoVenditeAdmin(admin.ModelAdmin):
+    """Cruscotto delle vendite: legge solo le tabelle di riepilogo."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        oggi = timezone.localdate()
+        try:
+            anno = int(request.GET.get('anno', oggi.year))
+        except ValueError:
+            anno = oggi.year
+
+        preventivi = (
+            RiepilogoPreventivi.objects.filter(giorno__year=anno)
+            .annotate(mese=ExtractMonth('giorno'))
+        )
+        # Righe senza categoria: ogni preventivo contato una volta
+        per_stato = list(
+            preventivi.filter(categoria__isnull=True)
+            .values('mese', 'stato').annotate(numero=Sum('numero'), importo=Sum('importo'))
+        )
+        numero = _per_mese(per_stato, ['stato'], 'numero')
+        importo = _per_mese(per_stato, ['stato'], 'importo')
+        totali = [sum(valori[mese] for valori in numero.values()) for mese in range(12)]
+        conversione = [
+            round(100 * numero[('ACCETTATO',)][mese] / totali[mese], 1) if totali[mese] else None
+            for mese in range(12)
+        ]
+
+        accettati = _per_mese(
+            preventivi.filter(categoria__isnull=False, stato='ACCETTATO')
+            .values('mese', 'categoria__nome').annotate(importo=Sum('importo')),
+            ['categoria__nome'], 'importo',
+        )
+
+        appuntamenti = _per_mese(
+            RiepilogoAppuntamenti.objects.filter(giorno__year=anno)
+            .annotate(mese=ExtractMonth('giorno'))
+            .values('mese', 'tipo_consulenza', 'stato').annotate(numero=Sum('numero')),
+            ['tipo_consulenza', 'stato'], 'numero',
+        )
+        tipi = dict(Appuntamento.TIPO_CONSULENZA_CHOICES)
+        stati = dict(Appuntamento.STATO_CHOICES)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Statistiche vendite {anno}',
+            'opts': self.model._meta,
+            'anno': anno,
+            'anni': [anno - 1, anno + 1],
+            'mesi': MESI,
+            'preventivi_per_stato': [
+                {
+                    'stato': etichetta,
+                    'numero': numero[(stato,)],
+                    'importo': importo[(stato,)],
+                }
+                for stato, etichetta in Preventivo.STATO_CHOICES
+            ],
+            'totali': totali,
+            'conversione': conversione,
+            'accettati_per_categoria': sorted(
+                ({'categoria': nome, 'importo': valori, 'totale': sum(valori, Decimal('0'))}
+                 for (nome,), valori in accettati.items()),
+                key=lambda riga: -riga['totale'],
+            ),
+            'appuntamenti_per_tipo': [
+                {'tipo': tipi.get(tipo, tipo), 'stato': stati.get(stato, stato), 'numero': valori}
+                for (tipo, stato), valori in sorted(appuntamenti.items())
+            ],
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'statistiche/cruscotto.html', context)
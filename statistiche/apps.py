@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class StatisticheConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'statistiche'
+    verbose_name = 'Statistiche'
+
+    def ready(self):
+        from . import signals  # noqa: F401
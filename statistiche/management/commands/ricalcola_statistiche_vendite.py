@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from statistiche import riepiloghi
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce dai dati le tabelle di riepilogo di preventivi e appuntamenti'
+
+    def handle(self, *args, **options):
+        giorni_preventivi, giorni_appuntamenti = riepiloghi.ricalcola_tutto()
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Statistiche ricalcolate: {giorni_preventivi} giorni di preventivi, '
+            f'{giorni_appuntamenti} giorni di appuntamenti'
+        ))
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('prodotti', '0008_statistiche_categoria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiepilogoAppuntamenti',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('giorno', models.DateField(verbose_name='Giorno')),
+                ('tipo_consulenza', models.CharField(max_length=20, verbose_name='Tipo Consulenza')),
+                ('stato', models.CharField(max_length=20, verbose_name='Stato')),
+                ('numero', models.PositiveIntegerField(default=0, verbose_name='Numero appuntamenti')),
+            ],
+            options={
+                'verbose_name': 'Riepilogo Appuntamenti',
+                'verbose_name_plural': 'Riepiloghi Appuntamenti',
+            },
+        ),
+        migrations.CreateModel(
+            name='RiepilogoPreventivi',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('giorno', models.DateField(verbose_name='Giorno')),
+                ('stato', models.CharField(max_length=20, verbose_name='Stato')),
+                ('numero', models.PositiveIntegerField(default=0, verbose_name='Numero preventivi')),
+                ('importo', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Importo (€)')),
+            ],
+            options={
+                'verbose_name': 'Riepilogo Preventivi',
+                'verbose_name_plural': 'Riepiloghi Preventivi',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='riepilogoappuntamenti',
+            constraint=models.UniqueConstraint(fields=('giorno', 'tipo_consulenza', 'stato'), name='riepilogo_appuntamenti_unico'),
+        ),
+        migrations.AddField(
+            model_name='riepilogopreventivi',
+            name='categoria',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='riepiloghi_preventivi', to='prodotti.categoria', verbose_name='Categoria'),
+        ),
+        migrations.AddConstraint(
+            model_name='riepilogopreventivi',
+            constraint=models.UniqueConstraint(condition=models.Q(('categoria__isnull', False)), fields=('giorno', 'categoria', 'stato'), name='riepilogo_preventivi_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='riepilogopreventivi',
+            constraint=models.UniqueConstraint(condition=models.Q(('categoria__isnull', True)), fields=('giorno', 'stato'), name='riepilogo_preventivi_totale_unico'),
+        ),
+    ]
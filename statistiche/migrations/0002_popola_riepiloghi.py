@@ -0,0 +1,57 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import TruncDate
+
+
+def popola_riepiloghi(apps, schema_editor):
+    Preventivo = apps.get_model('preventivi', 'Preventivo')
+    VocePreventivo = apps.get_model('preventivi', 'VocePreventivo')
+    Appuntamento = apps.get_model('clienti', 'Appuntamento')
+    RiepilogoPreventivi = apps.get_model('statistiche', 'RiepilogoPreventivi')
+    RiepilogoAppuntamenti = apps.get_model('statistiche', 'RiepilogoAppuntamenti')
+
+    RiepilogoPreventivi.objects.bulk_create(
+        RiepilogoPreventivi(giorno=r['giorno'], stato=r['stato'], numero=r['numero'], importo=r['importo'] or 0)
+        for r in Preventivo.objects.order_by().annotate(giorno=TruncDate('data_creazione'))
+        .values('giorno', 'stato').annotate(numero=Count('pk'), importo=Sum('totale_stimato'))
+    )
+    RiepilogoPreventivi.objects.bulk_create(
+        RiepilogoPreventivi(
+            giorno=r['giorno'], categoria_id=r['prodotto__categoria'], stato=r['preventivo__stato'],
+            numero=r['numero'],
+            importo=Decimal(str(r['importo'] or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+        )
+        for r in VocePreventivo.objects.order_by()
+        .annotate(giorno=TruncDate('preventivo__data_creazione'))
+        .values('giorno', 'prodotto__categoria', 'preventivo__stato')
+        .annotate(
+            numero=Count('preventivo', distinct=True),
+            importo=Sum(
+                F('quantita') * F('prezzo_unitario_finale')
+                * (100 - F('preventivo__sconto_percentuale')) * Value(Decimal('0.01')),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+        )
+    )
+    RiepilogoAppuntamenti.objects.bulk_create(
+        RiepilogoAppuntamenti(
+            giorno=r['giorno'], tipo_consulenza=r['tipo_consulenza'], stato=r['stato'], numero=r['numero']
+        )
+        for r in Appuntamento.objects.order_by().annotate(giorno=TruncDate('data_ora'))
+        .values('giorno', 'tipo_consulenza', 'stato').annotate(numero=Count('pk'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statistiche', '0001_initial'),
+        ('preventivi', '0004_indice_data_creazione'),
+        ('clienti', '0002_indice_data_appuntamento'),
+    ]
+
+    operations = [
+        migrations.RunPython(popola_riepiloghi, migrations.RunPython.noop),
+    ]
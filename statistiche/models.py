@@ -0,0 +1,64 @@
+from django.db import models
+from django.db.models import Q
+from prodotti.models import Categoria
+
+class RiepilogoPreventivi(models.Model):
+    """Preventivi per giorno di creazione, categoria e stato (vedi riepiloghi.py).
+    
+    Le righe senza categoria riassumono i preventivi interi: `numero` conta
+    ogni preventivo una volta e `importo` somma i totali scontati. Nelle
+    righe di una categoria `numero` conta i preventivi con almeno una voce
+    della categoria e `importo` la quota scontata di quelle voci.
+    """
+    giorno = models.DateField(verbose_name="Giorno")
+    categoria = models.ForeignKey(
+        Categoria,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='riepiloghi_preventivi',
+        verbose_name="Categoria"
+    )
+    stato = models.CharField(max_length=20, verbose_name="Stato")
+    numero = models.PositiveIntegerField(default=0, verbose_name="Numero preventivi")
+    importo = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Importo (€)")
+    
+    class Meta:
+        verbose_name = "Riepilogo Preventivi"
+        verbose_name_plural = "Riepiloghi Preventivi"
+        constraints = [
+            # Due vincoli parziali: NULL non viola un vincolo UNIQUE ordinario
+            models.UniqueConstraint(
+                fields=['giorno', 'categoria', 'stato'],
+                condition=Q(categoria__isnull=False),
+                name='riepilogo_preventivi_unico',
+            ),
+            models.UniqueConstraint(
+                fields=['giorno', 'stato'],
+                condition=Q(categoria__isnull=True),
+                name='riepilogo_preventivi_totale_unico',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.giorno} {self.categoria_id or 'tutte'} {self.stato}: {self.numero}"
+
+class RiepilogoAppuntamenti(models.Model):
+    """Appuntamenti per giorno, tipo di consulenza e stato (vedi riepiloghi.py)."""
+    giorno = models.DateField(verbose_name="Giorno")
+    tipo_consulenza = models.CharField(max_length=20, verbose_name="Tipo Consulenza")
+    stato = models.CharField(max_length=20, verbose_name="Stato")
+    numero = models.PositiveIntegerField(default=0, verbose_name="Numero appuntamenti")
+    
+    class Meta:
+        verbose_name = "Riepilogo Appuntamenti"
+        verbose_name_plural = "Riepiloghi Appuntamenti"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['giorno', 'tipo_consulenza', 'stato'],
+                name='riepilogo_appuntamenti_unico',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.giorno} {self.tipo_consulenza} {self.stato}: {self.numero}"
@@ -0,0 +1,232 @@
+"""
+Tabelle di riepilogo per le statistiche di vendita.
+
+RiepilogoPreventivi e RiepilogoAppuntamenti contengono i conteggi per
+giorno già aggregati: il cruscotto in admin legge solo queste tabelle e
+non scorre mai preventivi, voci e appuntamenti.
+
+Ogni modifica che sposta un preventivo o un appuntamento da una cella
+all'altra (cambio di stato, voci, sconto, eliminazione, anche con update()
+in blocco) segna i giorni coinvolti con segna_preventivi() o
+segna_appuntamenti(), chiamate dai ricevitori in signals.py: per le
+modifiche in blocco i QuerySet inviano i segnali di
+negozio_cucine.segnali. Dopo il commit quei giorni vengono ricalcolati
+dai dati con una query aggregata per tabella, una sola volta per
+transazione anche quando le modifiche sono molte. Il ricalcolo legge i
+dati confermati e blocca le righe dei giorni interessati: due ricalcoli
+concorrenti dello stesso giorno vengono eseguiti uno dopo l'altro.
+
+Il comando ricalcola_statistiche_vendite ricostruisce da zero le tabelle,
+per esempio dopo aver spostato molti prodotti fra categorie con update().
+"""
+import threading
+from datetime import datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import RiepilogoAppuntamenti, RiepilogoPreventivi
+
+# Campi che spostano un preventivo o un appuntamento in un'altra cella
+CAMPI_PREVENTIVO = {'stato', 'sconto_percentuale', 'data_creazione'}
+CAMPI_APPUNTAMENTO = {'stato', 'tipo_consulenza', 'data_ora'}
+
+# Giorni ricalcolati con una sola coppia di query
+GIORNI_PER_BLOCCO = 31
+
+
+class _InAttesa(threading.local):
+    """Preventivi, prodotti, appuntamenti e giorni da ricalcolare al
+    prossimo commit nel thread corrente."""
+
+    def __init__(self):
+        self.preventivi = set()
+        self.prodotti = set()
+        self.giorni_preventivi = set()
+        self.appuntamenti = set()
+        self.giorni_appuntamenti = set()
+
+    def svuota(self):
+        contenuto = dict(self.__dict__)
+        self.__init__()
+        return contenuto
+
+
+_in_attesa = _InAttesa()
+
+
+def _pianifica():
+    # Ogni modifica registra un callback, ma solo il primo eseguito trova
+    # qualcosa da fare: i successivi della stessa transazione non fanno query
+    transaction.on_commit(aggiorna_in_attesa, robust=True)
+
+
+def giorno_di(data_ora):
+    return timezone.localdate(data_ora)
+
+
+def segna_preventivi(ids=(), giorni=(), prodotti=()):
+    """Ricalcola dopo il commit i giorni dei preventivi indicati, quelli in
+    `giorni` e quelli dei preventivi che contengono i `prodotti`."""
+    _in_attesa.preventivi.update(pk for pk in ids if pk is not None)
+    _in_attesa.prodotti.update(prodotti)
+    _in_attesa.giorni_preventivi.update(giorni)
+    _pianifica()
+
+
+def segna_appuntamenti(ids=(), giorni=()):
+    """Ricalcola dopo il commit i giorni degli appuntamenti indicati e quelli in `giorni`."""
+    _in_attesa.appuntamenti.update(pk for pk in ids if pk is not None)
+    _in_attesa.giorni_appuntamenti.update(giorni)
+    _pianifica()
+
+
+def ids_e_giorni(queryset, campo):
+    """Id e giorni delle righe di `queryset`, letti prima di un update() in
+    blocco: se `campo` cambia, i nuovi giorni si ricavano dagli id."""
+    righe = list(queryset.values_list('pk', campo))
+    return [pk for pk, _ in righe], {giorno_di(data_ora) for _, data_ora in righe}
+
+
+def aggiorna_in_attesa():
+    from clienti.models import Appuntamento
+    from preventivi.models import Preventivo
+
+    in_attesa = _in_attesa.svuota()
+    giorni = set(in_attesa['giorni_preventivi'])
+    if in_attesa['preventivi']:
+        giorni.update(_giorni(Preventivo.objects.filter(pk__in=in_attesa['preventivi']), 'data_creazione'))
+    if in_attesa['prodotti']:
+        giorni.update(_giorni(
+            Preventivo.objects.filter(voci__prodotto__in=in_attesa['prodotti']), 'data_creazione'
+        ))
+    ricalcola_preventivi(giorni)
+
+    giorni = set(in_attesa['giorni_appuntamenti'])
+    if in_attesa['appuntamenti']:
+        giorni.update(_giorni(Appuntamento.objects.filter(pk__in=in_attesa['appuntamenti']), 'data_ora'))
+    ricalcola_appuntamenti(giorni)
+
+
+def _giorni(queryset, campo):
+    return set(
+        queryset.order_by().annotate(giorno=TruncDate(campo))
+        .values_list('giorno', flat=True).distinct()
+    )
+
+
+def _blocchi(giorni):
+    giorni = sorted(giorni)
+    for inizio in range(0, len(giorni), GIORNI_PER_BLOCCO):
+        yield giorni[inizio:inizio + GIORNI_PER_BLOCCO]
+
+
+def _intervallo(campo, giorni):
+    """Filtro sull'intervallo dei giorni, per usare l'indice su `campo`."""
+    inizio = timezone.make_aware(datetime.combine(giorni[0], time.min))
+    fine = timezone.make_aware(datetime.combine(giorni[-1] + timedelta(days=1), time.min))
+    return {f'{campo}__gte': inizio, f'{campo}__lt': fine}
+
+
+def _sostituisci(modello, giorni, calcola):
+    """Sostituisce le righe di `modello` per `giorni` con quelle prodotte
+    da `calcola()`, eseguito dopo aver bloccato le righe esistenti."""
+    for tentativo in range(2):
+        try:
+            with transaction.atomic():
+                esistenti = modello.objects.filter(giorno__in=giorni)
+                list(esistenti.select_for_update().values_list('pk', flat=True))
+                righe = calcola()
+                esistenti.delete()
+                modello.objects.bulk_create(righe)
+            return
+        except IntegrityError:
+            # Un altro ricalcolo ha creato per primo le righe di un giorno
+            # ancora vuoto: con le sue righe bloccate il secondo tentativo
+            # attende che termini
+            if tentativo:
+                raise
+
+
+def _arrotonda(importo):
+    # Sotto SQLite la somma arriva come float
+    return Decimal(str(importo or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def ricalcola_preventivi(giorni):
+    from preventivi.models import Preventivo, VocePreventivo
+
+    for blocco in _blocchi(giorni):
+        def calcola(blocco=blocco):
+            preventivi = (
+                Preventivo.objects.filter(**_intervallo('data_creazione', blocco))
+                .order_by().annotate(giorno=TruncDate('data_creazione'))
+                .filter(giorno__in=blocco)
+            )
+            righe = [
+                RiepilogoPreventivi(giorno=r['giorno'], categoria=None, stato=r['stato'],
+                                    numero=r['numero'], importo=r['importo'] or 0)
+                for r in preventivi.values('giorno', 'stato')
+                .annotate(numero=Count('pk'), importo=Sum('totale_stimato'))
+            ]
+            voci = (
+                VocePreventivo.objects.filter(**_intervallo('preventivo__data_creazione', blocco))
+                .order_by().annotate(giorno=TruncDate('preventivo__data_creazione'))
+                .filter(giorno__in=blocco)
+                .values('giorno', 'prodotto__categoria', 'preventivo__stato')
+                .annotate(
+                    numero=Count('preventivo', distinct=True),
+                    # Quota della categoria al netto dello sconto del preventivo
+                    importo=Sum(
+                        F('quantita') * F('prezzo_unitario_finale')
+                        * (100 - F('preventivo__sconto_percentuale')) * Value(Decimal('0.01')),
+                        output_field=DecimalField(max_digits=14, decimal_places=2),
+                    ),
+                )
+            )
+            righe.extend(
+                RiepilogoPreventivi(
+                    giorno=r['giorno'], categoria_id=r['prodotto__categoria'], stato=r['preventivo__stato'],
+                    numero=r['numero'], importo=_arrotonda(r['importo']),
+                )
+                for r in voci
+            )
+            return righe
+
+        _sostituisci(RiepilogoPreventivi, blocco, calcola)
+
+
+def ricalcola_appuntamenti(giorni):
+    from clienti.models import Appuntamento
+
+    for blocco in _blocchi(giorni):
+        def calcola(blocco=blocco):
+            return [
+                RiepilogoAppuntamenti(giorno=r['giorno'], tipo_consulenza=r['tipo_consulenza'],
+                                      stato=r['stato'], numero=r['numero'])
+                for r in Appuntamento.objects.filter(**_intervallo('data_ora', blocco))
+                .order_by().annotate(giorno=TruncDate('data_ora'))
+                .filter(giorno__in=blocco)
+                .values('giorno', 'tipo_consulenza', 'stato')
+                .annotate(numero=Count('pk'))
+            ]
+
+        _sostituisci(RiepilogoAppuntamenti, blocco, calcola)
+
+
+def ricalcola_tutto():
+    """Ricostruisce entrambe le tabelle dai dati; restituisce i giorni ricalcolati."""
+    from clienti.models import Appuntamento
+    from preventivi.models import Preventivo
+
+    with transaction.atomic():
+        RiepilogoPreventivi.objects.all().delete()
+        RiepilogoAppuntamenti.objects.all().delete()
+        giorni_preventivi = _giorni(Preventivo.objects.all(), 'data_creazione')
+        ricalcola_preventivi(giorni_preventivi)
+        giorni_appuntamenti = _giorni(Appuntamento.objects.all(), 'data_ora')
+        ricalcola_appuntamenti(giorni_appuntamenti)
+    return len(giorni_preventivi), len(giorni_appuntamenti)
@@ -0,0 +1,104 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from clienti.models import Appuntamento
+from preventivi.models import Preventivo, VocePreventivo
+from negozio_cucine import segnali
+from prodotti.models import Prodotto
+
+from . import riepiloghi
+
+
+# I ricalcoli vengono eseguiti dopo il commit, una volta per transazione
+# (vedi riepiloghi.py): i ricevitori si limitano a segnare cosa è cambiato
+
+# Campi di Preventivo che compaiono nelle statistiche
+CAMPI_PREVENTIVO = riepiloghi.CAMPI_PREVENTIVO | {'subtotale', 'totale_stimato'}
+
+
+@receiver(segnali.pre_update, sender=Preventivo)
+def segna_preventivi_aggiornati(sender, queryset, campi, **kwargs):
+    if riepiloghi.CAMPI_PREVENTIVO.intersection(campi):
+        # Anche il nuovo giorno, se cambia data_creazione: dagli id
+        riepiloghi.segna_preventivi(*riepiloghi.ids_e_giorni(queryset, 'data_creazione'))
+
+
+@receiver(segnali.modificati_in_blocco, sender=Preventivo)
+def segna_preventivi_modificati(sender, pks, **kwargs):
+    riepiloghi.segna_preventivi(pks)
+
+
+@receiver(post_save, sender=Preventivo)
+def segna_preventivo(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not CAMPI_PREVENTIVO.intersection(update_fields):
+        return
+    riepiloghi.segna_preventivi([instance.pk])
+
+
+@receiver(post_delete, sender=Preventivo)
+def segna_preventivo_eliminato(sender, instance, **kwargs):
+    riepiloghi.segna_preventivi(giorni=[riepiloghi.giorno_di(instance.data_creazione)])
+
+
+@receiver(post_save, sender=VocePreventivo)
+@receiver(post_delete, sender=VocePreventivo)
+def segna_voce(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ids = [instance.preventivo_id]
+    # Voce spostata da un altro preventivo
+    caricato = getattr(instance, '_contributo_caricato', None)
+    if caricato:
+        ids.append(caricato[0])
+    riepiloghi.segna_preventivi(ids)
+
+
+@receiver(post_save, sender=Prodotto)
+def segna_prodotto_spostato(sender, instance, created, raw=False, **kwargs):
+    # Chiave letta dal pre_save delle faccette: il primo elemento è la categoria
+    precedente = getattr(instance, '_chiave_facet_precedente', None)
+    if not raw and precedente and precedente[0] != instance.categoria_id:
+        riepiloghi.segna_preventivi(prodotti=[instance.pk])
+
+
+@receiver(segnali.pre_update, sender=Appuntamento)
+def segna_appuntamenti_aggiornati(sender, queryset, campi, **kwargs):
+    if riepiloghi.CAMPI_APPUNTAMENTO.intersection(campi):
+        riepiloghi.segna_appuntamenti(*riepiloghi.ids_e_giorni(queryset, 'data_ora'))
+
+
+@receiver(segnali.modificati_in_blocco, sender=Appuntamento)
+def segna_appuntamenti_modificati(sender, pks, **kwargs):
+    # Lo stato cambia, il giorno no: bastano gli id
+    riepiloghi.segna_appuntamenti(pks)
+
+
+@receiver(pre_save, sender=Appuntamento)
+def memorizza_giorno_appuntamento(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._giorno_precedente = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and 'data_ora' not in update_fields:
+        return
+    data_ora = sender.objects.filter(pk=instance.pk).values_list('data_ora', flat=True).first()
+    if data_ora:
+        instance._giorno_precedente = riepiloghi.giorno_di(data_ora)
+
+
+@receiver(post_save, sender=Appuntamento)
+def segna_appuntamento(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not riepiloghi.CAMPI_APPUNTAMENTO.intersection(update_fields):
+        return
+    giorni = {riepiloghi.giorno_di(instance.data_ora)}
+    if getattr(instance, '_giorno_precedente', None):
+        giorni.add(instance._giorno_precedente)
+    riepiloghi.segna_appuntamenti(giorni=giorni)
+
+
+@receiver(post_delete, sender=Appuntamento)
+def segna_appuntamento_eliminato(sender, instance, **kwargs):
+    riepiloghi.segna_appuntamenti(giorni=[riepiloghi.giorno_di(instance.data_ora)])
@@ -0,0 +1,173 @@
+import io
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from clienti.models import Appuntamento, Cliente
+from preventivi.models import Preventivo, VocePreventivo
+from prodotti.models import Categoria, Prodotto
+
+from . import riepiloghi
+from .models import RiepilogoAppuntamenti, RiepilogoPreventivi
+
+
+def celle_preventivi():
+    return {
+        (r.giorno, r.categoria_id, r.stato): (r.numero, r.importo)
+        for r in RiepilogoPreventivi.objects.all()
+    }
+
+
+def celle_appuntamenti():
+    return {
+        (r.giorno, r.tipo_consulenza, r.stato): r.numero
+        for r in RiepilogoAppuntamenti.objects.all()
+    }
+
+
+class RiepiloghiTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.cucine = Categoria.objects.create(nome='Cucine Moderne')
+        self.elettrodomestici = Categoria.objects.create(nome='Elettrodomestici')
+        self.cucina = Prodotto.objects.create(
+            categoria=self.cucine, nome='Cucina Aurora', descrizione='Cucina', prezzo_base=Decimal('1000.00')
+        )
+        self.forno = Prodotto.objects.create(
+            categoria=self.elettrodomestici, nome='Forno', descrizione='Forno', prezzo_base=Decimal('200.00')
+        )
+        self.cliente = Cliente.objects.create(
+            nome='Mario', cognome='Rossi', email='mario.rossi@example.com', telefono='3331234567',
+        )
+        self.oggi = timezone.localdate()
+
+    def _crea_preventivo(self, sconto='0'):
+        with self.captureOnCommitCallbacks(execute=True):
+            preventivo = Preventivo.objects.create(cliente=self.cliente, sconto_percentuale=Decimal(sconto))
+            VocePreventivo.objects.bulk_create([
+                VocePreventivo(preventivo=preventivo, prodotto=self.cucina, quantita=2),
+                VocePreventivo(preventivo=preventivo, prodotto=self.forno),
+            ])
+        return preventivo
+
+    def test_preventivo_per_categoria_e_stato(self):
+        self._crea_preventivo(sconto='10')
+        self.assertEqual(celle_preventivi(), {
+            (self.oggi, None, 'BOZZA'): (1, Decimal('1980.00')),
+            (self.oggi, self.cucine.pk, 'BOZZA'): (1, Decimal('1800.00')),
+            (self.oggi, self.elettrodomestici.pk, 'BOZZA'): (1, Decimal('180.00')),
+        })
+
+    def test_azione_admin_in_blocco_sposta_lo_stato(self):
+        preventivi = [self._crea_preventivo(), self._crea_preventivo()]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:preventivi_preventivo_changelist'), {
+                'action': 'marca_come_accettato', '_selected_action': [preventivi[0].pk],
+            })
+        celle = celle_preventivi()
+        self.assertEqual(celle[(self.oggi, None, 'ACCETTATO')], (1, Decimal('2200.00')))
+        self.assertEqual(celle[(self.oggi, None, 'BOZZA')], (1, Decimal('2200.00')))
+        self.assertEqual(celle[(self.oggi, self.cucine.pk, 'ACCETTATO')], (1, Decimal('2000.00')))
+
+    def test_modifica_voci_ed_eliminazione(self):
+        preventivo = self._crea_preventivo()
+        voce = preventivo.voci.get(prodotto=self.forno)
+        with self.captureOnCommitCallbacks(execute=True):
+            voce.quantita = 3
+            voce.save()
+        self.assertEqual(
+            celle_preventivi()[(self.oggi, self.elettrodomestici.pk, 'BOZZA')], (1, Decimal('600.00'))
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            voce.delete()
+        self.assertNotIn((self.oggi, self.elettrodomestici.pk, 'BOZZA'), celle_preventivi())
+
+        # Eliminato a cascata con il cliente
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente.delete()
+        self.assertEqual(celle_preventivi(), {})
+
+    def test_prodotto_spostato_di_categoria(self):
+        self._crea_preventivo()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.forno.categoria = self.cucine
+            self.forno.save()
+        self.assertEqual(celle_preventivi()[(self.oggi, self.cucine.pk, 'BOZZA')], (1, Decimal('2200.00')))
+        self.assertNotIn((self.oggi, self.elettrodomestici.pk, 'BOZZA'), celle_preventivi())
+
+    def test_un_solo_ricalcolo_per_transazione(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            preventivo = Preventivo.objects.create(cliente=self.cliente)
+            for prodotto in (self.cucina, self.forno, self.cucina):
+                VocePreventivo.objects.create(preventivo=preventivo, prodotto=prodotto)
+        ricalcoli = [c for c in callbacks if c is riepiloghi.aggiorna_in_attesa]
+        self.assertEqual(len(ricalcoli), 4)
+        ricalcoli[0]()
+        # Le modifiche sono già state ricalcolate dal primo callback
+        with self.assertNumQueries(0):
+            for callback in ricalcoli[1:]:
+                callback()
+        self.assertEqual(celle_preventivi()[(self.oggi, None, 'BOZZA')], (1, Decimal('2200.00')))
+
+    def test_appuntamenti_per_giorno_tipo_e_stato(self):
+        domani = timezone.now() + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            appuntamenti = [
+                Appuntamento.objects.create(cliente=self.cliente, data_ora=domani, tipo_consulenza='RILIEVO')
+                for _ in range(2)
+            ]
+        giorno = timezone.localdate(domani)
+        self.assertEqual(celle_appuntamenti(), {(giorno, 'RILIEVO', 'RICHIESTO'): 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Appuntamento.objects.filter(pk=appuntamenti[0].pk).update(stato='CONFERMATO')
+        self.assertEqual(celle_appuntamenti(), {
+            (giorno, 'RILIEVO', 'RICHIESTO'): 1,
+            (giorno, 'RILIEVO', 'CONFERMATO'): 1,
+        })
+
+        # Spostato a un altro giorno: la cella del giorno precedente si svuota
+        appuntamenti[0].refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            appuntamenti[0].data_ora = domani + timedelta(days=7)
+            appuntamenti[0].save()
+        self.assertEqual(celle_appuntamenti(), {
+            (giorno, 'RILIEVO', 'RICHIESTO'): 1,
+            (giorno + timedelta(days=7), 'RILIEVO', 'CONFERMATO'): 1,
+        })
+
+    def test_ricalcolo_completo_coincide_con_incrementale(self):
+        self._crea_preventivo(sconto='5')
+        with self.captureOnCommitCallbacks(execute=True):
+            Preventivo.objects.update(stato='INVIATO')
+            Appuntamento.objects.create(cliente=self.cliente, data_ora=timezone.now())
+        incrementali = (celle_preventivi(), celle_appuntamenti())
+        RiepilogoPreventivi.objects.all().delete()
+        call_command('ricalcola_statistiche_vendite', stdout=io.StringIO())
+        self.assertEqual((celle_preventivi(), celle_appuntamenti()), incrementali)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_cruscotto_legge_solo_i_riepiloghi(self):
+        preventivo = self._crea_preventivo()
+        with self.captureOnCommitCallbacks(execute=True):
+            Preventivo.objects.filter(pk=preventivo.pk).update(stato='ACCETTATO')
+            Appuntamento.objects.create(cliente=self.cliente, data_ora=timezone.now())
+
+        with CaptureQueriesContext(connection) as query:
+            response = self.client.get(reverse('admin:statistiche_riepilogopreventivi_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Cucine Moderne')
+        self.assertEqual(response.context['conversione'][self.oggi.month - 1], 100.0)
+        tabelle_sorgente = ('preventivi_', 'clienti_appuntamento')
+        self.assertFalse([
+            q['sql'] for q in query.captured_queries
+            if any(tabella in q['sql'] for tabella in tabelle_sorgente)
+        ])